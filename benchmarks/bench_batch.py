@@ -0,0 +1,121 @@
+import argparse
+import gc
+import tracemalloc
+from dataclasses import fields, replace
+from datetime import datetime, timedelta
+from typing import Any, Callable, List
+
+from next_meeting.args import Args, Command, OutputFormat
+from next_meeting.batch import EventBatch
+from next_meeting.index import EventIndex
+from next_meeting.main import find_meeting_to_join, joinable_events
+from next_meeting.parsing import MyEvent, parse_events_details, update_event_times
+
+from .synthetic import synthetic_events
+from .timing import quiet, time_it
+
+# Memory and time for deciding what to join over big calendars: a list of
+# (slotted) MyEvents with an EventIndex, versus a columnar EventBatch. Also how
+# much the slots save over a MyEvent with a __dict__.
+#
+#   python -m benchmarks.bench_batch --sizes 10000 50000
+
+SIZES = (10_000, 50_000)
+# How many times to ask "what should I join" (every minute this many minutes)
+QUERIES = 600
+
+
+class UnslottedEvent:
+    """A MyEvent as it was before slots, with an instance __dict__"""
+
+    def __init__(self, event: MyEvent) -> None:
+        self.__dict__.update((f.name, getattr(event, f.name)) for f in fields(event))
+
+
+def parsed_events(n: int) -> List[MyEvent]:
+    # The descriptions only slow down parsing, which isn't what we're timing.
+    raw = [dict(e, description="") for e in synthetic_events(n)]
+    with quiet():
+        return parse_events_details(raw, Args(command=Command.list))
+
+
+def allocated(build: Callable[[], Any]) -> int:
+    """Bytes still allocated by whatever build returns"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del kept
+    return size
+
+
+def with_index(events: List[MyEvent]) -> Any:
+    return events, EventIndex(joinable_events(events))
+
+
+def queries(events: List[MyEvent]) -> List[datetime]:
+    start = min(e.start for e in events if e.start)
+    return [start + timedelta(minutes=m) for m in range(QUERIES)]
+
+
+def bench_size(n: int) -> None:
+    events = parsed_events(n)
+    joinable = joinable_events(events)
+    times = queries(events)
+    args = Args(command=Command.list, format=OutputFormat.alfred)
+
+    def scan() -> None:
+        # What a single run does: flag every event for now, then look.
+        for now in times[:: QUERIES // 10]:
+            args.now = now
+            find_meeting_to_join([update_event_times(e, now) for e in joinable], args)
+
+    index = EventIndex(joinable)
+    batch = EventBatch(events)
+
+    def query_index() -> None:
+        for now in times:
+            index.find_meeting_to_join(now)
+
+    def query_batch() -> None:
+        for now in times:
+            batch.find_meeting_to_join(now)
+
+    # The first two share their values with events, so they're only the cost
+    # of the objects themselves.
+    memory = [
+        ("MyEvent (no slots)", allocated(lambda: [UnslottedEvent(e) for e in events])),
+        ("MyEvent (slots)", allocated(lambda: [replace(e) for e in events])),
+        ("MyEvent + EventIndex", allocated(lambda: with_index(parsed_events(n)))),
+        ("EventBatch", allocated(lambda: EventBatch(parsed_events(n)))),
+    ]
+    for name, size in memory:
+        print(f"{name:<40} {n:>7} {size / 1e6:>10.2f}MB")
+
+    with quiet():
+        timings = [
+            ("EventIndex build", time_it(lambda: EventIndex(joinable))),
+            ("EventBatch build", time_it(lambda: EventBatch(events))),
+            ("scan (per query)", time_it(scan) / len(times[:: QUERIES // 10])),
+            ("EventIndex (per query)", time_it(query_index) / QUERIES),
+            ("EventBatch (per query)", time_it(query_batch) / QUERIES),
+        ]
+    for name, seconds in timings:
+        print(f"{name:<40} {n:>7} {seconds * 1e6:>10.1f}us")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark EventBatch")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    options = parser.parse_args()
+    print(f"{'benchmark':<40} {'events':>7} {'':>12}")
+    for n in options.sizes:
+        bench_size(n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import os
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from next_meeting import ics
+from next_meeting.args import Args, Command, OutputFormat
+from next_meeting.parsing import parse_events_details
+
+from .synthetic import synthetic_description
+from .timing import quiet, time_it
+
+# Reading an exported calendar (--ics) of increasing size where only a handful
+# of events are in the window: the time to read it grows with the file but what
+# we keep (and the memory for it), and the time to parse what we keep, don't.
+#
+#   python -m benchmarks.bench_ics --sizes 1000 10000 100000
+
+SIZES = (1_000, 10_000, 100_000)
+NOW = datetime(2021, 7, 12, 13, 0, tzinfo=timezone.utc)
+
+
+def write_calendar(path: str, n: int) -> None:
+    """n events (with long descriptions) over the last few years, a few
+    recurring ones and a few in the window"""
+    description = synthetic_description(1_000, "end").replace("\n", "\\n")
+    with open(path, "w") as f:
+        f.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\n")
+        for i in range(n):
+            start = NOW - timedelta(hours=4 * (i + 1))
+            rules = []
+            if i % 1000 == 0:
+                # Recurring since long ago, happening today
+                start = start.replace(hour=NOW.hour + 1)
+                rules.append("RRULE:FREQ=DAILY")
+            elif i < 5:
+                start = NOW + timedelta(hours=i + 1)
+            lines: List[str] = [
+                "BEGIN:VEVENT",
+                *rules,
+                f"UID:event-{i}@example.com",
+                f"DTSTART:{start:%Y%m%dT%H%M%SZ}",
+                f"DTEND:{start + timedelta(minutes=30):%Y%m%dT%H%M%SZ}",
+                "DTSTAMP:20210712T120000Z",
+                f"SUMMARY:Meeting {i}",
+                # Folded, as they would be
+                "DESCRIPTION:"
+                + "\r\n ".join(description[j : j + 74] for j in range(0, 1000, 74)),
+                "END:VEVENT",
+            ]
+            f.write("\r\n".join(lines) + "\r\n")
+        f.write("END:VCALENDAR\r\n")
+
+
+def bench_size(n: int, directory: str) -> None:
+    path = os.path.join(directory, f"calendar-{n}.ics")
+    write_calendar(path, n)
+    args = Args(command=Command.list, format=OutputFormat.alfred, now=NOW, ics=[path])
+
+    tracemalloc.start()
+    events = ics.fetch_events(args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    read = time_it(lambda: ics.fetch_events(args))
+    with quiet():
+        parse = time_it(lambda: parse_events_details(events, args))
+    size = os.path.getsize(path)
+    print(
+        f"{n:>8} {size / 1e6:>8.1f}MB {len(events):>6} {read * 1e3:>10.1f}ms"
+        f" {peak / 1e6:>8.2f}MB {parse * 1e3:>10.2f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark reading .ics files")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    options = parser.parse_args()
+    print(
+        f"{'events':>8} {'file':>10} {'kept':>6} {'read':>12} {'peak mem':>10}"
+        f" {'parse kept':>12}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for n in options.sizes:
+            bench_size(n, directory)
+
+
+if __name__ == "__main__":
+    main()
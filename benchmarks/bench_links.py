@@ -0,0 +1,61 @@
+import glob
+import json
+from typing import List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+
+from next_meeting.parsing import find_description_link, has_meeting_link
+
+from .synthetic import synthetic_description
+from .timing import time_it
+
+# Compare the single pass description link extractor against building a full
+# BeautifulSoup tree (what get_meeting_link used to do for every event).
+#
+#   python -m benchmarks.bench_links
+
+
+def bs4_link(description: str) -> Optional[str]:
+    """The old way of finding the link"""
+    soup = BeautifulSoup(description, "html.parser")
+    for link in soup.find_all("a"):
+        href = link.get("href")
+        if href and has_meeting_link(href):
+            return str(href)
+    return None
+
+
+def fixture_descriptions() -> List[Tuple[str, str]]:
+    descriptions = []
+    for path in sorted(glob.glob("tests/events/*.json")):
+        with open(path) as f:
+            event = json.load(f)
+        if "description" in event:
+            descriptions.append((path, event["description"]))
+    return descriptions
+
+
+def cases() -> List[Tuple[str, str]]:
+    all_cases = fixture_descriptions()
+    for size in (1_000, 10_000, 100_000):
+        for link_at in ("start", "end", "none"):
+            all_cases.append(
+                (
+                    f"synthetic {size}B link@{link_at}",
+                    synthetic_description(size, link_at),
+                )
+            )
+    return all_cases
+
+
+def main() -> None:
+    print(f"{'case':<40} {'extractor':>12} {'bs4':>12} {'speedup':>8}")
+    for name, description in cases():
+        assert find_description_link(description) == bs4_link(description), name
+        fast = time_it(lambda: find_description_link(description)) * 1_000_000
+        slow = time_it(lambda: bs4_link(description)) * 1_000_000
+        print(f"{name:<40} {fast:>10.1f}us {slow:>10.1f}us {slow / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import re
+from typing import List
+
+from next_meeting.providers import _by_marker, _compile
+
+from .synthetic import synthetic_description
+from .timing import time_it
+
+# How the cost of finding a meeting link grows with the number of providers:
+# one substring scan per provider marker (what has_meeting_link used to do), a
+# plain alternation of the markers and the regex providers.py builds.
+#
+#   python -m benchmarks.bench_providers
+
+PROVIDER_COUNTS = (2, 5, 10, 25, 50, 200)
+
+
+def markers(n: int) -> List[str]:
+    made_up = [f"meet{i}.example{i}.net" for i in range(n)]
+    return (list(_by_marker) + made_up)[:n]
+
+
+def main() -> None:
+    values = {
+        "location": "Conference Room 42, Building 7, 3rd floor",
+        "entry point": "tel:+1-555-0100,,123456789#",
+        "1KB description": synthetic_description(1_000, "none"),
+        "10KB description": synthetic_description(10_000, "none"),
+    }
+    print(
+        f"{'case':<24} {'providers':>9} {'scans':>12} {'alternation':>12}"
+        f" {'providers.py':>12}"
+    )
+    for name, value in values.items():
+        for n in PROVIDER_COUNTS:
+            ms = markers(n)
+            alternation = re.compile("|".join(re.escape(m) for m in ms))
+            matcher = _compile(ms)
+
+            def scans() -> bool:
+                return any(m in value for m in ms)
+
+            assert scans() == bool(alternation.search(value))
+            assert scans() == bool(matcher.search(value))
+            times = [
+                time_it(scans),
+                time_it(lambda: alternation.search(value)),
+                time_it(lambda: matcher.search(value)),
+            ]
+            print(
+                f"{name:<24} {n:>9}",
+                *(f"{t * 1_000_000:>10.2f}us" for t in times),
+            )
+
+
+if __name__ == "__main__":
+    main()
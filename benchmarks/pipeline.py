@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+import next_meeting.constants as c
+import next_meeting.parsing as parsing
+from next_meeting.alfred import ScriptFilterOutput
+from next_meeting.args import Args, Command, OutputFormat
+from next_meeting.index import EventIndex
+from next_meeting.main import find_meeting_to_join, joinable_events, render_list
+from next_meeting.parsing import get_meeting_link, parse_event_details, parse_events
+
+from .synthetic import synthetic_events
+from .timing import quiet, time_it
+
+# Benchmarks for the fetch -> parse -> decide -> serialize pipeline over
+# synthetic calendars, with fetch_events stubbed out. Results are written as
+# JSON so they can be compared between versions.
+#
+#   python -m benchmarks.pipeline --output results.json
+
+SIZES = (10, 100, 1_000, 10_000)
+# Starting a new process for each of these is slow, so only go this far.
+MAX_CLI_SIZE = 1_000
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run the CLI with fetch_events replaced by reading a dump of raw events.
+CLI_STUB = """
+import json, sys
+import next_meeting.gcal as gcal
+with open(sys.argv[1]) as f:
+    events = json.load(f)
+gcal.fetch_events = lambda args: events
+from next_meeting.main import entrypoint
+sys.argv = ["nm.py", "-c", "list", "-f", "alfred", "-n", sys.argv[2]]
+entrypoint()
+"""
+
+
+@dataclass
+class Result:
+    benchmark: str
+    events: int
+    # Best time per call
+    seconds: float
+
+
+def bench_size(n: int, workdir: str, cli: bool = True) -> List[Result]:
+    raw = synthetic_events(n)
+    args = Args(command=Command.list, format=OutputFormat.alfred)
+    args.now = datetime.fromisoformat(raw[len(raw) // 2]["start"]["dateTime"])
+
+    def fresh_parse_cache() -> None:
+        parsing._parsed_events = parsing.ParsedEventCache(c.PARSED_EVENT_CACHE_SIZE)
+
+    results: List[Result] = []
+
+    def record(name: str, fn: Any) -> None:
+        results.append(Result(name, n, time_it(fn)))
+
+    with quiet():
+        record("get_meeting_link", lambda: [get_meeting_link(e, args) for e in raw])
+        record(
+            "parse_event_details", lambda: [parse_event_details(e, args) for e in raw]
+        )
+        # Everything already parsed, in memory and on disk.
+        fresh_parse_cache()
+        events = parse_events(raw, args)
+        record("parse_events (cached)", lambda: parse_events(raw, args))
+
+        def parse_new_process() -> None:
+            # Parsed on a previous run, so only on disk.
+            fresh_parse_cache()
+            parse_events(raw, args)
+
+        record("parse_events (cached on disk)", parse_new_process)
+
+        joinable = joinable_events(events)
+        record("find_meeting_to_join", lambda: find_meeting_to_join(joinable, args))
+        record("EventIndex", lambda: EventIndex(joinable))
+        index = EventIndex(joinable)
+        record(
+            "EventIndex.find_meeting_to_join",
+            lambda: index.find_meeting_to_join(args.now),
+        )
+
+        items = [e.to_item() for e in joinable]
+        record("ScriptFilterOutput.to_json", ScriptFilterOutput(items=items).to_json)
+        record("render_list", lambda: render_list(events, args))
+
+    if cli and n <= MAX_CLI_SIZE:
+        results.append(Result("cli", n, time_cli(raw, args.now, workdir)))
+    return results
+
+
+def time_cli(raw: List[Dict[str, Any]], now: datetime, workdir: str) -> float:
+    """Best wall clock time for a fresh `nm.py -c list -f alfred`"""
+    dump = os.path.join(workdir, "events.json")
+    with open(dump, "w") as f:
+        json.dump(raw, f)
+    env = dict(os.environ, PYTHONPATH=REPO)
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", CLI_STUB, dump, now.isoformat()],
+            cwd=workdir,
+            env=env,
+            check=True,
+            capture_output=True,
+        )
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes: Sequence[int], cli: bool = True) -> Dict[str, Any]:
+    """Run every benchmark for each calendar size"""
+    results: List[Result] = []
+    event_cache_file = c.EVENT_CACHE_FILE
+    with tempfile.TemporaryDirectory() as workdir:
+        # Keep the parsed event cache out of the working directory
+        c.EVENT_CACHE_FILE = os.path.join(workdir, "events.sqlite")
+        try:
+            for n in sizes:
+                results.extend(bench_size(n, workdir, cli))
+        finally:
+            c.EVENT_CACHE_FILE = event_cache_file
+    return dict(
+        meta=dict(
+            revision=git_revision(),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            timestamp=datetime.now(tz=timezone.utc).isoformat(),
+        ),
+        results=[asdict(r) for r in results],
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the list pipeline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--no-cli", dest="cli", action="store_false")
+    parser.add_argument("-o", "--output", help="Write the results (JSON) here")
+    options = parser.parse_args()
+
+    report = run(options.sizes, options.cli)
+    for r in report["results"]:
+        print(
+            f"{r['benchmark']:<34} {r['events']:>7} {r['seconds'] * 1000:>12.3f}ms",
+            file=sys.stderr,
+        )
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+# Synthetic calendars for the benchmarks: events shaped like the raw ones google
+# hands back, with descriptions of varying sizes and the meeting link in any of
+# the places get_meeting_link looks for it.
+
+ZOOM_LINK = "https://example.zoom.us/j/12345678987?pwd=SUPERSECRET1234"
+MEET_LINK = "https://meet.google.com/abc-defg-hij"
+FILLER = (
+    "<p>Agenda item with a <a href='https://docs.example.com/doc/{i}'>doc link</a>"
+    " and some more text to make the paragraph look like a real one.</p>\n"
+)
+# Where the meeting link goes
+LINK_PLACEMENTS = (
+    "location",
+    "conference",
+    "description-start",
+    "description-end",
+    "none",
+)
+# Rough description sizes (bytes), most invites are small but recurring ones
+# tend to collect a lot of pasted text.
+DESCRIPTION_SIZES = (0, 500, 5_000, 50_000)
+DESCRIPTION_SIZE_WEIGHTS = (4, 4, 2, 1)
+
+START = datetime(2021, 7, 12, 8, 0, tzinfo=timezone.utc)
+
+
+def synthetic_description(size: int, link_at: str, link: str = ZOOM_LINK) -> str:
+    """Build a description of roughly size bytes with the meeting link placed
+    at the start, the end or nowhere"""
+    paragraphs: List[str] = []
+    total = 0
+    while total < size:
+        paragraphs.append(FILLER.format(i=len(paragraphs)))
+        total += len(paragraphs[-1])
+    anchor = f'<a href="{link}">Join Meeting</a>\n'
+    if link_at == "start":
+        paragraphs.insert(0, anchor)
+    elif link_at == "end":
+        paragraphs.append(anchor)
+    return "".join(paragraphs)
+
+
+def synthetic_event(i: int, rng: random.Random, start: datetime) -> Dict[str, Any]:
+    link = rng.choice((ZOOM_LINK, MEET_LINK))
+    placement = rng.choice(LINK_PLACEMENTS)
+    size = rng.choices(DESCRIPTION_SIZES, DESCRIPTION_SIZE_WEIGHTS)[0]
+    end = start + timedelta(minutes=rng.choice((15, 25, 30, 50, 60, 90)))
+    event: Dict[str, Any] = dict(
+        id=f"synthetic{i}",
+        etag=f'"{i}"',
+        status="confirmed",
+        summary=rng.choice(("Standup", "You and Me 1:1", "Planning", "Review")),
+        start=dict(dateTime=start.isoformat()),
+        end=dict(dateTime=end.isoformat()),
+        location="Conference Room 1",
+    )
+    description_link = "none"
+    if placement == "location":
+        event["location"] += f",{link}"
+    elif placement == "conference":
+        event["conferenceData"] = dict(entryPoints=[dict(uri=link)])
+    elif placement.startswith("description-"):
+        description_link = placement.split("-")[1]
+    if size or description_link != "none":
+        event["description"] = synthetic_description(size, description_link, link)
+    return event
+
+
+def synthetic_events(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """n events, in start order, a few minutes apart (with plenty of overlaps)"""
+    rng = random.Random(seed)
+    events = []
+    start = START
+    for i in range(n):
+        events.append(synthetic_event(i, rng, start))
+        start += timedelta(minutes=rng.choice((0, 5, 10, 30)))
+    return events
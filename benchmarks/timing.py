@@ -0,0 +1,20 @@
+import contextlib
+import io
+import timeit
+from typing import Any, Callable, Iterator
+
+
+def time_it(fn: Callable[[], Any], repeat: int = 3) -> float:
+    """Best per call time in seconds"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+@contextlib.contextmanager
+def quiet() -> Iterator[None]:
+    """Swallow the debug output so we're not timing the terminal"""
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+        io.StringIO()
+    ):
+        yield
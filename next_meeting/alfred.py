@@ -1,26 +1,72 @@
 import json
-from dataclasses import asdict, dataclass, field, is_dataclass
+from dataclasses import dataclass, field, fields, is_dataclass
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
 
 # Classes to help serialize various Alfred formats
 
 
-class EnhancedJSONEncoder(json.JSONEncoder):
-    def default(self, o: Any) -> Any:
-        if is_dataclass(o):
-            return asdict(o)
-        elif isinstance(o, datetime):
-            return o.isoformat()
-        return super().default(o)
+def to_json(o: Any, pretty: bool = False) -> str:
+    """Serialize (a tree of) our dataclasses as JSON
 
+    Compact by default, this is what Alfred reads and nobody else sees it. Uses
+    orjson when it's installed, which handles dataclasses and datetimes
+    natively, otherwise converts to plain dicts with the per-class writers below
+    and hands them to the json module."""
+    if orjson is not None:
+        return str(
+            orjson.dumps(o, option=orjson.OPT_INDENT_2 if pretty else 0), "utf-8"
+        )
+    if pretty:
+        return json.dumps(_plain(o), indent=2, ensure_ascii=False)
+    return json.dumps(_plain(o), separators=(",", ":"), ensure_ascii=False)
 
-@dataclass
+
+# Converts an instance of a dataclass to a dict of plain values, by class.
+_writers: Dict[type, Callable[[Any], Dict[str, Any]]] = {}
+
+
+def _writer(cls: type) -> Callable[[Any], Dict[str, Any]]:
+    """Build the writer for a dataclass, once
+
+    Unlike asdict this doesn't deep copy anything, it only builds the new
+    dicts and lists it has to."""
+    writer = _writers.get(cls)
+    if writer is None:
+        names = tuple(f.name for f in fields(cls))
+
+        def writer(o: Any) -> Dict[str, Any]:
+            return {name: _plain(getattr(o, name)) for name in names}
+
+        _writers[cls] = writer
+    return writer
+
+
+def _plain(o: Any) -> Any:
+    if o is None or isinstance(o, (str, bool, int, float)):
+        return o
+    if isinstance(o, list):
+        return [_plain(v) for v in o]
+    if isinstance(o, dict):
+        return {k: _plain(v) for k, v in o.items()}
+    if isinstance(o, datetime):
+        return o.isoformat()
+    if is_dataclass(o) and not isinstance(o, type):
+        return _writer(type(o))(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+@dataclass(slots=True)
 class ItemIcon:
     path: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Item:
     uid: str
     title: str
@@ -38,8 +84,8 @@ class ScriptFilterOutput:
 
     items: List[Item] = field(default_factory=list)
 
-    def to_json(self) -> str:
-        return json.dumps(self, indent=2, cls=EnhancedJSONEncoder)
+    def to_json(self, pretty: bool = False) -> str:
+        return to_json(self, pretty)
 
 
 @dataclass
@@ -70,5 +116,5 @@ class JsonUtilityFormat:
 
     alfredworkflow: AlfredWorkflow
 
-    def to_json(self) -> str:
-        return json.dumps(self, indent=2, cls=EnhancedJSONEncoder)
+    def to_json(self, pretty: bool = False) -> str:
+        return to_json(self, pretty)
@@ -1,18 +1,38 @@
 import argparse
-import sys
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from enum import Enum
+from typing import List, Optional, Sequence
+
+from . import constants as c
 
 
 class Command(Enum):
     list = "list"
     join = "join"
+    serve = "serve"
+    startup = "startup"
+    replay = "replay"
 
 
 class OutputFormat(Enum):
     stdout = "stdout"
     alfred = "alfred"
+    # One JSON object per line: each meeting, then what to join
+    ndjson = "ndjson"
+
+
+class ProfileFormat(Enum):
+    json = "json"
+    # Chrome's trace event format, viewable in chrome://tracing or Perfetto
+    chrome = "chrome"
+
+
+class LogLevel(Enum):
+    debug = "debug"
+    info = "info"
+    warning = "warning"
+    error = "error"
 
 
 class NextMeetingOptions(Enum):
@@ -33,6 +53,33 @@ class Args:
     command: Command
     format: OutputFormat = OutputFormat.stdout
     now: datetime = datetime.now(tz=timezone.utc)
+    # Ignore the local event cache and fetch everything again
+    refresh: bool = False
+    # The calendars to look for meetings in
+    calendars: List[str] = field(default_factory=lambda: list(c.CALENDAR_IDS))
+    # Parse events across this many processes (for big calendars, see
+    # parsing.parse_events_details)
+    jobs: int = 1
+    # Fetch (and parse) on asyncio, see gcal_async.py
+    use_async: bool = False
+    # Time each stage of the run and print a breakdown to stderr
+    profile: bool = False
+    # Also write the full profile here
+    profile_output: Optional[str] = None
+    profile_format: ProfileFormat = ProfileFormat.json
+    # Read events from these iCalendar files/feeds instead of google
+    ics: List[str] = field(default_factory=list)
+    # Log at this level and above...
+    log_level: LogLevel = LogLevel.warning
+    # ...to this file (rotated) instead of stdout/stderr
+    log_file: Optional[str] = None
+    # Recorded events to replay (raw API responses)
+    events_files: List[str] = field(default_factory=list)
+    # Replay every `every` minutes from now until this...
+    until: Optional[datetime] = None
+    every: int = 1
+    # ...or at exactly these times
+    at: List[datetime] = field(default_factory=list)
 
 
 def valid_datetime_type(arg_datetime_str: str) -> datetime:
@@ -44,7 +91,7 @@ def valid_datetime_type(arg_datetime_str: str) -> datetime:
         raise argparse.ArgumentTypeError(msg)
 
 
-def parse_args() -> Args:
+def parse_args(argv: Optional[Sequence[str]] = None) -> Args:
     parser = argparse.ArgumentParser(
         description="Parse your calendar looking for the next zoom meeting"
     )
@@ -72,21 +119,132 @@ def parse_args() -> Args:
         type=valid_datetime_type,
         help="Optional override time to use for 'now'",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "-r",
+        "--refresh",
+        dest="refresh",
+        action="store_true",
+        help="Ignore the local event cache and refetch from the calendar",
+    )
+    parser.add_argument(
+        "--calendar",
+        dest="calendars",
+        action="append",
+        help="Calendar id to look for meetings in, may be given more than once "
+        f"(default: {', '.join(c.CALENDAR_IDS)})",
+    )
+    parser.add_argument(
+        "--ics",
+        dest="ics",
+        action="append",
+        default=[],
+        help="An iCalendar (.ics) file or feed url to read events from instead "
+        "of google, may be given more than once",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="Parse events across this many processes, only worth it for "
+        f"{c.PARALLEL_PARSE_MIN_EVENTS}+ events (default: 1)",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Fetch calendars and parse events at the same time on asyncio "
+        "(using httpx if it's installed)",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        action="store_true",
+        help="Print how long each stage of the run took to stderr",
+    )
+    parser.add_argument(
+        "--profile-output",
+        dest="profile_output",
+        help="Write the full profile to this file (implies --profile)",
+    )
+    parser.add_argument(
+        "--profile-format",
+        dest="profile_format",
+        default=ProfileFormat.json.value,
+        choices=tuple(e.value for e in ProfileFormat),
+        help="Format for --profile-output",
+    )
+    parser.add_argument(
+        "--log-level",
+        dest="log_level",
+        default=LogLevel.warning.value,
+        choices=tuple(e.value for e in LogLevel),
+        help="Log messages at this level and above (default: warning)",
+    )
+    parser.add_argument(
+        "--log-file",
+        dest="log_file",
+        help="Log to this file (rotated) instead of stdout/stderr",
+    )
+    replay = parser.add_argument_group(
+        "replay", "Find the meeting to join over a range of times, offline"
+    )
+    replay.add_argument(
+        "--events",
+        dest="events_files",
+        action="append",
+        default=[],
+        help="Recorded events (a raw API response, list of events or single "
+        "event) to replay, may be given more than once",
+    )
+    replay.add_argument(
+        "--until",
+        dest="until",
+        type=valid_datetime_type,
+        help=f"Replay up until this time (default: {c.HOURS_AHEAD} hours after now)",
+    )
+    replay.add_argument(
+        "--every",
+        dest="every",
+        type=int,
+        default=1,
+        help="Minutes between each time replayed (default: 1)",
+    )
+    replay.add_argument(
+        "--at",
+        dest="at",
+        action="append",
+        default=[],
+        type=valid_datetime_type,
+        help="Replay at exactly this time instead, may be given more than once",
+    )
+    args = parser.parse_args(argv)
+    if args.command == Command.replay.value and not args.events_files:
+        parser.error("--events is required to replay")
+    if args.every < 1:
+        parser.error("--every must be at least 1 minute")
     return Args(
         command=Command[args.command],
         format=OutputFormat[args.format],
         now=args.now,
+        refresh=args.refresh,
+        calendars=args.calendars or list(c.CALENDAR_IDS),
+        ics=args.ics,
+        jobs=args.jobs,
+        use_async=args.use_async,
+        profile=args.profile or args.profile_output is not None,
+        profile_output=args.profile_output,
+        profile_format=ProfileFormat[args.profile_format],
+        log_level=LogLevel[args.log_level],
+        log_file=args.log_file,
+        events_files=args.events_files,
+        until=args.until,
+        every=args.every,
+        at=args.at,
     )
 
 
-def _debug(message: str, format: OutputFormat = OutputFormat.stdout) -> None:
-    if format == OutputFormat.stdout:
-        print(message)
-    else:
-        print(message, file=sys.stderr)
-
-
-def _output(message: str) -> None:
+def _output(message: str, flush: bool = False) -> None:
     "Thin wrapper around print so we can debug what we're doing"
-    print(message)
+    print(message, flush=flush)
@@ -0,0 +1,167 @@
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from . import constants as c
+from .args import NextMeetingOptions
+from .parsing import MyEvent, update_event_times
+
+# Epoch seconds standing in for a missing start/end.
+_NO_START = -(2**63)
+_NO_END = 2**63 - 1
+# UTC offset (seconds) standing in for a naive datetime.
+_NAIVE = -(2**31)
+
+
+class EventBatch:
+    """Lots of parsed events, stored column by column
+
+    Instead of a MyEvent (and two datetimes) per event, starts and ends are
+    epoch seconds in arrays and each boolean attribute is an int with a bit per
+    event. Events are kept in start order, so deciding what to join is a couple
+    of binary searches and some bitwise arithmetic on the flags. A MyEvent is
+    only built for the answer.
+
+    Answers the same questions as EventIndex, about the joinable events in the
+    batch (without having to filter them out first)."""
+
+    def __init__(
+        self, events: Iterable[MyEvent], horizon: Optional[timedelta] = None
+    ) -> None:
+        ordered = sorted(events, key=lambda e: _timestamp(e.start, _NO_START))
+        self.ids: List[str] = [e.id for e in ordered]
+        self.summaries: List[str] = [e.summary for e in ordered]
+        self.meeting_links: List[Optional[str]] = [e.meeting_link for e in ordered]
+        self.icons: List[Optional[str]] = [e.icon for e in ordered]
+        self.starts = array("q", (_timestamp(e.start, _NO_START) for e in ordered))
+        self.ends = array("q", (_timestamp(e.end, _NO_END) for e in ordered))
+        self.start_offsets = array("l", (_offset(e.start) for e in ordered))
+        self.end_offsets = array("l", (_offset(e.end) for e in ordered))
+
+        joinable = [bool(e.is_not_day_event and e.meeting_link) for e in ordered]
+        self.day_events = _bits([not e.is_not_day_event for e in ordered])
+        self.joinable = _bits(joinable)
+        # Joinable events that can be in progress: they have both a start and an
+        # end, in that order.
+        self._timed = self.joinable & _bits(
+            [bool(e.start and e.end and e.end >= e.start) for e in ordered]
+        )
+        # Nothing starting longer ago than this can still be in progress.
+        self._longest = max(
+            (self.ends[i] - self.starts[i] for i in _positions(self._timed)),
+            default=0,
+        )
+        # See EventIndex.has_candidates
+        self._horizon = horizon.total_seconds() if horizon else None
+        self._joinable_within = c.JOINABLE_IF_NEXT_STARTS_WITHIN * 60
+        self._open_until = array(
+            "q",
+            accumulate(
+                (end if j else _NO_START for end, j in zip(self.ends, joinable)),
+                max,
+            ),
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def event(self, i: int) -> MyEvent:
+        """Rebuild the i'th event (in start order)"""
+        return MyEvent(
+            id=self.ids[i],
+            start=_datetime(self.starts[i], self.start_offsets[i], _NO_START),
+            summary=self.summaries[i],
+            is_not_day_event=not self.day_events >> i & 1,
+            meeting_link=self.meeting_links[i],
+            icon=self.icons[i],
+            end=_datetime(self.ends[i], self.end_offsets[i], _NO_END),
+        )
+
+    # The public methods take datetimes, but work in epoch seconds (which is
+    # quicker than datetime arithmetic).
+
+    def in_progress(self, now: datetime) -> List[int]:
+        """Positions of the joinable events that have started and not yet
+        ended (inclusive)"""
+        return self._in_progress(now.timestamp())
+
+    def starting_soon(self, now: datetime) -> List[int]:
+        """Positions of the joinable events starting within
+        JOINABLE_IF_NEXT_STARTS_WITHIN of now"""
+        return self._starting_soon(now.timestamp())
+
+    def has_candidates(self, now: datetime) -> bool:
+        """Is there anything joinable (within the horizon) that isn't over
+        yet?"""
+        return self._has_candidates(now.timestamp())
+
+    def find_meeting_to_join(
+        self, now: datetime
+    ) -> Tuple[NextMeetingOptions, Optional[MyEvent]]:
+        """main.find_meeting_to_join, for any time"""
+        now_ts = now.timestamp()
+        for found in (self._starting_soon(now_ts), self._in_progress(now_ts)):
+            if len(found) == 1:
+                event = update_event_times(self.event(found[0]), now)
+                return NextMeetingOptions.FoundNextMeeting, event
+        if self._has_candidates(now_ts):
+            return NextMeetingOptions.MultipleOptions, None
+        return NextMeetingOptions.NoOptions, None
+
+    def _in_progress(self, now: float) -> List[int]:
+        hi = bisect_right(self.starts, now)
+        lo = bisect_left(self.starts, now - self._longest, hi=hi)
+        started = _window(self._timed, lo, hi)
+        return [i for i in _positions(started, lo) if self.ends[i] >= now]
+
+    def _starting_soon(self, now: float) -> List[int]:
+        lo = bisect_right(self.starts, now)
+        hi = bisect_left(self.starts, now + self._joinable_within, lo=lo)
+        return list(_positions(_window(self.joinable, lo, hi), lo))
+
+    def _has_candidates(self, now: float) -> bool:
+        if self._horizon is None:
+            i = len(self._open_until)
+        else:
+            i = bisect_left(self.starts, now + self._horizon)
+        return i > 0 and self._open_until[i - 1] >= now
+
+
+def _timestamp(value: Optional[datetime], missing: int) -> int:
+    return missing if value is None else math.floor(value.timestamp())
+
+
+def _offset(value: Optional[datetime]) -> int:
+    offset = value.utcoffset() if value else None
+    return _NAIVE if offset is None else int(offset.total_seconds())
+
+
+def _datetime(timestamp: int, offset: int, missing: int) -> Optional[datetime]:
+    if timestamp == missing:
+        return None
+    if offset == _NAIVE:
+        return datetime.fromtimestamp(timestamp)
+    return datetime.fromtimestamp(timestamp, timezone(timedelta(seconds=offset)))
+
+
+def _bits(flags: Sequence[bool]) -> int:
+    """A bitset, bit i set if flag i is"""
+    if not flags:
+        return 0
+    return int("".join("1" if flag else "0" for flag in reversed(flags)), 2)
+
+
+def _window(bits: int, lo: int, hi: int) -> int:
+    """Bits lo <= i < hi of a bitset, shifted down by lo"""
+    return (bits >> lo) & ((1 << (hi - lo)) - 1) if hi > lo else 0
+
+
+def _positions(bits: int, offset: int = 0) -> Iterator[int]:
+    """The positions of the set bits (plus offset), lowest first"""
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1 + offset
+        bits ^= lowest
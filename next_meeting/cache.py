@@ -0,0 +1,290 @@
+import json
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from types import TracebackType
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Type
+
+# Local, on disk store of the raw events we've fetched from google so repeat
+# invocations can skip the network entirely (or only ask for what changed).
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calendars (
+    calendar_id TEXT PRIMARY KEY,
+    sync_token TEXT,
+    window_min REAL NOT NULL,
+    window_max REAL NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    calendar_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    start REAL,
+    end REAL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (calendar_id, id)
+);
+CREATE INDEX IF NOT EXISTS events_by_start ON events (calendar_id, start);
+CREATE TABLE IF NOT EXISTS parsed_events (
+    id TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    used_at REAL NOT NULL,
+    PRIMARY KEY (id, etag)
+);
+"""
+
+
+def event_timestamp(value: Optional[Dict[str, str]]) -> Optional[float]:
+    """Convert a GCal start/end value to an epoch timestamp
+
+    All day events only have a date, which we treat as local midnight."""
+    if not value:
+        return None
+    datetime_or_date = value.get("dateTime", value.get("date"))
+    if not datetime_or_date:
+        return None
+    try:
+        return datetime.fromisoformat(datetime_or_date).timestamp()
+    except ValueError:
+        return None
+
+
+@dataclass
+class CalendarState:
+    """What we know about the last time we fetched a calendar"""
+
+    calendar_id: str
+    sync_token: Optional[str]
+    # The window (epoch seconds) the cached events are complete for.
+    window_min: float
+    window_max: float
+    # Wall clock time (epoch seconds) of the last successful fetch.
+    fetched_at: float
+
+    def covers(self, time_min: datetime, time_max: datetime) -> bool:
+        """Is the requested window entirely within what we've cached?"""
+        return (
+            self.window_min <= time_min.timestamp()
+            and time_max.timestamp() <= self.window_max
+        )
+
+    def is_fresh(self, now: float, max_age: float) -> bool:
+        return 0 <= now - self.fetched_at <= max_age
+
+
+class EventCache:
+    """SQLite backed store of raw GCal events per calendar
+
+    Alongside the events themselves we keep the window they were fetched for
+    and the nextSyncToken google handed back, so a stale cache can be brought
+    up to date with an incremental sync instead of a full fetch. It also holds
+    the parsed versions of events (see parsing.ParsedEventCache).
+
+    Reference: https://developers.google.com/calendar/api/guides/sync"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(_SCHEMA)
+
+    def __enter__(self) -> "EventCache":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def state(self, calendar_id: str) -> Optional[CalendarState]:
+        row = self._conn.execute(
+            "SELECT calendar_id, sync_token, window_min, window_max, fetched_at"
+            " FROM calendars WHERE calendar_id = ?",
+            (calendar_id,),
+        ).fetchone()
+        return CalendarState(*row) if row else None
+
+    def fresh_until(
+        self, calendar_ids: Sequence[str], max_age: float
+    ) -> Optional[float]:
+        """When the first of these calendars is due a refresh (epoch seconds)
+
+        None if any of them have never been fetched."""
+        fetched_at: List[float] = []
+        for calendar_id in calendar_ids:
+            state = self.state(calendar_id)
+            if state is None:
+                return None
+            fetched_at.append(state.fetched_at)
+        return min(fetched_at, default=time.time()) + max_age
+
+    def events(
+        self, calendar_ids: Sequence[str], time_min: datetime, time_max: datetime
+    ) -> List[Dict[str, Any]]:
+        """Return the cached events from these calendars overlapping the given
+        window
+
+        Follows the same semantics as the API's timeMin/timeMax (exclusive
+        bounds on end/start respectively) and orders by start time. An event on
+        more than one of the calendars (say you and a shared calendar are both
+        invited) is only returned once."""
+        placeholders = ", ".join("?" for _ in calendar_ids)
+        rows = self._conn.execute(
+            f"SELECT id, body FROM events WHERE calendar_id IN ({placeholders})"
+            " AND (end IS NULL OR end > ?) AND (start IS NULL OR start < ?)"
+            " ORDER BY start, id",
+            (*calendar_ids, time_min.timestamp(), time_max.timestamp()),
+        )
+        seen: Set[str] = set()
+        events: List[Dict[str, Any]] = []
+        for id, body in rows:
+            if id not in seen:
+                seen.add(id)
+                events.append(json.loads(body))
+        return events
+
+    def replace(
+        self,
+        calendar_id: str,
+        events: Iterable[Dict[str, Any]],
+        sync_token: Optional[str],
+        time_min: datetime,
+        time_max: datetime,
+        fetched_at: float,
+    ) -> None:
+        """Replace everything we know about a calendar with a full fetch"""
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM events WHERE calendar_id = ?", (calendar_id,)
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO calendars VALUES (?, ?, ?, ?, ?)",
+                (
+                    calendar_id,
+                    sync_token,
+                    time_min.timestamp(),
+                    time_max.timestamp(),
+                    fetched_at,
+                ),
+            )
+            self._upsert(calendar_id, events)
+
+    def extend(
+        self,
+        calendar_id: str,
+        events: Iterable[Dict[str, Any]],
+        sync_token: Optional[str],
+        time_max: datetime,
+    ) -> None:
+        """Add the next page of a full fetch (started with replace), which we
+        now have everything up to time_max for"""
+        with self._conn:
+            self._conn.execute(
+                "UPDATE calendars SET sync_token = ?, window_max = ?"
+                " WHERE calendar_id = ?",
+                (sync_token, time_max.timestamp(), calendar_id),
+            )
+            self._upsert(calendar_id, events)
+
+    def apply_changes(
+        self,
+        calendar_id: str,
+        changes: Iterable[Dict[str, Any]],
+        sync_token: Optional[str],
+        fetched_at: float,
+    ) -> None:
+        """Apply the results of an incremental sync
+
+        Cancelled events, and anything that moved out of the cached window, are
+        removed. Everything else is inserted or updated."""
+        state = self.state(calendar_id)
+        if state is None:
+            raise ValueError(f"No cached state for calendar {calendar_id}")
+        keep: List[Dict[str, Any]] = []
+        with self._conn:
+            for event in changes:
+                start = event_timestamp(event.get("start"))
+                end = event_timestamp(event.get("end"))
+                in_window = (end is None or end > state.window_min) and (
+                    start is None or start < state.window_max
+                )
+                if event.get("status") == "cancelled" or not in_window:
+                    self._conn.execute(
+                        "DELETE FROM events WHERE calendar_id = ? AND id = ?",
+                        (calendar_id, event["id"]),
+                    )
+                else:
+                    keep.append(event)
+            self._upsert(calendar_id, keep)
+            self._conn.execute(
+                "UPDATE calendars SET sync_token = ?, fetched_at = ?"
+                " WHERE calendar_id = ?",
+                (sync_token, fetched_at, calendar_id),
+            )
+
+    def parsed_events(
+        self, keys: Iterable[Tuple[str, str]], version: int
+    ) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """Look up previously parsed events by (id, etag)
+
+        Anything parsed by a different version of the parser is ignored."""
+        found: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        with self._conn:
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT body FROM parsed_events"
+                    " WHERE id = ? AND etag = ? AND version = ?",
+                    (*key, version),
+                ).fetchone()
+                if row:
+                    found[key] = json.loads(row[0])
+            self._conn.executemany(
+                "UPDATE parsed_events SET used_at = ? WHERE id = ? AND etag = ?",
+                ((time.time(), *key) for key in found),
+            )
+        return found
+
+    def save_parsed_events(
+        self,
+        events: Dict[Tuple[str, str], Dict[str, Any]],
+        version: int,
+        max_size: int,
+    ) -> None:
+        """Store parsed events, keeping only the max_size most recently used"""
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO parsed_events VALUES (?, ?, ?, ?, ?)",
+                (
+                    (id, etag, version, json.dumps(body), now)
+                    for (id, etag), body in events.items()
+                ),
+            )
+            self._conn.execute(
+                "DELETE FROM parsed_events WHERE rowid NOT IN"
+                " (SELECT rowid FROM parsed_events ORDER BY used_at DESC LIMIT ?)",
+                (max_size,),
+            )
+
+    def _upsert(self, calendar_id: str, events: Iterable[Dict[str, Any]]) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?)",
+            (
+                (
+                    calendar_id,
+                    event["id"],
+                    event_timestamp(event.get("start")),
+                    event_timestamp(event.get("end")),
+                    json.dumps(event),
+                )
+                for event in events
+            ),
+        )
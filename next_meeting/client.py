@@ -0,0 +1,32 @@
+import json
+import os
+import socket
+from typing import List, Optional
+
+from . import constants as c
+
+# Thin client for the daemon (see daemon.py). This is imported by nm.py before
+# anything else so it must stay cheap: standard library only.
+
+
+def request_output(argv: List[str], path: str = c.DAEMON_SOCKET) -> Optional[str]:
+    """Ask a running daemon to handle these command line arguments
+
+    Returns what should be printed, or None if there's no daemon or it
+    couldn't handle the request, in which case the caller should do the work
+    itself."""
+    # Help is printed by argparse wherever it's parsed, so that's on us.
+    if not os.path.exists(path) or "-h" in argv or "--help" in argv:
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(c.DAEMON_CLIENT_TIMEOUT_SECONDS)
+            sock.connect(path)
+            sock.sendall(json.dumps(dict(argv=argv)).encode() + b"\n")
+            with sock.makefile("rb") as f:
+                response = json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+    if not response.get("ok"):
+        return None
+    return str(response["output"])
@@ -1,13 +1,74 @@
 # How many hours ahead worth of events should we fetch.
 HOURS_AHEAD = 9
-# How many calendar events to fetch at a time.
-NUM_NEXT = 5
+# The calendars to fetch events from (override with --calendar).
+CALENDAR_IDS = ["primary"]
+# How many calendars to fetch at once.
+FETCH_WORKERS = 4
+# Where the calendar API lives, for fetching without googleapiclient (--async).
+CALENDAR_API_URL = "https://www.googleapis.com/calendar/v3/"
+# How many events to ask for at a time when streaming a calendar (see
+# gcal.iter_events), small so the first of them arrive quickly.
+STREAM_PAGE_SIZE = 10
+# How long to wait on a calendar before giving up on it.
+FETCH_TIMEOUT_SECONDS = 10
+# Where we cache fetched events between runs (sqlite).
+EVENT_CACHE_FILE = "events.sqlite"
+# Serve events straight from the cache (no network at all) if it was refreshed
+# within this many seconds. Past this we ask google for what has changed.
+EVENT_CACHE_MAX_AGE_SECONDS = 60
+# Fetch (and cache) this many hours past HOURS_AHEAD, so later runs (whose
+# window ends later) can keep using the cache and syncing just the changes.
+EVENT_CACHE_EXTRA_HOURS = 12
 # Mark this event as joinable if it starts within this many minutes...used to
 # skip the current in-progress meeting for cases where a meeting ends at 10am
 # and the next one starts at 10am and you want to join the next one at 9:59am.
 JOINABLE_IF_NEXT_STARTS_WITHIN = 3
-# If true, this will dump the raw data we get back from the API
+# If true (and logging at debug, see --log-level), this will dump the raw data
+# we get back from the API
 DEBUG_RAW_EVENTS = True
 # Scopes requested when authenticating against google api
-# If modifying these scopes, delete the file token.pickle.
+# If modifying these scopes, delete the file token.json.
 SCOPES = ["https://www.googleapis.com/auth/calendar.readonly"]
+# How many parsed events to keep (in memory and in the event cache) so
+# unchanged events don't need to be parsed again.
+PARSED_EVENT_CACHE_SIZE = 1000
+# Where your google credentials are saved between runs.
+TOKEN_FILE = "token.json"
+# Where older versions saved them (pickled), these are converted to TOKEN_FILE.
+LEGACY_TOKEN_FILE = "token.pickle"
+# Refresh the access token ahead of time (on another process, or in the
+# daemon) once it's this close to expiring...
+TOKEN_REFRESH_MARGIN_SECONDS = 600
+# ...giving a background refresh this long before another is started.
+TOKEN_REFRESH_TIMEOUT_SECONDS = 60
+# Calendar API discovery document. Optional, if this doesn't exist we use the
+# one bundled with googleapiclient (downloading it here if there isn't one).
+DISCOVERY_DOC_FILE = "calendar-v3-discovery.json"
+# Unix socket the background daemon (-c serve) listens on.
+DAEMON_SOCKET = "next-meeting.sock"
+# How often the daemon re-fetches and re-parses the calendar...
+DAEMON_REFRESH_SECONDS = 60
+# ...fetching this many minutes past HOURS_AHEAD, so it can answer for the time
+# until the next refresh (and a few more if they fail).
+DAEMON_EXTRA_MINUTES = 15
+# How long nm.py waits on the daemon before doing the work itself.
+DAEMON_CLIENT_TIMEOUT_SECONDS = 1.0
+# Where iCalendar feeds (--ics with a url) are downloaded to...
+ICS_FEED_DIR = "ics-feeds"
+# ...and how long a download is used for before fetching the feed again.
+ICS_FEED_MAX_AGE_SECONDS = 300
+# Where the rendered Alfred output is saved for repeat runs, until the next
+# time it could change.
+PAYLOAD_CACHE_FILE = "alfred-payload.json"
+# Where the joinable events from the last refresh are saved (binary, see
+# snapshot.py) for runs the payload can't answer.
+SNAPSHOT_FILE = "events.snapshot"
+# With --jobs, only parse in parallel when there are at least this many events
+# to parse...
+PARALLEL_PARSE_MIN_EVENTS = 500
+# ...sending them to each process this many at a time.
+PARALLEL_PARSE_CHUNK_SIZE = 100
+# With --log-file, start a new log once it reaches this size...
+LOG_FILE_MAX_BYTES = 1_000_000
+# ...keeping this many old ones.
+LOG_FILE_BACKUPS = 3
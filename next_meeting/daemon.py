@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import socketserver
+import threading
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import constants as c
+from . import ics, snapshot
+from .args import Args, Command, parse_args
+from .gcal import fetch_events, refresh_expiring_creds
+from .index import EventIndex
+from .main import events_expire_at, joinable_events, render_list
+from .parsing import MyEvent, parse_events, update_event_times
+
+logger = logging.getLogger(__name__)
+
+# Long-running mode that keeps the parsed calendar in memory and answers
+# nm.py over a unix socket (see client.py for the other side).
+
+
+class EventStore:
+    """Holds the most recently parsed events, refreshed on a schedule"""
+
+    def __init__(self, args: Args) -> None:
+        self.args = args
+        self._events: List[MyEvent] = []
+        self.index = EventIndex([])
+        # The window the events were fetched for, none until the first refresh
+        self._window: Optional[Tuple[float, float]] = None
+        self._lock = threading.Lock()
+
+    def refresh(self, now: Optional[datetime] = None) -> None:
+        """Fetch and parse the calendar as of now (by default, right now)"""
+        args = replace(self.args, now=now or datetime.now(tz=timezone.utc))
+        # Past HOURS_AHEAD, so we can answer for a while after this (until the
+        # next refresh, or a few more if they fail).
+        window_max = args.now + timedelta(
+            hours=c.HOURS_AHEAD, minutes=c.DAEMON_EXTRA_MINUTES
+        )
+        if args.ics:
+            raw = ics.fetch_events(args, window_max)
+        else:
+            raw = fetch_events(args, window_max)
+        events = parse_events(raw, args)
+        joinable = joinable_events(events)
+        # Like the events, only as far ahead as nm.py would have fetched.
+        index = EventIndex(joinable, horizon=timedelta(hours=c.HOURS_AHEAD))
+        with self._lock:
+            self._events = events
+            self.index = index
+            self._window = (args.now.timestamp(), window_max.timestamp())
+        if not args.ics:
+            # For nm.py to answer from if we go away, just the window it
+            # would have fetched itself.
+            expires_at = events_expire_at(args)
+            if expires_at is not None:
+                snapshot.save(args, _starting_before(joinable, args.now), expires_at)
+
+    def events_at(self, now: datetime) -> List[MyEvent]:
+        """Copies of the current events with their time based attributes
+        updated for the given time"""
+        with self._lock:
+            events = self._events
+        return _events_at(events, now)
+
+    def render(self, argv: List[str]) -> str:
+        """Produce exactly what nm.py would have printed for these arguments"""
+        args = parse_args(argv)
+        if args.command != Command.list:
+            raise ValueError(f"Can't serve the {args.command.value} command")
+        with self._lock:
+            events, index, window = self._events, self.index, self._window
+        # We only have our own calendars, as of the last refresh.
+        if args.calendars != self.args.calendars or args.ics != self.args.ics:
+            raise ValueError("Can't serve other calendars")
+        if args.refresh:
+            raise ValueError("Can't serve a refresh")
+        # Anything logged would end up in our log, not theirs.
+        if (args.log_level, args.log_file) != (self.args.log_level, self.args.log_file):
+            raise ValueError("Can't serve other logging")
+        window_max = args.now + timedelta(hours=c.HOURS_AHEAD)
+        if (
+            window is None
+            or args.now.timestamp() < window[0]
+            or window_max.timestamp() > window[1]
+        ):
+            raise ValueError(f"Can't serve {args.now}, it's outside of our window")
+        events = _starting_before(_events_at(events, args.now), args.now)
+        return render_list(events, args, index)
+
+
+def _events_at(events: List[MyEvent], now: datetime) -> List[MyEvent]:
+    return [
+        update_event_times(replace(e), now)
+        for e in events
+        if not (e.end and e.end < now)
+    ]
+
+
+def _starting_before(events: List[MyEvent], now: datetime) -> List[MyEvent]:
+    """The events nm.py would have fetched as of now, the ones starting within
+    HOURS_AHEAD"""
+    window_max = now + timedelta(hours=c.HOURS_AHEAD)
+    return [e for e in events if not (e.start and e.start >= window_max)]
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "DaemonServer"
+
+    def handle(self) -> None:
+        response: Dict[str, Any]
+        try:
+            request = json.loads(self.rfile.readline())
+            response = dict(ok=True, output=self.server.store.render(request["argv"]))
+        except (Exception, SystemExit) as e:
+            # SystemExit comes from argparse, let the client deal with it.
+            response = dict(ok=False, error=str(e))
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, store: EventStore) -> None:
+        self.store = store
+        # Clean up after a previous daemon that didn't shut down cleanly.
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, _Handler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.server_address):  # type: ignore[arg-type]
+            os.unlink(self.server_address)  # type: ignore[arg-type]
+
+
+def _refresh_loop(store: EventStore, stop: threading.Event) -> None:
+    while not stop.wait(c.DAEMON_REFRESH_SECONDS):
+        try:
+            refresh_expiring_creds()
+            store.refresh()
+        except Exception as e:
+            # Keep serving what we have, we'll try again next time around.
+            logger.warning("Error refreshing events: %s", e)
+
+
+def serve(args: Args) -> None:
+    """Implement the serve command"""
+    store = EventStore(args)
+    store.refresh()
+
+    stop = threading.Event()
+    refresher = threading.Thread(
+        target=_refresh_loop, args=(store, stop), name="refresh", daemon=True
+    )
+    refresher.start()
+    with DaemonServer(c.DAEMON_SOCKET, store) as server:
+        logger.info("Listening on %s", c.DAEMON_SOCKET)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
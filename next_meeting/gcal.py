@@ -1,89 +1,682 @@
+import heapq
 import json
+import logging
 import os.path
 import pickle
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
-
-from google.auth.exceptions import RefreshError
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 
 from . import constants as c
-from .args import Args, _debug
+from .args import Args
+from .cache import EventCache, event_timestamp
+from .parsing import EVENT_FIELDS
+from .profiling import profiled, span
+from .transport import auth_request, http_pool
+
+logger = logging.getLogger(__name__)
+
+# NOTE: the google client libraries are slow to import so they are only
+# imported on the code paths that actually talk to google. A fresh cache means
+# we never pay for them at all.
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+
+# Only ask google for the parts of events we use: what we parse, plus whether
+# it's been cancelled (which a sync uses to tell us an event was deleted).
+# Attendees, reminders and the like can be most of a big calendar's response.
+LIST_FIELDS = "nextPageToken,nextSyncToken,items({})".format(
+    ",".join(EVENT_FIELDS + ("status",))
+)
+
+
+@profiled("fetch_events")
+def fetch_events(args: Args, until: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Fetch every upcoming event from all of our calendars, in start order,
+    going through the local event cache
+
+    The window is from args.now until HOURS_AHEAD later (or until, if given).
+
+    If a calendar's cache was refreshed recently we never touch the network for
+    it. Otherwise we ask google for what changed since the last fetch (using the
+    sync token), or for the whole window if there's nothing usable cached.
+    Calendars that need fetching are fetched concurrently, then everything is
+    read back (in order) from the cache. See iter_events for when you might
+    not need the whole window."""
+    time_min, time_max, window_max = fetch_window(args, until)
+    with EventCache(c.EVENT_CACHE_FILE) as cache:
+        stale = stale_calendars(cache, args, time_min, time_max)
+        if stale:
+            creds = fetch_creds()
+            service = _get_service(creds)
+            executor = ThreadPoolExecutor(max_workers=min(c.FETCH_WORKERS, len(stale)))
+            try:
+                for fetched in _fetch_calendars(
+                    executor, service, creds, stale, time_min, window_max, args
+                ):
+                    fetched.save(cache, time_min, window_max)
+            finally:
+                # Don't hang around waiting on stragglers
+                executor.shutdown(wait=False, cancel_futures=True)
+        return cache.events(args.calendars, time_min, time_max)
+
+
+def iter_events(
+    args: Args, until: Optional[datetime] = None
+) -> Iterator[Dict[str, Any]]:
+    """Lazily yield the upcoming events from all of our calendars, in start
+    order, going through the local event cache
+
+    As fetch_events, except calendars with nothing usable cached are streamed
+    from google a page at a time (see _stream_calendar), so a caller that stops
+    early (find_meeting_to_join, say) never waits on the pages it doesn't need.
+    Those are fetched in start order, which google hands back no sync token
+    for, so they're fetched in full again once they're stale. Calendars with a
+    sync token are brought up to date (concurrently with the first page of the
+    rest) before anything is yielded."""
+    time_min, time_max, window_max = fetch_window(args, until)
+    with EventCache(c.EVENT_CACHE_FILE) as cache:
+        stale = stale_calendars(cache, args, time_min, time_max)
+        if not stale:
+            yield from cache.events(args.calendars, time_min, time_max)
+            return
+
+        creds = fetch_creds()
+        service = _get_service(creds)
+        executor = ThreadPoolExecutor(max_workers=min(c.FETCH_WORKERS, len(stale)))
+        try:
+            streams: List[Iterator[Dict[str, Any]]] = [
+                _stream_calendar(
+                    executor,
+                    service,
+                    creds,
+                    calendar_id,
+                    cache,
+                    time_min,
+                    window_max,
+                    args,
+                )
+                for calendar_id, sync_token in stale.items()
+                if sync_token is None
+            ]
+            incremental: Dict[str, Optional[str]] = {
+                calendar_id: sync_token
+                for calendar_id, sync_token in stale.items()
+                if sync_token
+            }
+            if incremental:
+                for fetched in _fetch_calendars(
+                    executor, service, creds, incremental, time_min, window_max, args
+                ):
+                    fetched.save(cache, time_min, window_max)
+            streamed = set(stale) - set(incremental)
+            cached = [
+                calendar_id
+                for calendar_id in args.calendars
+                if calendar_id not in streamed
+            ]
+            if cached:
+                streams.append(iter(cache.events(cached, time_min, time_max)))
+            yield from _merge_by_start(streams, time_max)
+        finally:
+            # Don't hang around waiting on stragglers
+            executor.shutdown(wait=False, cancel_futures=True)
 
 
-def fetch_events(args: Args) -> List[Dict[str, str]]:
-    creds = _fetch_creds()
-    service = build("calendar", "v3", credentials=creds)
+def fetch_window(
+    args: Args, until: Optional[datetime]
+) -> Tuple[datetime, datetime, datetime]:
+    """The window we want events for (args.now until HOURS_AHEAD later, or
+    until), and where to fetch until for the cache"""
+    time_min: datetime = args.now
+    time_max: datetime = until or args.now + timedelta(hours=c.HOURS_AHEAD)
+    # What we fetch (and cache) runs on past the window we want, so the cache
+    # still covers the window of runs a little later on.
+    window_max = time_max + timedelta(hours=c.EVENT_CACHE_EXTRA_HOURS)
+    return time_min, time_max, window_max
 
-    # Call the Calendar API
-    now: datetime = args.now
-    time_min: str = now.isoformat()
-    time_max: str = (now + timedelta(hours=c.HOURS_AHEAD)).isoformat()
-    _debug(
-        f"Getting the upcoming {c.NUM_NEXT} events from {time_min} to {time_max}",
-        args.format,
+
+def stale_calendars(
+    cache: EventCache, args: Args, time_min: datetime, time_max: datetime
+) -> Dict[str, Optional[str]]:
+    """The calendars we need to go to google for, along with their sync token
+    (None for a full fetch)"""
+    stale: Dict[str, Optional[str]] = {}
+    for calendar_id in args.calendars:
+        state = cache.state(calendar_id)
+        if args.refresh or not state or not state.covers(time_min, time_max):
+            stale[calendar_id] = None
+        elif state.is_fresh(time.time(), c.EVENT_CACHE_MAX_AGE_SECONDS):
+            logger.debug("Using cached events for %s", calendar_id)
+        else:
+            stale[calendar_id] = state.sync_token
+    return stale
+
+
+@dataclass
+class Fetched:
+    """The result of going to google for a single calendar"""
+
+    calendar_id: str
+    events: List[Dict[str, Any]]
+    sync_token: Optional[str]
+    fetched_at: float
+    # A full fetch (replaces the cache) or just the changes since the last one
+    full: bool
+
+    def save(self, cache: EventCache, time_min: datetime, time_max: datetime) -> None:
+        if self.full:
+            cache.replace(
+                self.calendar_id,
+                self.events,
+                self.sync_token,
+                time_min,
+                time_max,
+                self.fetched_at,
+            )
+        else:
+            cache.apply_changes(
+                self.calendar_id, self.events, self.sync_token, self.fetched_at
+            )
+
+
+def _stream_calendar(
+    executor: ThreadPoolExecutor,
+    service: Any,
+    creds: Optional["Credentials"],
+    calendar_id: str,
+    cache: EventCache,
+    time_min: datetime,
+    time_max: datetime,
+    args: Args,
+) -> Iterator[Dict[str, Any]]:
+    """Stream a calendar from google a page (of STREAM_PAGE_SIZE events, in
+    start order) at a time
+
+    The first page is asked for right away, so several calendars are fetched
+    at once, but each page after that only once the caller has worked through
+    the one before. Every page is cached as it arrives, along with how far the
+    cache is now complete. A page that takes longer than FETCH_TIMEOUT_SECONDS
+    ends the stream there."""
+    logger.debug(
+        "Streaming the upcoming events in %s from %s to %s",
+        calendar_id,
+        time_min,
+        time_max,
     )
-    events_result = (
-        service.events()
-        .list(
-            calendarId="primary",
-            timeMin=time_min,
-            timeMax=time_max,
-            maxResults=c.NUM_NEXT,
-            singleEvents=True,
-            orderBy="startTime",
-        )
-        .execute()
+    fetched_at = time.time()
+    kwargs: Dict[str, Any] = dict(
+        timeMin=time_min.isoformat(),
+        timeMax=time_max.isoformat(),
+        maxResults=c.STREAM_PAGE_SIZE,
+        orderBy="startTime",
     )
-    if c.DEBUG_RAW_EVENTS:
-        _debug("----------", args.format)
-        _debug("Dumping raw results from google api", args.format)
-        _debug(events_result, args.format)
-        _debug("Again, in JSON", args.format)
-        _debug(json.dumps(events_result), args.format)
-        _debug("----------", args.format)
-    events: List[Dict[str, str]] = events_result.get("items", [])
-    return events
-
-
-def _fetch_creds() -> Optional[Credentials]:
-    """Attempts to load credentials from a pickle otherwise logs you in to get a
-    token"""
-    creds: Optional[Credentials] = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists("token.pickle"):
-        with open("token.pickle", "rb") as token:
-            creds = pickle.load(token)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        re_auth = True
+    first = executor.submit(_list_page, service, creds, calendar_id, args, **kwargs)
 
-        if creds and creds.expired and creds.refresh_token:
-            # this may fail if the request token has a short ttl, so treat it as a
-            # re-auth flow.
+    def stream() -> Iterator[Dict[str, Any]]:
+        future = first
+        streamed = Streamed(calendar_id, time_min, time_max, fetched_at)
+        while True:
             try:
-                creds.refresh(Request())
-                # Made it this far, no need to re-auth
-                re_auth = False
-            except RefreshError as e:
-                if "Token has been expired or revoked" in str(e):
-                    _debug("Token expired, time to reauth", e)
-                    re_auth = True
-                else:
-                    raise
-
-        if re_auth:
-            flow: InstalledAppFlow = InstalledAppFlow.from_client_secrets_file(
-                "credentials.json", c.SCOPES
+                page = future.result(timeout=c.FETCH_TIMEOUT_SECONDS)
+            except TimeoutError:
+                logger.warning("Timed out fetching events for %s", calendar_id)
+                return
+            streamed.save(cache, page)
+            yield from page.get("items", [])
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                return
+            future = executor.submit(
+                _list_page,
+                service,
+                creds,
+                calendar_id,
+                args,
+                pageToken=page_token,
+                **kwargs,
+            )
+
+    return stream()
+
+
+def _merge_by_start(
+    streams: List[Iterator[Dict[str, Any]]], time_max: datetime
+) -> Iterator[Dict[str, Any]]:
+    """Merge start ordered streams of events, up to time_max, dropping events
+    that appear in more than one (say you and a shared calendar are both
+    invited)"""
+    until = time_max.timestamp()
+    seen: Set[str] = set()
+    for event in heapq.merge(*streams, key=start_key):
+        if start_key(event) >= until:
+            # The streams carry on past the window, for the cache
+            return
+        if event["id"] not in seen:
+            seen.add(event["id"])
+            yield event
+
+
+def start_key(event: Dict[str, Any]) -> float:
+    """An event's start (epoch seconds), for ordering by"""
+    timestamp = event_timestamp(event.get("start"))
+    return float("-inf") if timestamp is None else timestamp
+
+
+@dataclass
+class Streamed:
+    """A calendar being fetched from google a page at a time, in start order,
+    and cached as each page arrives"""
+
+    calendar_id: str
+    time_min: datetime
+    time_max: datetime
+    fetched_at: float
+    # Everything starting before this has been fetched (and cached), None until
+    # the first page is in.
+    complete_until: Optional[datetime] = None
+
+    def save(self, cache: EventCache, page: Dict[str, Any]) -> None:
+        items: List[Dict[str, Any]] = page.get("items", [])
+        first = self.complete_until is None
+        complete_until = self.complete_until or self.time_min
+        last_start = event_timestamp(items[-1].get("start")) if items else None
+        if not page.get("nextPageToken"):
+            complete_until = self.time_max
+        elif last_start is not None:
+            complete_until = datetime.fromtimestamp(last_start, timezone.utc)
+        sync_token = page.get("nextSyncToken")
+        if first:
+            cache.replace(
+                self.calendar_id,
+                items,
+                sync_token,
+                self.time_min,
+                complete_until,
+                self.fetched_at,
+            )
+        else:
+            cache.extend(self.calendar_id, items, sync_token, complete_until)
+        self.complete_until = complete_until
+
+
+def _fetch_calendars(
+    executor: ThreadPoolExecutor,
+    service: Any,
+    creds: Optional["Credentials"],
+    sync_tokens: Dict[str, Optional[str]],
+    time_min: datetime,
+    time_max: datetime,
+    args: Args,
+) -> List[Fetched]:
+    """Fetch several calendars at once, given their sync tokens (None for a
+    full fetch)
+
+    Each calendar is given FETCH_TIMEOUT_SECONDS, any that don't make it are
+    skipped (and left as they are in the cache)."""
+    futures = {
+        executor.submit(
+            _fetch_calendar,
+            service,
+            creds,
+            calendar_id,
+            sync_token,
+            time_min,
+            time_max,
+            args,
+        ): calendar_id
+        for calendar_id, sync_token in sync_tokens.items()
+    }
+    done, not_done = wait(futures, timeout=c.FETCH_TIMEOUT_SECONDS)
+    for future in not_done:
+        logger.warning("Timed out fetching events for %s", futures[future])
+    # Keep the results in the order the calendars were given to us
+    return [f.result() for f in futures if f in done]
+
+
+def _fetch_calendar(
+    service: Any,
+    creds: Optional["Credentials"],
+    calendar_id: str,
+    sync_token: Optional[str],
+    time_min: datetime,
+    time_max: datetime,
+    args: Args,
+) -> Fetched:
+    """Fetch what changed in a calendar since we last synced it, or the whole
+    window if we never have
+
+    A full fetch isn't ordered by start time (we order what's cached when we
+    read it) as google only hands back a sync token for unordered results."""
+    from googleapiclient.errors import HttpError
+
+    fetched_at = time.time()
+    if sync_token:
+        logger.debug("Getting the events changed in %s", calendar_id)
+        try:
+            changes, next_sync_token = _list_all(
+                service, creds, calendar_id, args, syncToken=sync_token
+            )
+            return Fetched(calendar_id, changes, next_sync_token, fetched_at, False)
+        except HttpError as e:
+            # 410 GONE means the sync token is no longer valid and we need to
+            # start over.
+            if e.resp.status != 410:
+                raise
+            logger.info("Sync token expired, doing a full fetch")
+
+    logger.debug(
+        "Getting the upcoming events in %s from %s to %s",
+        calendar_id,
+        time_min,
+        time_max,
+    )
+    events, next_sync_token = _list_all(
+        service,
+        creds,
+        calendar_id,
+        args,
+        timeMin=time_min.isoformat(),
+        timeMax=time_max.isoformat(),
+    )
+    return Fetched(calendar_id, events, next_sync_token, fetched_at, True)
+
+
+def _list_all(
+    service: Any,
+    creds: Optional["Credentials"],
+    calendar_id: str,
+    args: Args,
+    **kwargs: Any,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Call events().list following every page
+
+    Returns all the events along with the nextSyncToken (which google only
+    hands back on the last page)."""
+    events: List[Dict[str, Any]] = []
+    while True:
+        events_result = _list_page(service, creds, calendar_id, args, **kwargs)
+        events.extend(events_result.get("items", []))
+        kwargs["pageToken"] = events_result.get("nextPageToken")
+        if not kwargs["pageToken"]:
+            return events, events_result.get("nextSyncToken")
+
+
+def _list_page(
+    service: Any,
+    creds: Optional["Credentials"],
+    calendar_id: str,
+    args: Args,
+    **kwargs: Any,
+) -> Dict[str, Any]:
+    """Fetch a single page of events
+
+    Just the fields we use (LIST_FIELDS). googleapiclient also asks for the
+    response to be gzipped, which (for google) takes both the accept-encoding
+    header and "(gzip)" in the user agent."""
+    # The service itself isn't thread safe, but it's fine to share as long as
+    # each thread makes its requests over its own connection.
+    with span("events.list"), http_pool().connection() as http:
+        events_result: Dict[str, Any] = (
+            service.events()
+            .list(
+                calendarId=calendar_id,
+                singleEvents=True,
+                fields=LIST_FIELDS,
+                **kwargs,
             )
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open("token.pickle", "wb") as token:
-            pickle.dump(creds, token)
+            .execute(http=_authorized_http(creds, http))
+        )
+    # Checked up front so there's nothing to pay for unless we're debugging
+    if c.DEBUG_RAW_EVENTS and logger.isEnabledFor(logging.DEBUG):
+        debug_raw_events(events_result)
+    return events_result
+
 
+@profiled("debug raw events")
+def debug_raw_events(events_result: Dict[str, Any]) -> None:
+    logger.debug("Raw results from google api: %s", json.dumps(events_result))
+
+
+def _authorized_http(creds: Optional["Credentials"], http: Any) -> Any:
+    import google_auth_httplib2
+
+    return google_auth_httplib2.AuthorizedHttp(creds, http=http)
+
+
+# Built services, keyed by the identity of the credentials they were built with.
+_services: Dict[Tuple[Optional[str], Optional[str]], Any] = {}
+# The parsed discovery document, see _discovery_document.
+_discovery_doc: Optional[Dict[str, Any]] = None
+
+
+def _discovery_document() -> Dict[str, Any]:
+    """Load the Calendar API discovery document without hitting the network
+
+    We look for it on disk first (DISCOVERY_DOC_FILE), then fall back to the
+    copy bundled with googleapiclient. Only if neither exists do we download it,
+    saving it to disk for next time."""
+    global _discovery_doc
+    if _discovery_doc is None:
+        if os.path.exists(c.DISCOVERY_DOC_FILE):
+            with open(c.DISCOVERY_DOC_FILE) as f:
+                doc = f.read()
+        else:
+            from googleapiclient.discovery_cache import get_static_doc
+
+            doc = get_static_doc("calendar", "v3")
+            if doc is None:
+                from urllib.request import urlopen
+
+                from googleapiclient.discovery import DISCOVERY_URI
+
+                url = DISCOVERY_URI.format(api="calendar", apiVersion="v3")
+                with urlopen(url) as response:
+                    doc = response.read().decode()
+                with open(c.DISCOVERY_DOC_FILE, "w") as f:
+                    f.write(doc)
+        _discovery_doc = json.loads(doc)
+    return _discovery_doc
+
+
+@profiled("_get_service")
+def _get_service(creds: Optional["Credentials"]) -> Any:
+    """Build (or reuse) the calendar service for these credentials
+
+    Building the service constructs a large tree of resource objects from the
+    discovery document, so we only do it once per set of credentials."""
+    key = (
+        getattr(creds, "client_id", None),
+        getattr(creds, "refresh_token", None),
+    )
+    service = _services.get(key)
+    if service is None:
+        from googleapiclient.discovery import build_from_document
+
+        service = build_from_document(_discovery_document(), credentials=creds)
+        _services[key] = service
+    return service
+
+
+@profiled("fetch_creds")
+def fetch_creds() -> Optional["Credentials"]:
+    """Attempts to load saved credentials otherwise logs you in to get a token
+
+    Valid credentials that are about to expire are refreshed by another
+    process (see _refresh_in_background) while we carry on with these."""
+    from google.auth.exceptions import RefreshError
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    creds: Optional[Credentials] = _load_creds()
+    if creds and creds.valid:
+        if _expires_soon(creds):
+            _refresh_in_background()
+        return creds
+
+    # If there are no (valid) credentials available, let the user log in.
+    re_auth = True
+
+    if creds and creds.expired and creds.refresh_token:
+        # this may fail if the request token has a short ttl, so treat it as a
+        # re-auth flow.
+        try:
+            _refresh(creds)
+            # Made it this far, no need to re-auth
+            re_auth = False
+        except RefreshError as e:
+            if "Token has been expired or revoked" in str(e):
+                logger.info("Token expired, time to reauth: %s", e)
+                re_auth = True
+            else:
+                raise
+
+    if re_auth:
+        flow: InstalledAppFlow = InstalledAppFlow.from_client_secrets_file(
+            "credentials.json", c.SCOPES
+        )
+        creds = flow.run_local_server(port=0)
+    # Save the credentials for the next run
+    if creds:
+        _save_creds(creds)
+
+    return creds
+
+
+def _load_creds() -> Optional["Credentials"]:
+    """Load the saved credentials, if there are any
+
+    TOKEN_FILE stores the user's access and refresh tokens as JSON, and is
+    created automatically when the authorization flow completes for the first
+    time. Credentials from older versions (pickled to LEGACY_TOKEN_FILE) are
+    converted to it."""
+    if os.path.exists(c.TOKEN_FILE):
+        with open(c.TOKEN_FILE) as f:
+            return _from_json(json.load(f))
+    if os.path.exists(c.LEGACY_TOKEN_FILE):
+        with open(c.LEGACY_TOKEN_FILE, "rb") as token:
+            legacy: Optional[Credentials] = pickle.load(token)
+        if legacy:
+            _save_creds(legacy)
+        return legacy
+    return None
+
+
+# NOTE: google.auth isn't consistently typed across versions, these thin
+# wrappers keep that from leaking everywhere.
+
+
+def _from_json(info: Dict[str, Any]) -> "Credentials":
+    from google.oauth2.credentials import Credentials
+
+    loader: Any = Credentials.from_authorized_user_info
+    creds: Credentials = loader(info, c.SCOPES)
     return creds
+
+
+def _to_json(creds: Any) -> str:
+    return str(creds.to_json())
+
+
+def _refresh(creds: Any) -> None:
+    creds.refresh(auth_request())
+
+
+def _save_creds(creds: "Credentials") -> None:
+    """Atomically write the credentials to TOKEN_FILE, readable only by you"""
+    tmp = f"{c.TOKEN_FILE}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(_to_json(creds))
+    os.replace(tmp, c.TOKEN_FILE)
+
+
+def _expires_soon(creds: "Credentials") -> bool:
+    if not creds.expiry or not creds.refresh_token:
+        return False
+    # google.auth uses naive UTC datetimes
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return bool(creds.expiry - now < timedelta(seconds=c.TOKEN_REFRESH_MARGIN_SECONDS))
+
+
+def refresh_expiring_creds() -> None:
+    """Refresh (and save) the saved credentials if they're about to expire
+
+    The daemon calls this between refreshes so the next fetch doesn't have to
+    wait on google for a new access token, as does the process a short-lived
+    run starts (see _refresh_in_background)."""
+    try:
+        creds = _load_creds()
+        if creds is None or not creds.valid or not _expires_soon(creds):
+            return
+        _refresh(creds)
+        _save_creds(creds)
+    except Exception as e:
+        # Not the end of the world, we'll refresh when it actually expires.
+        logger.warning("Error refreshing credentials: %s", e)
+    finally:
+        _refreshed()
+
+
+# What the background refresh runs.
+_REFRESH_CREDS = "from next_meeting.gcal import refresh_expiring_creds as r; r()"
+
+
+def _refresh_marker() -> str:
+    return f"{c.TOKEN_FILE}.refreshing"
+
+
+def _refresh_in_background() -> None:
+    """Start a detached process to refresh the credentials
+
+    The current access token is still good, so nothing needs to wait on this.
+    Being a separate process (rather than a thread) a short-lived run exits
+    as soon as it's done, and the refresh carries on without it. Only one is
+    started per TOKEN_REFRESH_TIMEOUT_SECONDS, however many runs there are."""
+    marker = _refresh_marker()
+    try:
+        os.close(os.open(marker, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+    except FileExistsError:
+        if time.time() - os.path.getmtime(marker) < c.TOKEN_REFRESH_TIMEOUT_SECONDS:
+            # Someone else is already on it
+            return
+        # They must have given up, take over.
+        os.utime(marker)
+    except OSError as e:
+        logger.warning("Not refreshing credentials in the background: %s", e)
+        return
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    python_path = os.pathsep.join(filter(None, (root, os.environ.get("PYTHONPATH"))))
+    try:
+        subprocess.Popen(
+            [sys.executable, "-c", _REFRESH_CREDS],
+            env=dict(os.environ, PYTHONPATH=python_path),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError as e:
+        logger.warning("Not refreshing credentials in the background: %s", e)
+        _refreshed()
+
+
+def _refreshed() -> None:
+    """Let the next run start a background refresh again, if it needs one"""
+    try:
+        os.unlink(_refresh_marker())
+    except FileNotFoundError:
+        pass
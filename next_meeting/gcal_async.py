@@ -0,0 +1,410 @@
+import asyncio
+import json
+import logging
+import time
+from contextlib import aclosing
+from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, List, Optional, Set, Tuple, Union
+from urllib.parse import quote, urlencode
+
+from . import constants as c
+from . import gcal
+from .args import Args
+from .cache import EventCache
+from .parsing import MyEvent, parse_events
+from .profiling import profiled, span
+from .transport import http_pool
+
+logger = logging.getLogger(__name__)
+
+# gcal.py on asyncio (--async), overlapping whatever doesn't depend on
+# anything else:
+#
+# - loading (and if need be refreshing) the credentials, on a thread, with
+#   reading the calendars that are fresh in the event cache
+# - every calendar's requests with each other's
+# - for the join command (iter_parsed_pages), fetching the next page of each
+#   calendar that isn't cached with parsing (on a thread) the page before it,
+#   until main.find_meeting_to_join_in_pages has what it needs
+#
+# It goes through the same cache and sync tokens as gcal.py. The API is called
+# directly, so there's no googleapiclient service to build. Requests go through
+# httpx if it's installed, otherwise each one runs on a thread over gcal.py's
+# pool of httplib2 connections.
+
+# For google to gzip the response the user agent has to say so too.
+_HEADERS = {"Accept-Encoding": "gzip", "User-Agent": "next-meeting (gzip)"}
+
+
+class HttpError(Exception):
+    """The calendar API answered with something other than a 200"""
+
+    def __init__(self, status: int, body: bytes) -> None:
+        super().__init__(f"HTTP {status}: {body[:200]!r}")
+        self.status = status
+
+
+class _ThreadClient:
+    """Makes each request on a thread, over gcal.py's httplib2 connections"""
+
+    async def get_json(
+        self, url: str, params: Dict[str, str], token: Optional[str]
+    ) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._get_json, url, params, token)
+
+    def _get_json(
+        self, url: str, params: Dict[str, str], token: Optional[str]
+    ) -> Dict[str, Any]:
+        with span("events.list"), http_pool().connection() as http:
+            response, content = http.request(
+                f"{url}?{urlencode(params)}", headers=_headers(token)
+            )
+        if response.status != 200:
+            raise HttpError(response.status, content)
+        result: Dict[str, Any] = json.loads(content)
+        return result
+
+    async def aclose(self) -> None:
+        pass
+
+
+class _HttpxClient:
+    """Makes requests with an httpx.AsyncClient, on the event loop itself"""
+
+    def __init__(self) -> None:
+        import httpx
+
+        self._client = httpx.AsyncClient(
+            timeout=c.FETCH_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=c.FETCH_WORKERS),
+        )
+
+    async def get_json(
+        self, url: str, params: Dict[str, str], token: Optional[str]
+    ) -> Dict[str, Any]:
+        response = await self._client.get(url, params=params, headers=_headers(token))
+        if response.status_code != 200:
+            raise HttpError(response.status_code, response.content)
+        result: Dict[str, Any] = response.json()
+        return result
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+_Client = Union[_ThreadClient, _HttpxClient]
+
+
+def _client() -> _Client:
+    try:
+        import httpx  # noqa: F401
+    except ImportError:
+        return _ThreadClient()
+    return _HttpxClient()
+
+
+def _headers(token: Optional[str]) -> Dict[str, str]:
+    if token is None:
+        return _HEADERS
+    return dict(_HEADERS, Authorization=f"Bearer {token}")
+
+
+@profiled("fetch_events")
+def fetch_events(args: Args, until: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """gcal.fetch_events, on asyncio"""
+
+    async def collect() -> List[Dict[str, Any]]:
+        pages = _iter_pages(args, until, stream=False)
+        return [event async for page in pages for event in page]
+
+    return asyncio.run(collect())
+
+
+async def iter_parsed_pages(
+    args: Args, until: Optional[datetime] = None
+) -> AsyncGenerator[List[MyEvent], None]:
+    """The upcoming events from all of our calendars, parsed, a page at a time
+    in start order
+
+    As gcal.iter_events, calendars with nothing usable cached are streamed from
+    google a page at a time (see _CalendarStream). Each page is parsed on a
+    thread, while the next one is on its way."""
+    async with aclosing(_iter_pages(args, until, stream=True)) as pages:
+        async for page in pages:
+            yield await asyncio.to_thread(parse_events, page, args)
+
+
+async def _iter_pages(
+    args: Args, until: Optional[datetime], stream: bool
+) -> AsyncGenerator[List[Dict[str, Any]], None]:
+    """The upcoming events from all of our calendars, in start order, going
+    through the local event cache
+
+    Calendars that need fetching are fetched all at once. With stream those
+    with nothing usable cached are streamed (in start order) and events come a
+    page at a time, otherwise everything is fetched (unordered, which gets us a
+    sync token) and comes in one go."""
+    time_min, time_max, window_max = gcal.fetch_window(args, until)
+    with EventCache(c.EVENT_CACHE_FILE) as cache:
+        stale = gcal.stale_calendars(cache, args, time_min, time_max)
+        token, cached = await _creds_and_cached(cache, args, stale, time_min, time_max)
+        if not stale:
+            if cached:
+                yield cached
+            return
+
+        client = _client()
+        streams: List[_CalendarStream] = []
+        try:
+            if stream:
+                streams = [
+                    _CalendarStream(
+                        client, token, calendar_id, cache, time_min, window_max
+                    )
+                    for calendar_id, sync_token in stale.items()
+                    if sync_token is None
+                ]
+            fetch = {
+                calendar_id: sync_token
+                for calendar_id, sync_token in stale.items()
+                if not stream or sync_token
+            }
+            if fetch:
+                for fetched in await _fetch_calendars(
+                    client, token, fetch, time_min, window_max
+                ):
+                    fetched.save(cache, time_min, window_max)
+                cached += cache.events(list(fetch), time_min, time_max)
+            async with aclosing(_merge_pages(streams, cached, time_max)) as pages:
+                async for page in pages:
+                    yield page
+        finally:
+            for calendar_stream in streams:
+                calendar_stream.cancel()
+            await client.aclose()
+
+
+async def _creds_and_cached(
+    cache: EventCache,
+    args: Args,
+    stale: Dict[str, Optional[str]],
+    time_min: datetime,
+    time_max: datetime,
+) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+    """The access token (if there's anything stale to fetch) and the events
+    from the calendars that are fresh in the cache
+
+    The credentials are loaded (and refreshed if need be) on a thread, started
+    before the cache is read so one doesn't wait on the other."""
+    loop = asyncio.get_running_loop()
+    creds = loop.run_in_executor(None, gcal.fetch_creds) if stale else None
+    fresh = [calendar_id for calendar_id in args.calendars if calendar_id not in stale]
+    cached = cache.events(fresh, time_min, time_max) if fresh else []
+    token: Optional[str] = getattr(await creds, "token", None) if creds else None
+    return token, cached
+
+
+class _CalendarStream:
+    """A calendar fetched from google a page (of STREAM_PAGE_SIZE events, in
+    start order) at a time, with the next page always on its way
+
+    Each page is cached as it arrives (see gcal.Streamed). A page that takes
+    longer than FETCH_TIMEOUT_SECONDS ends the stream there."""
+
+    def __init__(
+        self,
+        client: _Client,
+        token: Optional[str],
+        calendar_id: str,
+        cache: EventCache,
+        time_min: datetime,
+        time_max: datetime,
+    ) -> None:
+        logger.debug(
+            "Streaming the upcoming events in %s from %s to %s",
+            calendar_id,
+            time_min,
+            time_max,
+        )
+        self._client = client
+        self._token = token
+        self._cache = cache
+        self._params = dict(
+            timeMin=time_min.isoformat(),
+            timeMax=time_max.isoformat(),
+            maxResults=str(c.STREAM_PAGE_SIZE),
+            orderBy="startTime",
+        )
+        self._streamed = gcal.Streamed(calendar_id, time_min, time_max, time.time())
+        self._next: Optional[asyncio.Task[Dict[str, Any]]] = self._fetch({})
+
+    @property
+    def complete_until(self) -> float:
+        """Everything starting before this (epoch seconds) has been fetched"""
+        if self._next is None:
+            return float("inf")
+        complete_until = self._streamed.complete_until
+        return complete_until.timestamp() if complete_until else float("-inf")
+
+    async def next_page(self) -> List[Dict[str, Any]]:
+        if self._next is None:
+            return []
+        calendar_id = self._streamed.calendar_id
+        try:
+            page = await asyncio.wait_for(self._next, c.FETCH_TIMEOUT_SECONDS)
+        except TimeoutError:
+            logger.warning("Timed out fetching events for %s", calendar_id)
+            self._next = None
+            return []
+        page_token = page.get("nextPageToken")
+        self._next = self._fetch(dict(pageToken=page_token)) if page_token else None
+        self._streamed.save(self._cache, page)
+        items: List[Dict[str, Any]] = page.get("items", [])
+        return items
+
+    def cancel(self) -> None:
+        if self._next is not None:
+            self._next.cancel()
+            self._next = None
+
+    def _fetch(self, params: Dict[str, str]) -> "asyncio.Task[Dict[str, Any]]":
+        return asyncio.create_task(
+            _list_page(
+                self._client,
+                self._token,
+                self._streamed.calendar_id,
+                dict(self._params, **params),
+            )
+        )
+
+
+async def _merge_pages(
+    streams: List[_CalendarStream], events: List[Dict[str, Any]], time_max: datetime
+) -> AsyncGenerator[List[Dict[str, Any]], None]:
+    """Merge the streams (and events we already have) into pages of events in
+    start order, up to time_max
+
+    Each page is everything that starts by when the stream furthest behind has
+    got to (anything else starting then can come in any order). An event on
+    more than one calendar is only returned once."""
+    until = time_max.timestamp()
+    seen: Set[str] = set()
+    pending = list(events)
+    behind = streams
+    while True:
+        for page in await asyncio.gather(*(s.next_page() for s in behind)):
+            pending += page
+        complete_until = min([until] + [s.complete_until for s in streams])
+        ready = sorted(
+            (e for e in pending if gcal.start_key(e) <= complete_until),
+            key=gcal.start_key,
+        )
+        pending = [e for e in pending if gcal.start_key(e) > complete_until]
+        page = []
+        for event in ready:
+            if event["id"] not in seen and gcal.start_key(event) < until:
+                seen.add(event["id"])
+                page.append(event)
+        if page:
+            yield page
+        if complete_until >= until:
+            return
+        # Only the streams holding the rest up need another page
+        behind = [s for s in streams if s.complete_until == complete_until]
+
+
+async def _fetch_calendars(
+    client: _Client,
+    token: Optional[str],
+    sync_tokens: Dict[str, Optional[str]],
+    time_min: datetime,
+    time_max: datetime,
+) -> List[gcal.Fetched]:
+    """gcal._fetch_calendars, on asyncio"""
+    tasks = {
+        asyncio.create_task(
+            _fetch_calendar(client, token, calendar_id, sync_token, time_min, time_max)
+        ): calendar_id
+        for calendar_id, sync_token in sync_tokens.items()
+    }
+    done, not_done = await asyncio.wait(tasks, timeout=c.FETCH_TIMEOUT_SECONDS)
+    for task in not_done:
+        logger.warning("Timed out fetching events for %s", tasks[task])
+        task.cancel()
+    # Keep the results in the order the calendars were given to us
+    return [task.result() for task in tasks if task in done]
+
+
+async def _fetch_calendar(
+    client: _Client,
+    token: Optional[str],
+    calendar_id: str,
+    sync_token: Optional[str],
+    time_min: datetime,
+    time_max: datetime,
+) -> gcal.Fetched:
+    """gcal._fetch_calendar, on asyncio"""
+    fetched_at = time.time()
+    if sync_token:
+        logger.debug("Getting the events changed in %s", calendar_id)
+        try:
+            changes, next_sync_token = await _list_all(
+                client, token, calendar_id, dict(syncToken=sync_token)
+            )
+            return gcal.Fetched(
+                calendar_id, changes, next_sync_token, fetched_at, False
+            )
+        except HttpError as e:
+            # 410 GONE means the sync token is no longer valid and we need to
+            # start over.
+            if e.status != 410:
+                raise
+            logger.info("Sync token expired, doing a full fetch")
+
+    logger.debug(
+        "Getting the upcoming events in %s from %s to %s",
+        calendar_id,
+        time_min,
+        time_max,
+    )
+    events, next_sync_token = await _list_all(
+        client,
+        token,
+        calendar_id,
+        dict(timeMin=time_min.isoformat(), timeMax=time_max.isoformat()),
+    )
+    return gcal.Fetched(calendar_id, events, next_sync_token, fetched_at, True)
+
+
+async def _list_all(
+    client: _Client, token: Optional[str], calendar_id: str, params: Dict[str, str]
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """gcal._list_all, on asyncio"""
+    events: List[Dict[str, Any]] = []
+    while True:
+        result = await _list_page(client, token, calendar_id, params)
+        events.extend(result.get("items", []))
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            return events, result.get("nextSyncToken")
+        params = dict(params, pageToken=page_token)
+
+
+async def _list_page(
+    client: _Client, token: Optional[str], calendar_id: str, params: Dict[str, str]
+) -> Dict[str, Any]:
+    """Fetch a single page of events (see gcal._list_page)"""
+    url = f"{c.CALENDAR_API_URL}calendars/{quote(calendar_id, safe='')}/events"
+    result: Dict[str, Any] = await client.get_json(
+        url, dict(params, singleEvents="true", fields=gcal.LIST_FIELDS), token
+    )
+    # Checked up front so there's nothing to pay for unless we're debugging
+    if c.DEBUG_RAW_EVENTS and logger.isEnabledFor(logging.DEBUG):
+        _debug_raw_events(result)
+    return result
+
+
+@profiled("debug raw events")
+def _debug_raw_events(result: Dict[str, Any]) -> None:
+    # The same as gcal.py's, so replay can read it back
+    logger.debug("Raw results from google api: %s", json.dumps(result))
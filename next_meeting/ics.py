@@ -0,0 +1,576 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import time
+from calendar import monthrange
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from . import constants as c
+from .args import Args
+from .profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+# Events from iCalendar (.ics) files or feeds, instead of google (--ics).
+#
+# Files are read a line at a time and only the events overlapping the window
+# (now to HOURS_AHEAD from now) are kept, with recurring events expanded just
+# within it. So however big an exported calendar gets, what we hold on to (and
+# parse afterwards) is only what's coming up. Each event is handed on in the
+# same shape as the events google's API gives us, for parsing.parse_event.
+#
+# Recurrence rules are expanded here rather than with a library, covering what
+# calendar apps actually produce: DAILY/WEEKLY/MONTHLY/YEARLY with INTERVAL,
+# COUNT, UNTIL, BYDAY (with ordinals for MONTHLY/YEARLY), BYMONTHDAY, BYMONTH,
+# EXDATE and moved/cancelled instances (RECURRENCE-ID). Anything else only
+# gets its first occurrence.
+
+When = Union[date, datetime]
+# An instance of an event: its UID and (for recurring events) its start
+InstanceKey = Tuple[str, Optional[str]]
+
+_WEEKDAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+_SUPPORTED_RULE_PARTS = {
+    "FREQ",
+    "INTERVAL",
+    "COUNT",
+    "UNTIL",
+    "BYDAY",
+    "BYMONTHDAY",
+    "BYMONTH",
+    "WKST",
+}
+_DURATION_RE = re.compile(
+    r"([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$"
+)
+_ESCAPED_RE = re.compile(r"\\([\\;,nN])")
+# Properties that can be given more than once, that we care about
+_REPEATED = {"EXDATE"}
+# Where apps put the link to their meeting, which we pass on as conferenceData
+_CONFERENCE_PROPERTIES = ("X-GOOGLE-CONFERENCE", "X-MICROSOFT-SKYPETEAMSMEETINGURL")
+
+
+@profiled("ics.fetch_events")
+def fetch_events(args: Args, until: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Read every upcoming event from all of the --ics files/feeds
+
+    See iter_events, this just collects the whole window."""
+    return list(iter_events(args, until))
+
+
+def iter_events(
+    args: Args, until: Optional[datetime] = None
+) -> Iterator[Dict[str, Any]]:
+    """The upcoming events from all of the --ics files/feeds, in start order
+
+    From args.now until HOURS_AHEAD later (or until, if given). An event in
+    more than one of them is only returned once."""
+    time_min: datetime = args.now
+    time_max: datetime = until or args.now + timedelta(hours=c.HOURS_AHEAD)
+    window = Window(time_min, time_max)
+    for source in args.ics:
+        with open(_local_path(source, args), encoding="utf-8", errors="replace") as f:
+            window.read(f)
+    return iter(window.events())
+
+
+def _local_path(source: str, args: Args) -> str:
+    """Where to read this file or feed from
+
+    Feeds (http(s) urls) are downloaded to ICS_FEED_DIR and reused until they
+    are ICS_FEED_MAX_AGE_SECONDS old (or --refresh). If a feed can't be fetched
+    we make do with the last copy of it, if there is one."""
+    if not source.startswith(("http://", "https://", "webcal://")):
+        return source
+    url = re.sub("^webcal://", "https://", source)
+    name = hashlib.sha1(url.encode()).hexdigest()
+    path = os.path.join(c.ICS_FEED_DIR, f"{name}.ics")
+    if os.path.exists(path) and not args.refresh:
+        age = time.time() - os.path.getmtime(path)
+        if age < c.ICS_FEED_MAX_AGE_SECONDS:
+            logger.debug("Using the cached copy of %s", url)
+            return path
+    try:
+        _download(url, path)
+    except OSError as e:
+        if not os.path.exists(path):
+            raise
+        logger.warning("Error fetching %s, using the last copy: %s", url, e)
+    return path
+
+
+@profiled("ics download")
+def _download(url: str, path: str) -> None:
+    """Stream url to path (atomically)"""
+    from urllib.request import urlopen
+
+    logger.debug("Downloading %s", url)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with urlopen(url, timeout=c.FETCH_TIMEOUT_SECONDS) as response:
+        with open(tmp, "wb") as f:
+            shutil.copyfileobj(response, f)
+    os.replace(tmp, path)
+
+
+@dataclass
+class Window:
+    """Collects the instances of events overlapping [time_min, time_max) from
+    any number of calendars
+
+    Follows the same semantics as the API's timeMin/timeMax (exclusive bounds
+    on end/start respectively)."""
+
+    time_min: datetime
+    time_max: datetime
+    _instances: Dict[InstanceKey, Dict[str, Any]] = field(default_factory=dict)
+    # Instances that were moved (out of the window) or cancelled
+    _removed: Set[InstanceKey] = field(default_factory=set)
+
+    def read(self, lines: Iterable[str]) -> None:
+        """Read a calendar, a line at a time"""
+        for props in _vevents(_unfold(lines)):
+            self._add(props)
+
+    def events(self) -> List[Dict[str, Any]]:
+        """The events in the window, in start order"""
+        events = self._instances.values()
+        return sorted(events, key=lambda e: _as_datetime(_when(e["start"])))
+
+    def _overlaps(self, start: When, end: When) -> bool:
+        return _as_datetime(start) < self.time_max and _as_datetime(end) > self.time_min
+
+    def _add(self, props: "Props") -> None:
+        uid = props.value("UID")
+        dtstart = props.time("DTSTART")
+        if not uid or dtstart is None:
+            return
+        duration = _duration(props, dtstart)
+
+        recurrence_id = props.time("RECURRENCE-ID")
+        if recurrence_id is not None:
+            # A single instance of a recurring event, moved or changed. It
+            # replaces the instance it started out as wherever that is.
+            key = (uid, _instance_id(recurrence_id))
+            if props.value("STATUS") == "CANCELLED" or not self._overlaps(
+                dtstart, dtstart + duration
+            ):
+                self._removed.add(key)
+                self._instances.pop(key, None)
+            else:
+                self._instances[key] = _event(props, uid, key[1], dtstart, duration)
+            return
+
+        if props.value("STATUS") == "CANCELLED":
+            return
+        rule = props.value("RRULE")
+        if rule is None:
+            if self._overlaps(dtstart, dtstart + duration):
+                self._instances[(uid, None)] = _event(
+                    props, uid, None, dtstart, duration
+                )
+            return
+
+        exdates = {_instance_id(d) for d in props.times("EXDATE")}
+        for start in _occurrences(
+            dtstart, _parse_rule(rule), self.time_min - duration, self.time_max
+        ):
+            instance = _instance_id(start)
+            key = (uid, instance)
+            if instance in exdates or key in self._instances or key in self._removed:
+                # Excluded, or already replaced (or cancelled) on its own
+                continue
+            if self._overlaps(start, start + duration):
+                self._instances[key] = _event(props, uid, instance, start, duration)
+
+
+class Props:
+    """The properties of a VEVENT, as they were read
+
+    Values are only decoded when asked for, which for most events (those
+    outside the window) is just the UID and times."""
+
+    def __init__(self) -> None:
+        # name -> [(params, raw value)]
+        self._props: Dict[str, List[Tuple[str, str]]] = {}
+
+    def add(self, name: str, params: str, value: str) -> None:
+        if name in _REPEATED:
+            self._props.setdefault(name, []).append((params, value))
+        else:
+            self._props[name] = [(params, value)]
+
+    def raw(self, name: str) -> Optional[str]:
+        found = self._props.get(name)
+        return found[0][1] if found else None
+
+    def value(self, name: str) -> Optional[str]:
+        """A text value, unescaped"""
+        raw = self.raw(name)
+        return None if raw is None else _unescape(raw)
+
+    def time(self, name: str) -> Optional[When]:
+        found = self._props.get(name)
+        if not found:
+            return None
+        params, value = found[0]
+        return _parse_time(value, _params(params))
+
+    def times(self, name: str) -> Iterator[When]:
+        """Every value of a (repeatable, comma separated) date/time property"""
+        for params, values in self._props.get(name, []):
+            parsed = _params(params)
+            for value in values.split(","):
+                when = _parse_time(value, parsed)
+                if when is not None:
+                    yield when
+
+
+def _unfold(lines: Iterable[str]) -> Iterator[str]:
+    """Join folded content lines back together (RFC 5545 3.1)"""
+    parts: List[str] = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t"):
+            parts.append(line[1:])
+            continue
+        if parts:
+            yield "".join(parts)
+        parts = [line]
+    if parts:
+        yield "".join(parts)
+
+
+def _vevents(lines: Iterable[str]) -> Iterator[Props]:
+    """The properties of each VEVENT (ignoring any nested components like
+    alarms)"""
+    props: Optional[Props] = None
+    # How deep we are in components nested in the VEVENT
+    nested = 0
+    for line in lines:
+        name, params, value = _split(line)
+        if name == "BEGIN":
+            if value == "VEVENT" and props is None:
+                props = Props()
+            elif props is not None:
+                nested += 1
+        elif name == "END":
+            if props is None:
+                continue
+            if nested:
+                nested -= 1
+            elif value == "VEVENT":
+                yield props
+                props = None
+        elif props is not None and not nested:
+            props.add(name, params, value)
+
+
+def _split(line: str) -> Tuple[str, str, str]:
+    """Split a content line into its name, parameters and value"""
+    colon = line.find(":")
+    if colon < 0:
+        return line.upper(), "", ""
+    head = line[:colon]
+    if '"' in head:
+        # A quoted parameter value can contain a colon, find the real one.
+        quoted = False
+        for colon, char in enumerate(line):
+            if char == '"':
+                quoted = not quoted
+            elif char == ":" and not quoted:
+                break
+        head = line[:colon]
+    semi = head.find(";")
+    if semi < 0:
+        return head.upper(), "", line[colon + 1 :]
+    return head[:semi].upper(), head[semi + 1 :], line[colon + 1 :]
+
+
+def _params(params: str) -> Dict[str, str]:
+    found: Dict[str, str] = {}
+    for param in params.split(";") if params else ():
+        name, _, value = param.partition("=")
+        found[name.upper()] = value.strip('"')
+    return found
+
+
+def _unescape(value: str) -> str:
+    if "\\" not in value:
+        return value
+    return _ESCAPED_RE.sub(lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+_zones: Dict[str, Optional[tzinfo]] = {}
+
+
+def _zone(tzid: str) -> Optional[tzinfo]:
+    """The timezone for a TZID, None if we don't know it (Outlook, say, uses
+    Windows names) in which case we go with local (floating) time"""
+    if tzid not in _zones:
+        try:
+            _zones[tzid] = ZoneInfo(tzid.lstrip("/"))
+        except (ZoneInfoNotFoundError, ValueError):
+            logger.warning("Unknown timezone %s, using local time", tzid)
+            _zones[tzid] = None
+    return _zones[tzid]
+
+
+def _parse_time(value: str, params: Dict[str, str]) -> Optional[When]:
+    """A DATE or DATE-TIME value (UTC, in a TZID or floating)
+
+    Floating times (and those in a TZID we don't know) are left naive, as wall
+    clock times, and only become local time in _as_datetime. Fixing them to
+    today's UTC offset here would put recurring instances an hour out on the
+    other side of a daylight saving change."""
+    value = value.strip()
+    try:
+        if params.get("VALUE") == "DATE" or len(value) == 8:
+            return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+        naive = datetime(
+            int(value[0:4]),
+            int(value[4:6]),
+            int(value[6:8]),
+            int(value[9:11]),
+            int(value[11:13]),
+            int(value[13:15]),
+        )
+    except ValueError:
+        logger.warning("Couldn't parse the date/time %s", value)
+        return None
+    if value.endswith("Z"):
+        return naive.replace(tzinfo=timezone.utc)
+    zone = _zone(params["TZID"]) if "TZID" in params else None
+    return naive.replace(tzinfo=zone) if zone else naive
+
+
+def _as_datetime(value: When) -> datetime:
+    """Dates (all day events) as local midnight, floating times as local time
+    (on that day)"""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.astimezone()
+    return datetime(value.year, value.month, value.day).astimezone()
+
+
+def _duration(props: Props, start: When) -> timedelta:
+    end = props.time("DTEND")
+    if isinstance(end, datetime) and isinstance(start, datetime):
+        if (end.tzinfo is None) != (start.tzinfo is None):
+            # One floating, the other not
+            return _as_datetime(end) - _as_datetime(start)
+    if end is not None and type(end) is type(start):
+        return end - start
+    duration = props.raw("DURATION")
+    match = _DURATION_RE.match(duration.strip()) if duration else None
+    if match:
+        sign, weeks, days, hours, minutes, seconds = match.groups()
+        delta = timedelta(
+            weeks=int(weeks or 0),
+            days=int(days or 0),
+            hours=int(hours or 0),
+            minutes=int(minutes or 0),
+            seconds=int(seconds or 0),
+        )
+        return -delta if sign == "-" else delta
+    # RFC 5545: an all day event without an end lasts the day, anything else
+    # takes no time at all.
+    return timedelta(days=0 if isinstance(start, datetime) else 1)
+
+
+def _instance_id(start: When) -> str:
+    """How google identifies an instance of a recurring event"""
+    if isinstance(start, datetime):
+        return start.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return start.strftime("%Y%m%d")
+
+
+def _when(value: Dict[str, str]) -> When:
+    if "date" in value:
+        return date.fromisoformat(value["date"])
+    return datetime.fromisoformat(value["dateTime"])
+
+
+def _gcal_time(value: When) -> Dict[str, str]:
+    if isinstance(value, datetime):
+        return dict(dateTime=_as_datetime(value).isoformat())
+    return dict(date=value.isoformat())
+
+
+def _event(
+    props: Props, uid: str, instance: Optional[str], start: When, duration: timedelta
+) -> Dict[str, Any]:
+    """An (instance of an) event, the way google's API would give it to us"""
+    event: Dict[str, Any] = dict(
+        id=f"{uid}_{instance}" if instance else uid,
+        # Changes whenever the event does, so parsed events can be cached
+        etag=f"{props.raw('SEQUENCE') or 0}-"
+        f"{props.raw('LAST-MODIFIED') or props.raw('DTSTAMP')}",
+        status="confirmed",
+        summary=props.value("SUMMARY") or "",
+        start=_gcal_time(start),
+        end=_gcal_time(start + duration),
+    )
+    for name, key in (("LOCATION", "location"), ("DESCRIPTION", "description")):
+        text = props.value(name)
+        if text:
+            event[key] = text
+    uris = [props.value(name) for name in _CONFERENCE_PROPERTIES]
+    entry_points = [dict(uri=uri) for uri in uris if uri]
+    if entry_points:
+        event["conferenceData"] = dict(entryPoints=entry_points)
+    return event
+
+
+@dataclass
+class Rule:
+    """A recurrence rule (RRULE)"""
+
+    freq: str
+    interval: int = 1
+    count: Optional[int] = None
+    until: Optional[When] = None
+    # (ordinal or 0 for every one, weekday)
+    by_day: List[Tuple[int, int]] = field(default_factory=list)
+    by_month_day: List[int] = field(default_factory=list)
+    by_month: List[int] = field(default_factory=list)
+    # Parts we don't understand, in which case there's only the first occurrence
+    unsupported: bool = False
+
+
+def _parse_rule(value: str) -> Rule:
+    parts: Dict[str, str] = {}
+    for part in value.upper().split(";"):
+        name, _, part_value = part.partition("=")
+        parts[name] = part_value
+    rule = Rule(freq=parts.get("FREQ", ""))
+    rule.interval = max(1, int(parts.get("INTERVAL", 1)))
+    if "COUNT" in parts:
+        rule.count = int(parts["COUNT"])
+    if "UNTIL" in parts:
+        rule.until = _parse_time(parts["UNTIL"], {})
+    for day in filter(None, parts.get("BYDAY", "").split(",")):
+        rule.by_day.append((int(day[:-2] or 0), _WEEKDAYS[day[-2:]]))
+    rule.by_month_day = [int(d) for d in parts.get("BYMONTHDAY", "").split(",") if d]
+    rule.by_month = [int(m) for m in parts.get("BYMONTH", "").split(",") if m]
+    rule.unsupported = bool(set(parts) - _SUPPORTED_RULE_PARTS) or rule.freq not in (
+        "DAILY",
+        "WEEKLY",
+        "MONTHLY",
+        "YEARLY",
+    )
+    if rule.unsupported:
+        logger.warning("Only using the first occurrence of RRULE:%s", value)
+    return rule
+
+
+def _occurrences(
+    dtstart: When, rule: Rule, after: datetime, before: datetime
+) -> Iterator[When]:
+    """The starts of a recurring event from (about) after until before
+
+    Without a COUNT we skip straight to the period around after, so this costs
+    the same however long ago the event started recurring."""
+    if rule.unsupported:
+        yield dtstart
+        return
+    first = 0
+    if rule.count is None and _as_datetime(dtstart) < after:
+        first = max(0, _periods_between(dtstart, after, rule.freq) // rule.interval - 1)
+    # Nothing past this period can start before before (whether or not any
+    # period actually has an occurrence in it, say the 30th of February)
+    last = _periods_between(dtstart, before, rule.freq) // rule.interval + 1
+    count = 0
+    for period in range(first, last + 1):
+        for day in _days(dtstart, rule, period * rule.interval):
+            start = _at(day, dtstart)
+            if start < dtstart:
+                continue
+            if _ended(start, rule) or _as_datetime(start) >= before:
+                return
+            count += 1
+            if rule.count is not None and count > rule.count:
+                return
+            yield start
+
+
+def _periods_between(start: When, end: datetime, freq: str) -> int:
+    """Whole days/weeks/months/years from start until end"""
+    first = start.date() if isinstance(start, datetime) else start
+    days = (end.date() - first).days
+    if freq == "DAILY":
+        return days
+    if freq == "WEEKLY":
+        return days // 7
+    months = (end.year - start.year) * 12 + end.month - start.month
+    return months if freq == "MONTHLY" else months // 12
+
+
+def _ended(start: When, rule: Rule) -> bool:
+    if rule.until is None:
+        return False
+    if isinstance(rule.until, datetime) and isinstance(start, datetime):
+        return _as_datetime(start) > _as_datetime(rule.until)
+    day = start.date() if isinstance(start, datetime) else start
+    until = rule.until.date() if isinstance(rule.until, datetime) else rule.until
+    return day > until
+
+
+def _at(day: date, dtstart: When) -> When:
+    """day, at the (wall clock) time of dtstart"""
+    if isinstance(dtstart, datetime):
+        return datetime.combine(day, dtstart.timetz())
+    return day
+
+
+def _days(dtstart: When, rule: Rule, offset: int) -> List[date]:
+    """The days the event happens on, in the period offset periods on from
+    dtstart's"""
+    first = dtstart.date() if isinstance(dtstart, datetime) else dtstart
+    if rule.freq == "DAILY":
+        day = first + timedelta(days=offset)
+        weekdays = {w for _, w in rule.by_day}
+        if (weekdays and day.weekday() not in weekdays) or (
+            rule.by_month and day.month not in rule.by_month
+        ):
+            return []
+        return [day]
+    if rule.freq == "WEEKLY":
+        monday = first - timedelta(days=first.weekday()) + timedelta(weeks=offset)
+        every = {w for _, w in rule.by_day} or {first.weekday()}
+        return [monday + timedelta(days=w) for w in sorted(every)]
+    if rule.freq == "MONTHLY":
+        month = first.month - 1 + offset
+        return _month_days(first.year + month // 12, month % 12 + 1, first, rule)
+    months = rule.by_month or [first.month]
+    return [
+        day
+        for month in sorted(months)
+        for day in _month_days(first.year + offset, month, first, rule)
+    ]
+
+
+def _month_days(year: int, month: int, first: date, rule: Rule) -> List[date]:
+    """The days in this month the event happens on"""
+    length = monthrange(year, month)[1]
+    days: Set[int] = set()
+    for d in rule.by_month_day:
+        day = d if d > 0 else length + d + 1
+        if 1 <= day <= length:
+            days.add(day)
+    for ordinal, weekday in rule.by_day:
+        # Every one of this weekday in the month, or just the nth (from the end
+        # when negative).
+        first_weekday = (weekday - date(year, month, 1).weekday()) % 7 + 1
+        matching = list(range(first_weekday, length + 1, 7))
+        if ordinal == 0:
+            days.update(matching)
+        elif -len(matching) <= ordinal <= len(matching) and ordinal:
+            days.add(matching[ordinal - 1 if ordinal > 0 else ordinal])
+    if not rule.by_month_day and not rule.by_day and first.day <= length:
+        days.add(first.day)
+    return [date(year, month, day) for day in sorted(days)]
@@ -0,0 +1,122 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from itertools import accumulate
+from math import inf
+from typing import Dict, List, Optional, Protocol, Sequence, Tuple
+
+from . import constants as c
+from .args import NextMeetingOptions
+from .parsing import MyEvent
+
+
+class MeetingFinder(Protocol):
+    """Anything that can decide what to join at any time, like EventIndex"""
+
+    def find_meeting_to_join(
+        self, now: datetime
+    ) -> Tuple[NextMeetingOptions, Optional[MyEvent]]: ...
+
+
+class EventIndex:
+    """Answers "what's in progress" and "what's about to start" for any instant
+    in logarithmic time
+
+    MyEvent's in_progress/is_next_joinable flags are computed for a single
+    "now". This indexes the events by their start and end times instead, so the
+    same events can be asked about any time without re-parsing (or even
+    touching) them.
+
+    In progress events come from a sorted list of every start/end boundary:
+    between (and at) each pair of boundaries the set of events in progress is
+    fixed, so we precompute it once and binary search for the right one.
+
+    With a horizon, events starting further out than that from "now" are
+    ignored when deciding if there's anything left to join, the same as if we'd
+    only fetched that far ahead (see HOURS_AHEAD)."""
+
+    def __init__(
+        self, events: Sequence[MyEvent], horizon: Optional[timedelta] = None
+    ) -> None:
+        timed: List[Tuple[datetime, Optional[datetime], MyEvent]] = sorted(
+            ((e.start, e.end, e) for e in events if e.is_not_day_event and e.start),
+            key=lambda t: t[0],
+        )
+        self._len = len(events)
+        self._starts: List[datetime] = [start for start, _, _ in timed]
+        self._by_start: List[MyEvent] = [e for _, _, e in timed]
+
+        # For telling whether everything (within the horizon) is over: in start
+        # order, the latest any event up to that point ends. Events without an
+        # end never do, those without a start are always within the horizon.
+        self._horizon = horizon
+        by_start = sorted(events, key=_start_timestamp)
+        self._candidate_starts: List[float] = [_start_timestamp(e) for e in by_start]
+        self._open_until: List[float] = list(
+            accumulate((e.end.timestamp() if e.end else inf for e in by_start), max)
+        )
+
+        # Only events with both a start and an end can be in progress.
+        starting: Dict[datetime, List[MyEvent]] = {}
+        ending: Dict[datetime, List[MyEvent]] = {}
+        for start, end, e in timed:
+            if end and end >= start:
+                starting.setdefault(start, []).append(e)
+                ending.setdefault(end, []).append(e)
+        self._boundaries: List[datetime] = sorted(starting.keys() | ending.keys())
+        # In progress at exactly boundary i, and strictly between boundary i and
+        # i + 1.
+        self._at: List[Tuple[MyEvent, ...]] = []
+        self._after: List[Tuple[MyEvent, ...]] = []
+        active: Dict[int, MyEvent] = {}
+        for boundary in self._boundaries:
+            for e in starting.get(boundary, []):
+                active[id(e)] = e
+            self._at.append(tuple(active.values()))
+            for e in ending.get(boundary, []):
+                del active[id(e)]
+            self._after.append(tuple(active.values()))
+
+    def __len__(self) -> int:
+        return self._len
+
+    def in_progress(self, now: datetime) -> List[MyEvent]:
+        """Events that have started and not yet ended (inclusive)"""
+        i = bisect_right(self._boundaries, now) - 1
+        if i < 0:
+            return []
+        if self._boundaries[i] == now:
+            return list(self._at[i])
+        return list(self._after[i])
+
+    def starting_soon(self, now: datetime) -> List[MyEvent]:
+        """Events starting within JOINABLE_IF_NEXT_STARTS_WITHIN of now"""
+        joinable_before = now + timedelta(minutes=c.JOINABLE_IF_NEXT_STARTS_WITHIN)
+        lo = bisect_right(self._starts, now)
+        hi = bisect_left(self._starts, joinable_before, lo=lo)
+        return self._by_start[lo:hi]
+
+    def has_candidates(self, now: datetime) -> bool:
+        """Is there anything (within the horizon) that isn't over yet?"""
+        if self._horizon is None:
+            i = len(self._open_until)
+        else:
+            i = bisect_left(self._candidate_starts, (now + self._horizon).timestamp())
+        return i > 0 and self._open_until[i - 1] >= now.timestamp()
+
+    def find_meeting_to_join(
+        self, now: datetime
+    ) -> Tuple[NextMeetingOptions, Optional[MyEvent]]:
+        """main.find_meeting_to_join, for any time"""
+        next = self.starting_soon(now)
+        if len(next) == 1:
+            return NextMeetingOptions.FoundNextMeeting, next[0]
+        in_progress = self.in_progress(now)
+        if len(in_progress) == 1:
+            return NextMeetingOptions.FoundNextMeeting, in_progress[0]
+        if self.has_candidates(now):
+            return NextMeetingOptions.MultipleOptions, None
+        return NextMeetingOptions.NoOptions, None
+
+
+def _start_timestamp(event: MyEvent) -> float:
+    return event.start.timestamp() if event.start else -inf
@@ -0,0 +1,73 @@
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+from . import constants as c
+from .args import Args, OutputFormat
+
+# Every module logs to its own logger (logging.getLogger(__name__)), all of
+# which hang off this one. Nothing is shown until configure is called, and only
+# at the level asked for (--log-level) so below that a message is never even
+# formatted.
+#
+# Records are written by a background thread (see configure), so logging never
+# holds us up waiting on the terminal or disk.
+#
+# NOTE: events parsed in other processes (--jobs) don't log anything.
+
+logger = logging.getLogger("next_meeting")
+# Until we're configured (or when run as a library) don't fall back on
+# logging's last resort handler.
+logger.addHandler(logging.NullHandler())
+
+_STREAM_FORMAT = "%(message)s"
+_FILE_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_listener: Optional[QueueListener] = None
+
+
+def configure(args: Args) -> None:
+    """Start logging at args.log_level, to args.log_file (rotated) if there is
+    one otherwise to stdout (stderr when the output is for something else to
+    read)"""
+    global _listener
+    stop()
+
+    handler: logging.Handler
+    if args.log_file:
+        handler = RotatingFileHandler(
+            args.log_file,
+            maxBytes=c.LOG_FILE_MAX_BYTES,
+            backupCount=c.LOG_FILE_BACKUPS,
+        )
+        handler.setFormatter(logging.Formatter(_FILE_FORMAT))
+    else:
+        stream = sys.stdout if args.format == OutputFormat.stdout else sys.stderr
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter(_STREAM_FORMAT))
+
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(records))
+    logger.setLevel(args.log_level.value.upper())
+    logger.propagate = False
+    _listener = QueueListener(records, handler)
+    _listener.start()
+
+
+def stop() -> None:
+    """Write out anything still queued and stop logging"""
+    global _listener
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop)
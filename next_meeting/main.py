@@ -1,22 +1,39 @@
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple, Union
+import logging
+from contextlib import aclosing
+from datetime import datetime, timedelta
+from typing import (
+    Any,
+    AsyncGenerator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from .alfred import AlfredWorkflow, JsonUtilityFormat, ScriptFilterOutput
+from . import constants as c
+from . import log, payload, profiling, snapshot
+from .alfred import AlfredWorkflow, JsonUtilityFormat, ScriptFilterOutput, to_json
 from .args import (
     Args,
     Command,
     NextMeetingOptions,
     OutputFormat,
-    _debug,
     _output,
     parse_args,
 )
-from .gcal import fetch_events
-from .parsing import MyEvent, _debug_event_list, parse_events
+from .cache import EventCache
+from .index import MeetingFinder
+from .parsing import MyEvent, _debug_event_list, iter_parsed_events, parse_events
+
+logger = logging.getLogger(__name__)
 
 
+@profiling.profiled("find_meeting_to_join")
 def find_meeting_to_join(
-    events: List[MyEvent], args: Args
+    events: Iterable[MyEvent], args: Args
 ) -> Tuple[NextMeetingOptions, Optional[MyEvent]]:
     """
     Given a list of meetings to join, find the one we should join
@@ -24,11 +41,32 @@ def find_meeting_to_join(
     ...but this will only do so if the meeting to join is "obvious". Meaning
     there aren't multiple meetings happening at the same time (with some
     caveats) and that the next meeting is starting eminently.
+
+    Events are expected in start order (as they're fetched). We stop looking as
+    soon as we get to one that starts too far out to join, so this can be
+    handed a lazy stream of events and won't consume more of it than it needs.
     """
-    _debug(f"Looking for next meeting. Have {len(events)} candidates", args.format)
-    if events:
-        in_progress = [e for e in events if e.in_progress]
-        next = [e for e in events if e.is_next_joinable]
+    joinable_before = _joinable_before(args)
+    candidates = 0
+    in_progress: List[MyEvent] = []
+    next: List[MyEvent] = []
+    for e in events:
+        candidates += 1
+        if e.in_progress:
+            in_progress.append(e)
+        if e.is_next_joinable:
+            next.append(e)
+        if _too_late_to_join(e, joinable_before):
+            # Everything after this starts later still, so can't be in progress
+            # or about to start either. The decision is made.
+            break
+        if len(next) > 1:
+            # Everything in progress started before these did, so we've seen
+            # it all already, and more about to start can't change anything.
+            break
+    logger.debug("Looking for next meeting. Had %d candidates", candidates)
+
+    if candidates:
         if len(next) == 1:
             return NextMeetingOptions.FoundNextMeeting, next[0]
         if len(in_progress) == 1:
@@ -40,19 +78,89 @@ def find_meeting_to_join(
     return NextMeetingOptions.NoOptions, None
 
 
-def command_list(args: Args) -> None:
-    """Implement the list command"""
-    all_events = fetch_events(args)
-    events: List[MyEvent] = parse_events(all_events, args)
+def decision_made(events: Iterable[MyEvent], args: Args) -> bool:
+    """Has find_meeting_to_join seen enough of these (start ordered) events to
+    decide, so that nothing after them could change its answer?"""
+    joinable_before = _joinable_before(args)
+    next_joinable = 0
+    for e in events:
+        if e.is_next_joinable:
+            next_joinable += 1
+        if _too_late_to_join(e, joinable_before) or next_joinable > 1:
+            return True
+    return False
+
+
+async def find_meeting_to_join_in_pages(
+    pages: AsyncGenerator[List[MyEvent], None], args: Args
+) -> Tuple[NextMeetingOptions, Optional[MyEvent]]:
+    """find_meeting_to_join over pages of events as they arrive, closing pages
+    (so nothing more is fetched) as soon as the decision is made"""
+    meetings: List[MyEvent] = []
+    async with aclosing(pages):
+        async for page in pages:
+            meetings.extend(joinable_events(page))
+            if decision_made(meetings, args):
+                break
+    return find_meeting_to_join(meetings, args)
+
+
+def _joinable_before(args: Args) -> datetime:
+    return args.now + timedelta(minutes=c.JOINABLE_IF_NEXT_STARTS_WITHIN)
+
+
+def _too_late_to_join(event: MyEvent, joinable_before: datetime) -> bool:
+    return bool(
+        event.is_not_day_event and event.start and event.start >= joinable_before
+    )
+
+
+def is_joinable(event: MyEvent) -> bool:
+    """Is this a meeting we could join?"""
+    return bool(event.is_not_day_event and event.meeting_link)
 
-    _debug_event_list(events, args.format)
 
-    filtered_events = [e for e in events if e.is_not_day_event and e.meeting_link]
+def joinable_events(events: Iterable[MyEvent]) -> List[MyEvent]:
+    """The events that are meetings we could join"""
+    return [e for e in events if is_joinable(e)]
+
+
+def next_change(events: Iterable[MyEvent], now: datetime) -> Optional[datetime]:
+    """The next time (at or after now) that what we'd show for these joinable
+    events could change: one of them becoming joinable, starting or ending
+
+    None if none of them will."""
+    joinable_within = timedelta(minutes=c.JOINABLE_IF_NEXT_STARTS_WITHIN)
+    boundaries: List[datetime] = []
+    for e in events:
+        if e.start:
+            boundaries.extend((e.start - joinable_within, e.start))
+        if e.end:
+            boundaries.append(e.end)
+    return min((b for b in boundaries if b >= now), default=None)
+
+
+def render_list(
+    events: List[MyEvent], args: Args, index: Optional[MeetingFinder] = None
+) -> str:
+    """Render the output of the list command for an already parsed set of
+    events
+
+    If an index of the joinable events is given (an EventIndex, a Snapshot, ...)
+    it's used to find the meeting to join instead of the events' own
+    in_progress/is_next_joinable flags."""
+    _debug_event_list(events)
+
+    filtered_events = joinable_events(events)
 
     if args.format == OutputFormat.alfred:
         items = [e.to_item() for e in filtered_events]
         output = ScriptFilterOutput(items=items)
-        next_meeting_value, to_join = find_meeting_to_join(filtered_events, args)
+        if index is not None:
+            with profiling.span(f"{type(index).__name__}.find_meeting_to_join"):
+                next_meeting_value, to_join = index.find_meeting_to_join(args.now)
+        else:
+            next_meeting_value, to_join = find_meeting_to_join(filtered_events, args)
         vars: Dict[str, Optional[Union[str, bool, datetime]]] = dict(
             # bool values show up as 0/1 in Alfred.
             need_to_prompt=True,
@@ -64,24 +172,182 @@ def command_list(args: Args) -> None:
                 title=to_join.summary,
                 start=to_join.start,
             )
+        with profiling.span("ScriptFilterOutput.to_json"):
+            arg = output.to_json()
         utility_output = JsonUtilityFormat(
             alfredworkflow=AlfredWorkflow(
-                arg=output.to_json(),
+                arg=arg,
                 config=dict(),
                 variables=vars,
             )
         )
-        _output(utility_output.to_json())
+        with profiling.span("JsonUtilityFormat.to_json"):
+            return utility_output.to_json()
+    elif args.format == OutputFormat.ndjson:
+        lines = [meeting_record(e) for e in filtered_events]
+        if index is not None:
+            lines.append(decision_record(*index.find_meeting_to_join(args.now)))
+        else:
+            lines.append(decision_record(*find_meeting_to_join(filtered_events, args)))
+        return "\n".join(lines)
+    else:
+        return "TODO: Figure out the non-alfred output format..."
+
+
+def meeting_record(event: MyEvent) -> str:
+    """A meeting, as a line of ndjson output"""
+    return to_json(
+        dict(
+            type="meeting",
+            id=event.id,
+            title=event.summary,
+            start=event.start,
+            end=event.end,
+            meeting_link=event.meeting_link,
+            in_progress=event.in_progress,
+            is_next_joinable=event.is_next_joinable,
+        )
+    )
+
+
+def decision_record(option: NextMeetingOptions, to_join: Optional[MyEvent]) -> str:
+    """What to join, as the last line of ndjson output (the same as the
+    variables we give Alfred)"""
+    record: Dict[str, Optional[Union[str, datetime]]] = dict(
+        type="decision", next_meeting=option.value
+    )
+    if to_join:
+        record.update(
+            id=to_join.id,
+            meeting_link=to_join.meeting_link,
+            title=to_join.summary,
+            start=to_join.start,
+        )
+    return to_json(record)
+
+
+def _iter_events(args: Args) -> Iterator[Dict[str, Any]]:
+    """The upcoming events, lazily and in start order"""
+    if args.ics:
+        from .ics import iter_events
+    else:
+        # Imported here as it pulls in the (slow to import) google client
+        # libraries
+        from .gcal import iter_events
+
+    return iter_events(args)
+
+
+def stream_list(args: Args) -> None:
+    """The list command for ndjson output: each meeting is written as soon as
+    it's parsed, instead of once we have them all
+
+    For a calendar that isn't cached that's while its later pages are still
+    to be fetched (see gcal.iter_events)."""
+    meetings: List[MyEvent] = []
+    for event in iter_parsed_events(_iter_events(args), args):
+        if is_joinable(event):
+            meetings.append(event)
+            _output(meeting_record(event), flush=True)
+    _output(decision_record(*find_meeting_to_join(meetings, args)))
+
+
+def command_join(args: Args) -> None:
+    """Implement the join command: print the link of the meeting to join, if
+    there's an obvious one
+
+    Only the meetings up to the decision matter, so events are streamed and
+    nothing more is fetched once it's made (see gcal.iter_events, or with
+    --async gcal_async.iter_parsed_pages)."""
+    if args.use_async and not args.ics:
+        import asyncio
+
+        from .gcal_async import iter_parsed_pages
+
+        option, to_join = asyncio.run(
+            find_meeting_to_join_in_pages(iter_parsed_pages(args), args)
+        )
+    else:
+        events = iter_parsed_events(_iter_events(args), args)
+        option, to_join = find_meeting_to_join(
+            (e for e in events if is_joinable(e)), args
+        )
+    if to_join and to_join.meeting_link:
+        _output(to_join.meeting_link)
+    else:
+        logger.warning("No obvious meeting to join (%s)", option.value)
+
+
+def command_list(args: Args) -> None:
+    """Implement the list command"""
+    if args.format == OutputFormat.ndjson:
+        stream_list(args)
+        return
+
+    if args.ics:
+        from .ics import fetch_events
+    elif args.use_async:
+        from .gcal_async import fetch_events
     else:
-        _output("TODO: Figure out the non-alfred output format...")
+        # Imported here as it pulls in the (slow to import) google client
+        # libraries
+        from .gcal import fetch_events
+
+    events: List[MyEvent] = parse_events(fetch_events(args), args)
+    output = render_list(events, args)
+    _output(output)
+    if payload.cacheable(args):
+        _save_payload(args, events, output)
+
+
+def _save_payload(args: Args, events: List[MyEvent], output: str) -> None:
+    """Save the output for nm.py to reuse until something could change, and
+    the events to render it again from after that"""
+    expires_at = events_expire_at(args)
+    # Events that were never cached could be anything by next time.
+    if expires_at is not None:
+        joinable = joinable_events(events)
+        payload.save(args, output, next_change(joinable, args.now), expires_at)
+        snapshot.save(args, joinable, expires_at)
+
+
+def events_expire_at(args: Args) -> Optional[float]:
+    """When (epoch seconds) the cached events for args.calendars are due a
+    refresh, None if they aren't cached"""
+    with EventCache(c.EVENT_CACHE_FILE) as cache:
+        return cache.fresh_until(args.calendars, c.EVENT_CACHE_MAX_AGE_SECONDS)
 
 
 def entrypoint() -> None:
     args: Args = parse_args()
 
+    log.configure(args)
+    if args.profile:
+        profiling.start()
+    try:
+        run_command(args)
+    finally:
+        if args.profile:
+            profiling.finish(args.profile_output, args.profile_format)
+        log.stop()
+
+
+def run_command(args: Args) -> None:
     if args.command == Command.list:
         command_list(args)
     elif args.command == Command.join:
-        _output("TODO: Implement the join command")
+        command_join(args)
+    elif args.command == Command.serve:
+        from .daemon import serve
+
+        serve(args)
+    elif args.command == Command.startup:
+        from .startup import command_startup
+
+        command_startup(args)
+    elif args.command == Command.replay:
+        from .replay import command_replay
+
+        command_replay(args)
     else:
         raise Exception(f"Unknown command: {args.command}")
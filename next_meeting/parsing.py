@@ -1,17 +1,28 @@
+import html
+import logging
+import re
 import textwrap
-from dataclasses import dataclass
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, replace
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
-from urllib.parse import ParseResult, parse_qs, urlparse
-
-from bs4 import BeautifulSoup
+from itertools import repeat
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 from . import constants as c
 from .alfred import Item, ItemIcon
-from .args import Args, OutputFormat, _debug
+from .args import Args, Command, OutputFormat
+from .cache import EventCache
+from .profiling import profiled, span
+from .providers import has_meeting_link, to_native
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever a change to parsing would change the MyEvent we produce
+# for the same raw event, so previously cached results get ignored.
+PARSER_VERSION = 3
 
 
-@dataclass
+@dataclass(slots=True)
 class MyEvent:
     """
     Our version of a GCal event
@@ -29,6 +40,7 @@ class MyEvent:
     is_next_joinable: bool = False
     meeting_link: Optional[str] = None
     icon: Optional[str] = None
+    end: Optional[datetime] = None
 
     def to_item(self) -> Item:
         """Convert this to an Alfred Item for serialization"""
@@ -45,26 +57,6 @@ class MyEvent:
         )
 
 
-def is_zoom_link(value: str) -> bool:
-    return "zoom.us" in value
-
-
-def is_google_meet_link(value: str) -> bool:
-    return "meet.google.com" in value
-
-
-def has_meeting_link(value: str) -> bool:
-    """Given a string (presumably a url), parse the meeting link out of it
-
-    NOTE: this is the link used to join the meeting, so it's a URI in as native
-    a format as possible (zoom links for zoom meetings, not http links)"""
-    if is_zoom_link(value):
-        return True
-    elif is_google_meet_link(value):
-        return True
-    return False
-
-
 def get_meeting_link(event: Dict[str, str], args: Args) -> Optional[str]:
     """Given a parsed GCal event return any found meeting link
 
@@ -73,8 +65,8 @@ def get_meeting_link(event: Dict[str, str], args: Args) -> Optional[str]:
     - conferenceData (conferenceData.entrypoints[].uri)
     - description
 
-    Within each of these, we prefer zoom links over Google meet links (sorry
-    Google).
+    Within each of these, the first link to any of our meeting providers (see
+    providers.py) wins.
 
     Reference: https://developers.google.com/calendar/api/v3/reference/events"""
 
@@ -93,28 +85,79 @@ def get_meeting_link(event: Dict[str, str], args: Args) -> Optional[str]:
         if found:
             return str(found["uri"])
         else:
-            _debug(
-                "Conference data found, but no zoom links in it for "
-                + event["summary"],
-                args.format,
+            logger.debug(
+                "Conference data found, but no zoom links in it for %s",
+                event["summary"],
             )
     else:
-        _debug("No conference data found for " + event["summary"], args.format)
+        logger.debug("No conference data found for %s", event["summary"])
 
-    # Description - any links (parsed as HTML)
+    # Description - any links. A quick scan finds these almost all the time, only
+    # if that comes up empty but there's a meeting link in there somewhere do
+    # we go to the expense of parsing it as HTML.
     description: str = event.get("description", "--empty--")
+    link = find_description_link(description)
+    if link is None and has_meeting_link(description):
+        link = _find_description_link_html(description)
+    if link is None:
+        logger.debug("No zoom links found in description for %s", event["summary"])
+    return link
+
+
+# Either the href of an anchor tag or a bare url. Any other tag is matched (with
+# no group) only so the urls in its attributes, say an <img src>, are skipped.
+_DESCRIPTION_LINK_RE = re.compile(
+    r"""<a\s[^>]*?href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))[^>]*>"""
+    r"""|<[^>]*>"""
+    r"""|(https?://[^\s<>"']+)""",
+    re.IGNORECASE,
+)
+# Punctuation a bare url in running text is usually followed by, rather than
+# ending with.
+_TRAILING_PUNCTUATION = ").,;"
+
+
+def iter_description_links(description: str) -> Iterator[str]:
+    """Lazily yield the links in an event description, in order
+
+    This finds both <a href> values and bare urls in a single pass without
+    building a document tree."""
+    for match in _DESCRIPTION_LINK_RE.finditer(description):
+        *href, url = match.groups()
+        if url is not None:
+            yield html.unescape(url.rstrip(_TRAILING_PUNCTUATION))
+            continue
+        found = next((group for group in href if group is not None), None)
+        if found is not None:
+            yield html.unescape(found)
+
+
+def find_description_link(description: str) -> Optional[str]:
+    """Return the first meeting link in a description (stopping there)"""
+    return next(
+        (
+            link
+            for link in iter_description_links(description)
+            if has_meeting_link(link)
+        ),
+        None,
+    )
+
+
+@profiled("bs4")
+def _find_description_link_html(description: str) -> Optional[str]:
+    """Slow path for find_description_link that fully parses the HTML"""
+    # Imported here as bs4 is slow to import and we rarely get here
+    from bs4 import BeautifulSoup
+
     try:
         soup: BeautifulSoup = BeautifulSoup(description, "html.parser")
         for link in soup.find_all("a"):
             href = link.get("href")
             if has_meeting_link(href):
                 return str(href)
-        _debug(
-            "No zoom links found in description for " + event["summary"], args.format
-        )
     except Exception as e:
-        _debug(f"Error parsing description: {e}", args.format)
-
+        logger.warning("Error parsing description: %s", e)
     return None
 
 
@@ -128,29 +171,6 @@ def get_icon(summary: str) -> str:
     return "icon.png"
 
 
-def convert_to_zoom_protocol(url: str) -> str:
-    """Take the incoming url and convert it to a zoom protocol url
-
-    Convert this:
-      https://example.zoom.us/j/1234?pwd=abcd
-    to this
-      zoommtg://example.zoom.us/join?action=join&confno=1234&pwd=abcd
-
-    This is so you can delegate to the OS to open a zoom meeting directly in the
-    app instead of going through the browser to then open zoom.
-    """
-    parsed: ParseResult = urlparse(url)
-    hostname: Optional[str] = parsed.hostname
-    confno: str = parsed.path.split("/")[-1]
-    qargs: Dict[str, List[str]] = parse_qs(parsed.query)
-
-    zoom_url = [f"zoommtg://{hostname}/join?action=join&confno=", confno]
-    if "pwd" in qargs:
-        zoom_url.extend(["&pwd=", qargs["pwd"][0]])
-
-    return "".join(zoom_url)
-
-
 def parse_event_datetime(d: Dict[str, str]) -> Optional[datetime]:
     datetime_or_date = d.get("dateTime", d.get("date"))
     # TODO: deal with timezones...
@@ -170,60 +190,265 @@ def is_not_day_only(event: Dict[str, str]) -> bool:
     return "date" not in event["start"]
 
 
-def parse_event(event: Dict[str, Any], args: Args) -> MyEvent:
-    """Parses a single GCal event"""
+def update_event_times(event: MyEvent, now: datetime) -> MyEvent:
+    """(Re)compute the attributes of an event that depend on the current time
+
+    These are the only parts of an event that change as time passes, so a
+    long-running process can call this instead of re-parsing the raw event."""
+    start = event.start
+    end = event.end
+    is_not_day = event.is_not_day_event
+    # If start/end are None this evaluates to None.
+    in_progress = is_not_day and start and end and start <= now and end >= now or False
+    is_next_joinable = False
+    if is_not_day and not in_progress and start and start > now:
+        delta = start - now
+        is_next_joinable = delta < timedelta(minutes=c.JOINABLE_IF_NEXT_STARTS_WITHIN)
+
+    event.in_progress = in_progress
+    event.is_next_joinable = is_next_joinable
+    return event
+
+
+def parse_event_details(event: Dict[str, Any], args: Args) -> MyEvent:
+    """Parses the parts of a single GCal event that don't depend on the time
+
+    The in_progress/is_next_joinable flags are left unset, see
+    update_event_times."""
     id = event["id"]
 
     start = parse_event_datetime(event["start"])
     end = parse_event_datetime(event["end"])
     is_not_day = is_not_day_only(event)
-    # If start/end are None this evaluates to None.
-    in_progress = (
-        is_not_day and start and end and start <= args.now and end >= args.now or False
-    )
-    is_next_joinable = False
-    if is_not_day and not in_progress and start and start > args.now:
-        delta = start - args.now
-        is_next_joinable = delta < timedelta(minutes=c.JOINABLE_IF_NEXT_STARTS_WITHIN)
 
     summary = event["summary"]
 
     meeting_link: str | None = get_meeting_link(event, args)
-    if meeting_link and is_zoom_link(meeting_link):
-        # Convert from a https link to a zoom meeting (which will just open a
-        # tab you have to close later, convert it to the native protocol to open
-        # the app directly)
-        meeting_link = convert_to_zoom_protocol(meeting_link)
+    if meeting_link:
+        # A https link to (say) a zoom meeting will just open a tab you have to
+        # close later, convert it to the native protocol to open the app
+        # directly.
+        meeting_link = to_native(meeting_link)
 
     icon = get_icon(summary)
 
     return MyEvent(
         id=id,
         start=start,
+        end=end,
         summary=summary,
         is_not_day_event=is_not_day,
         meeting_link=meeting_link,
-        in_progress=in_progress,
-        is_next_joinable=is_next_joinable,
         icon=icon,
     )
 
 
-def parse_events(events: List[Dict[str, str]], args: Args) -> List[MyEvent]:
+CacheKey = Tuple[str, str]
+
+
+def _cache_key(event: Dict[str, Any]) -> Optional[CacheKey]:
+    """Events are identified by their id, and change whenever their etag does"""
+    if "id" in event and "etag" in event:
+        return event["id"], event["etag"]
+    return None
+
+
+def _event_to_dict(event: MyEvent) -> Dict[str, Any]:
+    d = asdict(event)
+    for name in ("start", "end"):
+        d[name] = d[name] and d[name].isoformat()
+    return d
+
+
+def _event_from_dict(d: Dict[str, Any]) -> MyEvent:
+    times = {
+        name: datetime.fromisoformat(d[name]) if d[name] else None
+        for name in ("start", "end")
+    }
+    return MyEvent(**{**d, **times})
+
+
+class ParsedEventCache:
+    """Bounded LRU of parsed events keyed by GCal id + etag
+
+    Only the time independent parts of an event are cached (see
+    parse_event_details) so an unchanged event never needs to be parsed again,
+    no matter what time it is. It can be loaded from and saved to the event
+    cache so this carries across runs."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._events: OrderedDict[CacheKey, MyEvent] = OrderedDict()
+        # Keys added since the last save
+        self._unsaved: Set[CacheKey] = set()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def get(self, key: CacheKey) -> Optional[MyEvent]:
+        event = self._events.get(key)
+        if event is not None:
+            self._events.move_to_end(key)
+        return event
+
+    def put(self, key: CacheKey, event: MyEvent) -> None:
+        self._add(key, event)
+        self._unsaved.add(key)
+
+    def _add(self, key: CacheKey, event: MyEvent) -> None:
+        self._events[key] = event
+        self._events.move_to_end(key)
+        while len(self._events) > self.max_size:
+            self._events.popitem(last=False)
+
+    def load(self, db: EventCache, keys: Iterable[CacheKey]) -> None:
+        """Pull in anything we don't already have in memory from disk"""
+        missing = [key for key in keys if key not in self._events]
+        for key, d in db.parsed_events(missing, PARSER_VERSION).items():
+            self._add(key, _event_from_dict(d))
+
+    def save(self, db: EventCache) -> None:
+        """Write anything newly parsed to disk"""
+        unsaved = {
+            key: _event_to_dict(self._events[key])
+            for key in self._unsaved
+            if key in self._events
+        }
+        if unsaved:
+            db.save_parsed_events(unsaved, PARSER_VERSION, self.max_size)
+        self._unsaved.clear()
+
+
+_parsed_events = ParsedEventCache(c.PARSED_EVENT_CACHE_SIZE)
+
+
+def parse_event(event: Dict[str, Any], args: Args) -> MyEvent:
+    """Parses a single GCal event"""
+    key = _cache_key(event)
+    details = _parsed_events.get(key) if key else None
+    if details is None:
+        details = parse_event_details(event, args)
+        if key:
+            _parsed_events.put(key, details)
+    return update_event_times(replace(details), args.now)
+
+
+@profiled("parse_events")
+def parse_events(events: List[Dict[str, Any]], args: Args) -> List[MyEvent]:
     """Converts a list of Google calendar events into a List of MyEvents
 
     Each GCal event is stored in a dict and each one will be converted to a
-    MyEvent whether or not it has a meeting in it or not.
+    MyEvent whether or not it has a meeting in it or not. Events parsed on a
+    previous run (and unchanged since) are pulled from the event cache.
     """
-
-    def augment(event: Dict[str, str]) -> MyEvent:
-        return parse_event(event, args)
-
-    return list(map(augment, events))
+    keys = [key for key in map(_cache_key, events) if key]
+    if not keys or not _saves_parsed_events(args):
+        return _parse_events(events, args)
+
+    with EventCache(c.EVENT_CACHE_FILE) as db:
+        with span("load parsed events"):
+            _parsed_events.load(db, keys)
+        parsed = _parse_events(events, args)
+        with span("save parsed events"):
+            _parsed_events.save(db)
+    return parsed
+
+
+def iter_parsed_events(
+    events: Iterable[Dict[str, Any]], args: Args
+) -> Iterator[MyEvent]:
+    """parse_events, but one at a time as each event arrives"""
+    if not _saves_parsed_events(args):
+        yield from (parse_event(event, args) for event in events)
+        return
+    with EventCache(c.EVENT_CACHE_FILE) as db:
+        try:
+            for event in events:
+                key = _cache_key(event)
+                if key:
+                    _parsed_events.load(db, [key])
+                yield parse_event(event, args)
+        finally:
+            _parsed_events.save(db)
+
+
+def _saves_parsed_events(args: Args) -> bool:
+    """Parsed events are saved alongside google's in the event cache, --ics runs
+    never touch it (they only keep them in memory)"""
+    return not args.ics
+
+
+def _parse_events(events: List[Dict[str, Any]], args: Args) -> List[MyEvent]:
+    """parse_event for each event, but with everything that isn't in the
+    parsed event cache parsed in one go (see parse_events_details)"""
+    details: List[Optional[MyEvent]] = []
+    unparsed: List[int] = []
+    for i, event in enumerate(events):
+        key = _cache_key(event)
+        found = _parsed_events.get(key) if key else None
+        if found is None:
+            unparsed.append(i)
+        details.append(found)
+
+    parsed = parse_events_details([events[i] for i in unparsed], args)
+    for i, event_details in zip(unparsed, parsed):
+        details[i] = event_details
+        key = _cache_key(events[i])
+        if key:
+            _parsed_events.put(key, event_details)
+
+    return [update_event_times(replace(d), args.now) for d in details if d]
+
+
+def parse_events_details(events: List[Dict[str, Any]], args: Args) -> List[MyEvent]:
+    """parse_event_details for each event, in order
+
+    With args.jobs > 1, and at least PARALLEL_PARSE_MIN_EVENTS events, they're
+    parsed in chunks across that many processes. Below that, starting the
+    processes and shipping the events over costs more than it saves."""
+    if args.jobs <= 1 or len(events) < c.PARALLEL_PARSE_MIN_EVENTS:
+        return [parse_event_details(e, args) for e in events]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    size = c.PARALLEL_PARSE_CHUNK_SIZE
+    chunks = [
+        [_parsed_fields(e) for e in events[i : i + size]]
+        for i in range(0, len(events), size)
+    ]
+    with span("parse in parallel"), ProcessPoolExecutor(args.jobs) as pool:
+        parsed = pool.map(_parse_chunk, chunks, repeat(args.format))
+        return [e for chunk in parsed for e in chunk]
+
+
+def _parse_chunk(events: List[Dict[str, Any]], format: OutputFormat) -> List[MyEvent]:
+    args = Args(command=Command.list, format=format)
+    return [parse_event_details(e, args) for e in events]
+
+
+# The parts of a raw event that parse_event_details looks at.
+_PARSED_FIELDS = ("id", "start", "end", "summary", "location", "description")
+# Everything parse_event reads from a raw event (the parsed event cache is keyed
+# by etag), in the syntax of the API's fields parameter.
+EVENT_FIELDS = _PARSED_FIELDS + ("etag", "conferenceData(entryPoints(uri))")
+
+
+def _parsed_fields(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Just the parts of an event we need to parse it, to keep what we send to
+    other processes small"""
+    fields = {name: event[name] for name in _PARSED_FIELDS if name in event}
+    if "conferenceData" in event:
+        entry_points = event["conferenceData"].get("entryPoints", [])
+        fields["conferenceData"] = dict(
+            entryPoints=[dict(uri=ep.get("uri", "")) for ep in entry_points]
+        )
+    return fields
 
 
-def _debug_event_list(events: List[MyEvent], format: OutputFormat) -> None:
+def _debug_event_list(events: List[MyEvent]) -> None:
     """Debug each event in a well formatted manner"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
     for event in events:
         event_string = f"""\
         Event: {event.id}
@@ -231,4 +456,4 @@ def _debug_event_list(events: List[MyEvent], format: OutputFormat) -> None:
           Start  : {event.start}
           Markers: {event.is_not_day_event} | {event.in_progress} | {event.is_next_joinable}
           Link   : {event.meeting_link}"""  # noqa: E501
-        _debug(textwrap.dedent(event_string), format)
+        logger.debug(textwrap.dedent(event_string))
@@ -0,0 +1,108 @@
+import io
+import json
+import os
+import time
+from contextlib import redirect_stderr, redirect_stdout
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from . import constants as c
+
+if TYPE_CHECKING:
+    from .args import Args
+
+# The rendered output of the list command, saved so a repeat run can skip
+# everything else. Like client.py, nm.py checks this before importing anything
+# else so it must stay cheap.
+#
+# The output only changes when the events do or when time crosses a boundary (a
+# meeting becoming joinable, starting or ending). So a snapshot is good until
+# the next boundary (and never past the window it was rendered for), or until
+# the events it was rendered from are due to be refreshed
+# (EVENT_CACHE_MAX_AGE_SECONDS), whichever comes first.
+
+
+def cacheable(args: "Args") -> bool:
+    """Only Alfred output is cached, stdout output has debugging mixed in
+
+    Nor is output from --ics calendars, which we can't tell have changed."""
+    from .args import Command, OutputFormat
+
+    return (
+        args.command == Command.list
+        and args.format == OutputFormat.alfred
+        and not args.ics
+    )
+
+
+def _key(args: "Args") -> Dict[str, Any]:
+    return dict(
+        command=args.command.value, format=args.format.value, calendars=args.calendars
+    )
+
+
+def load(args: "Args") -> Optional[str]:
+    """The saved output for these arguments, if it's still good"""
+    if args.refresh or not cacheable(args):
+        return None
+    try:
+        with open(c.PAYLOAD_CACHE_FILE) as f:
+            snapshot = json.load(f)
+        if snapshot["key"] != _key(args) or time.time() >= snapshot["expires_at"]:
+            return None
+        if args.now < datetime.fromisoformat(snapshot["now"]):
+            return None
+        if args.now >= datetime.fromisoformat(snapshot["valid_until"]):
+            return None
+    except (OSError, KeyError, TypeError, ValueError):
+        # TypeError is comparing naive and aware times, from -n
+        return None
+    return str(snapshot["output"])
+
+
+def save(
+    args: "Args", output: str, valid_until: Optional[datetime], expires_at: float
+) -> None:
+    """Save the output, good from args.now until valid_until and the
+    expires_at wall clock time (epoch seconds)
+
+    Never past the window it was rendered for (HOURS_AHEAD from args.now),
+    even if nothing in it changes (valid_until is None)."""
+    window_max = args.now + timedelta(hours=c.HOURS_AHEAD)
+    if valid_until is None or valid_until > window_max:
+        valid_until = window_max
+    snapshot = dict(
+        key=_key(args),
+        now=args.now.isoformat(),
+        valid_until=valid_until.isoformat(),
+        expires_at=expires_at,
+        output=output,
+    )
+    tmp = f"{c.PAYLOAD_CACHE_FILE}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, c.PAYLOAD_CACHE_FILE)
+
+
+def parse_quietly(argv: List[str]) -> Optional["Args"]:
+    """Parse nm.py's command line without printing anything
+
+    None if the arguments are bad, or ask for something argparse prints and
+    exits on (--help), either way that's left to the real run."""
+    from .args import parse_args
+
+    try:
+        with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+            return parse_args(argv)
+    except SystemExit:
+        return None
+
+
+def cached_output(argv: List[str]) -> Optional[str]:
+    """The saved output for these command line arguments, if it's still good"""
+    if not os.path.exists(c.PAYLOAD_CACHE_FILE):
+        return None
+    args = parse_quietly(argv)
+    if args is None:
+        return None
+    return load(args)
@@ -0,0 +1,205 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+from functools import wraps
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    TypeVar,
+    cast,
+)
+
+from .args import ProfileFormat
+
+# Opt-in (--profile) timing of the stages of a run: auth, building the service,
+# API calls, parsing, deciding what to join and serializing. When profiling is
+# off, span() hands back a shared do-nothing context manager and profiled()
+# functions call straight through, so the instrumentation can stay in place.
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+@dataclass
+class Span:
+    name: str
+    # Nanoseconds since profiling started
+    start: int
+    duration: int
+    thread_id: int
+    thread_name: str
+    # How many spans this one is nested within (on the same thread)
+    depth: int
+
+
+class Profiler:
+    """Collects timed spans from any thread"""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter_ns()
+        self.stopped: Optional[int] = None
+        self.spans: List[Span] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        depth: int = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter_ns() - start
+            self._local.depth = depth
+            thread = threading.current_thread()
+            with self._lock:
+                self.spans.append(
+                    Span(
+                        name,
+                        start - self.started,
+                        duration,
+                        thread.ident or 0,
+                        thread.name,
+                        depth,
+                    )
+                )
+
+    def stop(self) -> None:
+        self.stopped = time.perf_counter_ns()
+
+    @property
+    def total(self) -> int:
+        """Nanoseconds from start to stop (or now, if still running)"""
+        return (self.stopped or time.perf_counter_ns()) - self.started
+
+    def stages(self) -> List[Dict[str, Any]]:
+        """Spans totalled by name, in the order each was first started"""
+        stages: Dict[str, Dict[str, Any]] = {}
+        for s in sorted(self.spans, key=lambda s: s.start):
+            stage = stages.setdefault(
+                s.name, dict(name=s.name, calls=0, total_ms=0.0, depth=s.depth)
+            )
+            stage["calls"] += 1
+            stage["total_ms"] += s.duration / 1e6
+            stage["depth"] = min(stage["depth"], s.depth)
+        return list(stages.values())
+
+    def breakdown(self) -> str:
+        """Human readable per-stage timings"""
+        total_ms = self.total / 1e6
+        lines = [f"{'stage':<40} {'calls':>6} {'total':>11} {'%':>6}"]
+        for stage in self.stages():
+            name = "  " * stage["depth"] + stage["name"]
+            percent = 100 * stage["total_ms"] / total_ms if total_ms else 0
+            lines.append(
+                f"{name:<40} {stage['calls']:>6} {stage['total_ms']:>9.2f}ms"
+                f" {percent:>5.1f}%"
+            )
+        lines.append(f"{'total':<40} {'':>6} {total_ms:>9.2f}ms")
+        return "\n".join(lines)
+
+    def to_json(self) -> Dict[str, Any]:
+        return dict(
+            total_ms=self.total / 1e6,
+            stages=self.stages(),
+            spans=[asdict(s) for s in self.spans],
+        )
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """The spans in Chrome's trace event format, for chrome://tracing or
+        https://ui.perfetto.dev
+
+        Reference: https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+        """  # noqa: E501
+        pid = os.getpid()
+        events: List[Dict[str, Any]] = [
+            dict(
+                name="thread_name",
+                ph="M",
+                pid=pid,
+                tid=thread_id,
+                args=dict(name=thread_name),
+            )
+            for thread_id, thread_name in {
+                (s.thread_id, s.thread_name) for s in self.spans
+            }
+        ]
+        events.extend(
+            dict(
+                name=s.name,
+                ph="X",
+                ts=s.start / 1e3,
+                dur=s.duration / 1e3,
+                pid=pid,
+                tid=s.thread_id,
+            )
+            for s in self.spans
+        )
+        return dict(traceEvents=events, displayTimeUnit="ms")
+
+    def write(self, path: str, format: ProfileFormat) -> None:
+        if format == ProfileFormat.chrome:
+            report = self.to_chrome_trace()
+        else:
+            report = self.to_json()
+        with open(path, "w") as f:
+            json.dump(report, f)
+
+
+_profiler: Optional[Profiler] = None
+_NOT_PROFILING: ContextManager[None] = nullcontext()
+
+
+def start() -> Profiler:
+    """Start recording spans"""
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def finish(output: Optional[str], format: ProfileFormat) -> Optional[Profiler]:
+    """Stop recording, print the breakdown to stderr and optionally write the
+    full profile to a file"""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return None
+    profiler.stop()
+    print(profiler.breakdown(), file=sys.stderr)
+    if output:
+        profiler.write(output, format)
+    return profiler
+
+
+def span(name: str) -> ContextManager[None]:
+    """Time the enclosed block as the named stage"""
+    profiler = _profiler
+    if profiler is None:
+        return _NOT_PROFILING
+    return profiler.span(name)
+
+
+def profiled(name: str) -> Callable[[F], F]:
+    """Decorator timing every call to a function as the named stage"""
+
+    def decorate(fn: F) -> F:
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            profiler = _profiler
+            if profiler is None:
+                return fn(*args, **kwargs)
+            with profiler.span(name):
+                return fn(*args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorate
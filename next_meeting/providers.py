@@ -0,0 +1,154 @@
+import re
+from dataclasses import dataclass
+from itertools import groupby
+from typing import Callable, Dict, List, Optional, Pattern, Sequence, Tuple
+from urllib.parse import ParseResult, parse_qs, urlparse
+
+# The meeting providers we know how to find (and join) links for.
+#
+# Every provider's markers are compiled into a single regex, so a string is
+# scanned once however many providers there are, rather than once per provider.
+# The regex is anchored on the "." every marker (hostname) has, which re finds
+# with a fast search, and from there is a trie of what can follow it. So the
+# cost of a scan stays flat as providers are added (see
+# benchmarks/bench_providers.py), where a plain alternation of the markers
+# would try every one of them at every character.
+
+
+@dataclass(frozen=True)
+class Provider:
+    name: str
+    # Something (a hostname) only found in this provider's meeting links
+    markers: Tuple[str, ...]
+    # Convert a (https) meeting link to one that opens the provider's app
+    # directly, if it has its own protocol
+    to_native: Optional[Callable[[str], str]] = None
+
+
+_providers: List[Provider] = []
+_by_marker: Dict[str, Provider] = {}
+# Matches nothing until something is registered
+_matcher: Pattern[str] = re.compile(r"(?!)")
+
+
+def register(provider: Provider) -> Provider:
+    """Add a provider, whose links will be found from now on"""
+    global _matcher
+    for marker in provider.markers:
+        if "." not in marker:
+            raise ValueError(f"Provider markers must be hostnames, not {marker!r}")
+    _providers.append(provider)
+    for marker in provider.markers:
+        _by_marker[marker] = provider
+    _matcher = _compile(list(_by_marker))
+    return provider
+
+
+def providers() -> List[Provider]:
+    return list(_providers)
+
+
+def _compile(markers: Sequence[str]) -> Pattern[str]:
+    """A regex matching the first "." of any of the markers, through to the
+    end of it"""
+    # What follows the "." (the rest of the hostname), and what comes before it
+    tails: Dict[str, List[str]] = {}
+    for marker in markers:
+        head, tail = marker.split(".", 1)
+        tails.setdefault(tail, []).append(head)
+    return re.compile(r"\." + _trie(sorted(tails.items()), 0))
+
+
+def _trie(tails: List[Tuple[str, List[str]]], depth: int) -> str:
+    """Match any of these (sorted) tails, from depth characters in
+
+    Once a whole tail has matched, look behind for one of its heads."""
+    if len(tails) == 1:
+        # Nothing left to branch on
+        tail, heads = tails[0]
+        return re.escape(tail[depth:]) + _behind(tail, heads)
+    branches = [_behind(tail, heads) for tail, heads in tails if len(tail) == depth]
+    longer = [(tail, heads) for tail, heads in tails if len(tail) > depth]
+    for char, group in groupby(longer, key=lambda t: t[0][depth]):
+        branches.append(re.escape(char) + _trie(list(group), depth + 1))
+    return f"(?:{'|'.join(branches)})"
+
+
+def _behind(tail: str, heads: List[str]) -> str:
+    tail = re.escape(tail)
+    return "(?:{})".format("|".join(rf"(?<={re.escape(h)}\.{tail})" for h in heads))
+
+
+def find_provider(value: str) -> Optional[Provider]:
+    """The provider of the first meeting link in value, if there is one"""
+    match = _matcher.search(value)
+    if match is None:
+        return None
+    # Which of the markers with this tail it was
+    tail = match.group()[1:]
+    for marker, provider in _by_marker.items():
+        if marker.endswith(f".{tail}") and value.endswith(marker, 0, match.end()):
+            return provider
+    return None
+
+
+def has_meeting_link(value: str) -> bool:
+    """Is there a link to a meeting (with any provider) in value?"""
+    return _matcher.search(value) is not None
+
+
+def to_native(link: str) -> str:
+    """Convert a meeting link to open the provider's app directly, where it
+    has a protocol of its own (otherwise it's left as it is)
+
+    This is the link used to join the meeting, which we want in as native a
+    format as possible (zoom links for zoom meetings, not http links). Links
+    already using the provider's protocol are left alone."""
+    provider = find_provider(link)
+    if provider is None or provider.to_native is None:
+        return link
+    if urlparse(link).scheme not in ("http", "https"):
+        return link
+    return provider.to_native(link)
+
+
+def convert_to_zoom_protocol(url: str) -> str:
+    """Take the incoming url and convert it to a zoom protocol url
+
+    Convert this:
+      https://example.zoom.us/j/1234?pwd=abcd
+    to this
+      zoommtg://example.zoom.us/join?action=join&confno=1234&pwd=abcd
+
+    This is so you can delegate to the OS to open a zoom meeting directly in the
+    app instead of going through the browser to then open zoom.
+    """
+    parsed: ParseResult = urlparse(url)
+    hostname: Optional[str] = parsed.hostname
+    confno: str = parsed.path.split("/")[-1]
+    qargs: Dict[str, List[str]] = parse_qs(parsed.query)
+
+    zoom_url = [f"zoommtg://{hostname}/join?action=join&confno=", confno]
+    if "pwd" in qargs:
+        zoom_url.extend(["&pwd=", qargs["pwd"][0]])
+
+    return "".join(zoom_url)
+
+
+def convert_to_teams_protocol(url: str) -> str:
+    """https://teams.microsoft.com/l/meetup-join/... to msteams:/l/meetup-join/..."""
+    parsed = urlparse(url)
+    return parsed._replace(scheme="msteams", netloc="").geturl()
+
+
+def convert_to_chime_protocol(url: str) -> str:
+    """https://chime.aws/1234567890 to chime://meeting?pin=1234567890"""
+    pin = urlparse(url).path.strip("/").split("/")[-1]
+    return f"chime://meeting?pin={pin}"
+
+
+ZOOM = register(Provider("zoom", ("zoom.us",), convert_to_zoom_protocol))
+GOOGLE_MEET = register(Provider("google meet", ("meet.google.com",)))
+TEAMS = register(Provider("teams", ("teams.microsoft.com",), convert_to_teams_protocol))
+WEBEX = register(Provider("webex", ("webex.com",)))
+CHIME = register(Provider("chime", ("chime.aws",), convert_to_chime_protocol))
@@ -0,0 +1,110 @@
+import json
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from . import constants as c
+from .args import Args, NextMeetingOptions, _output
+from .batch import EventBatch
+from .parsing import MyEvent, parse_events_details
+
+# Offline evaluation of what we'd decide to join, over many times at once,
+# from recorded events (e.g. tests/events/*.json, or a log with the
+# DEBUG_RAW_EVENTS dump in it). Handy for regression testing changes to the
+# decision making without waiting for the right moment on a live calendar.
+
+
+@dataclass
+class Decision:
+    """What we decided from this time on (until the next Decision)"""
+
+    at: datetime
+    option: NextMeetingOptions
+    event: Optional[MyEvent] = None
+
+    def same_as(self, other: "Decision") -> bool:
+        """Is this the same decision (at whatever time)?"""
+        return self.option == other.option and _id(self.event) == _id(other.event)
+
+    def __str__(self) -> str:
+        line = f"{self.at.isoformat()}  {self.option.value:<16}"
+        if self.event:
+            line += f"  {self.event.summary}  {self.event.meeting_link}"
+        return line
+
+
+def _id(event: Optional[MyEvent]) -> Optional[str]:
+    return event.id if event else None
+
+
+# What gcal.debug_raw_events logs ahead of each response.
+_LOGGED_RESPONSE = "Raw results from google api: "
+
+
+def load_events(path: str) -> List[Dict[str, Any]]:
+    """Read recorded events: an events.list response, a list of events, a
+    single event or a log with DEBUG_RAW_EVENTS responses in it"""
+    with open(path) as f:
+        text = f.read()
+    try:
+        recorded = json.loads(text)
+    except ValueError:
+        return _logged_events(path, text)
+    if isinstance(recorded, list):
+        return recorded
+    if "items" in recorded:
+        return list(recorded["items"])
+    return [recorded]
+
+
+def _logged_events(path: str, log: str) -> List[Dict[str, Any]]:
+    """The events in every response logged by gcal.debug_raw_events
+
+    Later responses (the next page, or changes from an incremental sync) win
+    over earlier ones for the same event, and cancelled events are dropped."""
+    events: Dict[str, Dict[str, Any]] = {}
+    found = False
+    for line in log.splitlines():
+        _, logged, response = line.partition(_LOGGED_RESPONSE)
+        if logged:
+            found = True
+            for event in json.loads(response).get("items", []):
+                events[event["id"]] = event
+    if not found:
+        raise ValueError(f"No recorded events in {path}")
+    return [e for e in events.values() if e.get("status") != "cancelled"]
+
+
+def times(start: datetime, until: datetime, every: timedelta) -> Iterator[datetime]:
+    """Every `every` from start up to and including until"""
+    at = start
+    while at <= until:
+        yield at
+        at += every
+
+
+def replay(events: Iterable[MyEvent], at: Iterable[datetime]) -> List[Decision]:
+    """The timeline of decisions at each of these (ascending) times
+
+    Only changes are kept, so each Decision holds until the next one."""
+    batch = EventBatch(events, horizon=timedelta(hours=c.HOURS_AHEAD))
+    timeline: List[Decision] = []
+    for now in at:
+        decision = Decision(now, *batch.find_meeting_to_join(now))
+        if not timeline or not timeline[-1].same_as(decision):
+            timeline.append(decision)
+    return timeline
+
+
+def command_replay(args: Args) -> None:
+    """Implement the replay command"""
+    raw = [e for path in args.events_files for e in load_events(path)]
+    # Parsed once, only the time based flags depend on "now"
+    events = parse_events_details(raw, args)
+    if args.at:
+        at: Iterable[datetime] = sorted(args.at)
+    else:
+        until = args.until or args.now + timedelta(hours=c.HOURS_AHEAD)
+        at = times(args.now, until, timedelta(minutes=args.every))
+    for decision in replay(events, at):
+        _output(str(decision))
@@ -0,0 +1,296 @@
+import io
+import json
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Iterable, List, Optional, Tuple
+
+from . import constants as c
+from . import payload
+from .args import NextMeetingOptions
+from .batch import _NO_END, _NO_START, _datetime, _offset, _timestamp
+from .parsing import MyEvent, update_event_times
+
+if TYPE_CHECKING:
+    from .args import Args
+
+# The joinable events from the last refresh, in a compact binary file that a
+# cold nm.py run can answer from without fetching or parsing anything. It's
+# read through mmap and deciding what to join is a few binary searches over the
+# record table, so only the events actually shown are decoded.
+#
+# Layout (little endian):
+#   header   _HEADER: magic, version, record count, when it was written and
+#            until when it's good for (like payload.py), the longest event,
+#            when the last event ends and where the key is in the string pool
+#   records  _RECORD each, fixed width and in start order: start/end (epoch
+#            seconds), their UTC offsets, flags, and (offset, length) of the
+#            id, summary, meeting link and icon in the string pool
+#   strings  UTF-8, back to back
+
+_MAGIC = b"NMSNAP\r\n"
+# Bump when the layout changes, old files are then ignored.
+_VERSION = 1
+_HEADER = struct.Struct("<8sIIddqqII")
+_RECORD = struct.Struct("<qqiiI4xIIIIIIII")
+_START = struct.Struct("<q")
+# Record flags
+# It has both a start and an end, in that order, so can be in progress.
+_TIMED = 1
+_HAS_LINK = 2
+_HAS_ICON = 4
+
+
+def _key(args: "Args") -> str:
+    return json.dumps(args.calendars)
+
+
+def save(args: "Args", events: Iterable[MyEvent], expires_at: float) -> None:
+    """Save these (joinable) events as of args.now, good until the expires_at
+    wall clock time (epoch seconds)"""
+    ordered = sorted(events, key=lambda e: _timestamp(e.start, _NO_START))
+    strings = io.BytesIO()
+
+    def add(value: Optional[str]) -> Tuple[int, int]:
+        data = (value or "").encode()
+        offset = strings.tell()
+        strings.write(data)
+        return offset, len(data)
+
+    records = []
+    longest = 0
+    open_until = _NO_START
+    for e in ordered:
+        start = _timestamp(e.start, _NO_START)
+        end = _timestamp(e.end, _NO_END)
+        timed = bool(e.start and e.end and e.end >= e.start)
+        if timed:
+            longest = max(longest, end - start)
+        open_until = max(open_until, end)
+        flags = (
+            (_TIMED if timed else 0)
+            | (_HAS_LINK if e.meeting_link is not None else 0)
+            | (_HAS_ICON if e.icon is not None else 0)
+        )
+        records.append(
+            _RECORD.pack(
+                start,
+                end,
+                _offset(e.start),
+                _offset(e.end),
+                flags,
+                *add(e.id),
+                *add(e.summary),
+                *add(e.meeting_link),
+                *add(e.icon),
+            )
+        )
+    key = add(_key(args))
+    header = _HEADER.pack(
+        _MAGIC,
+        _VERSION,
+        len(records),
+        args.now.timestamp(),
+        expires_at,
+        longest,
+        open_until,
+        *key,
+    )
+
+    tmp = f"{c.SNAPSHOT_FILE}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.writelines(records)
+        f.write(strings.getbuffer())
+    os.replace(tmp, c.SNAPSHOT_FILE)
+
+
+class _Starts:
+    """The start column of the record table, as a sequence for bisect"""
+
+    def __init__(self, snapshot: "Snapshot") -> None:
+        self._buffer = snapshot._buffer
+        self._len = len(snapshot)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, i: int) -> int:
+        (start,) = _START.unpack_from(self._buffer, _HEADER.size + i * _RECORD.size)
+        return int(start)
+
+
+class Snapshot:
+    """A saved snapshot, mapped into memory
+
+    Answers the same questions as EventIndex (over the joinable events) without
+    decoding any more of the file than it has to."""
+
+    def __init__(self, path: str) -> None:
+        """Raises ValueError if the file isn't a snapshot we can read"""
+        with open(path, "rb") as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._buffer) < _HEADER.size:
+                raise ValueError(f"{path} is truncated")
+            (
+                magic,
+                version,
+                self._len,
+                self.now,
+                self.expires_at,
+                self._longest,
+                self._open_until,
+                *key,
+            ) = _HEADER.unpack_from(self._buffer)
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError(f"{path} isn't a snapshot (or is an old one)")
+            self._strings = _HEADER.size + self._len * _RECORD.size
+            if self._strings > len(self._buffer):
+                raise ValueError(f"{path} is truncated")
+            self.key = self._string(*key)
+        except ValueError:
+            self.close()
+            raise
+        self._starts = _Starts(self)
+        self._joinable_within = c.JOINABLE_IF_NEXT_STARTS_WITHIN * 60
+
+    def close(self) -> None:
+        self._buffer.close()
+
+    def __enter__(self) -> "Snapshot":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return int(self._len)
+
+    def _string(self, offset: int, length: int) -> str:
+        start = self._strings + offset
+        if start + length > len(self._buffer):
+            raise ValueError("String outside of the snapshot")
+        return self._buffer[start : start + length].decode()
+
+    def _record(self, i: int) -> Tuple[int, ...]:
+        return _RECORD.unpack_from(self._buffer, _HEADER.size + i * _RECORD.size)
+
+    def end(self, i: int) -> int:
+        """The i'th event's end (epoch seconds, far in the future if it has
+        none)"""
+        return self._record(i)[1]
+
+    def event(self, i: int) -> MyEvent:
+        """Decode the i'th event (in start order)"""
+        start, end, start_offset, end_offset, flags, *strings = self._record(i)
+        id, summary, link, icon = (
+            self._string(offset, length)
+            for offset, length in zip(strings[::2], strings[1::2])
+        )
+        return MyEvent(
+            id=id,
+            start=_datetime(start, start_offset, _NO_START),
+            summary=summary,
+            meeting_link=link if flags & _HAS_LINK else None,
+            icon=icon if flags & _HAS_ICON else None,
+            end=_datetime(end, end_offset, _NO_END),
+        )
+
+    def events_at(self, now: datetime) -> List[MyEvent]:
+        """The events that haven't ended by now, with their time based
+        attributes set for it"""
+        timestamp = now.timestamp()
+        return [
+            update_event_times(self.event(i), now)
+            for i in range(len(self))
+            if self.end(i) >= timestamp
+        ]
+
+    def in_progress(self, now: float) -> List[int]:
+        """Positions of the events that have started and not yet ended
+        (inclusive) at now (epoch seconds)"""
+        hi = bisect_right(self._starts, now)
+        lo = bisect_left(self._starts, now - self._longest, hi=hi)
+        found = []
+        for i in range(lo, hi):
+            _, end, _, _, flags, *_ = self._record(i)
+            if flags & _TIMED and end >= now:
+                found.append(i)
+        return found
+
+    def starting_soon(self, now: float) -> List[int]:
+        """Positions of the events starting within
+        JOINABLE_IF_NEXT_STARTS_WITHIN of now (epoch seconds)"""
+        lo = bisect_right(self._starts, now)
+        hi = bisect_left(self._starts, now + self._joinable_within, lo=lo)
+        return list(range(lo, hi))
+
+    def find_meeting_to_join(
+        self, now: datetime
+    ) -> Tuple[NextMeetingOptions, Optional[MyEvent]]:
+        """main.find_meeting_to_join, for any time"""
+        timestamp = now.timestamp()
+        for found in (self.starting_soon(timestamp), self.in_progress(timestamp)):
+            if len(found) == 1:
+                return NextMeetingOptions.FoundNextMeeting, update_event_times(
+                    self.event(found[0]), now
+                )
+        if self._len and self._open_until >= timestamp:
+            return NextMeetingOptions.MultipleOptions, None
+        return NextMeetingOptions.NoOptions, None
+
+
+def load(args: "Args") -> Optional[Snapshot]:
+    """The saved snapshot, if it can answer for these arguments"""
+    if args.refresh or not payload.cacheable(args):
+        return None
+    try:
+        snapshot = Snapshot(c.SNAPSHOT_FILE)
+    except (OSError, ValueError):
+        return None
+    # Events that ended before it was written aren't in it, nor any starting
+    # past its window.
+    window_max = snapshot.now + timedelta(hours=c.HOURS_AHEAD).total_seconds()
+    try:
+        if (
+            snapshot.key == _key(args)
+            and time.time() < snapshot.expires_at
+            and snapshot.now <= args.now.timestamp() <= window_max
+        ):
+            return snapshot
+    except (OSError, ValueError):
+        pass
+    snapshot.close()
+    return None
+
+
+def snapshot_output(argv: List[str]) -> Optional[str]:
+    """The output for these command line arguments, rendered from the saved
+    snapshot if it's still good
+
+    The output is saved for payload.py too, so until it could next change
+    this isn't needed at all."""
+    if not os.path.exists(c.SNAPSHOT_FILE):
+        return None
+    from .main import joinable_events, next_change, render_list
+
+    args = payload.parse_quietly(argv)
+    if args is None:
+        return None
+    snapshot = load(args)
+    if snapshot is None:
+        return None
+    with snapshot:
+        try:
+            events = snapshot.events_at(args.now)
+            output = render_list(events, args, snapshot)
+        except ValueError:
+            return None
+        valid_until = next_change(joinable_events(events), args.now)
+        # The events are only good for as long as the snapshot.
+        payload.save(args, output, valid_until, snapshot.expires_at)
+    return output
@@ -0,0 +1,66 @@
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import List
+
+from .args import Args, _output
+
+# Report on what importing the CLI costs, so startup time regressions are easy
+# to spot. This is built on python's own -X importtime output.
+
+# Modules that should never be imported just to start the CLI.
+HEAVY_MODULES = ("googleapiclient", "google", "google_auth_oauthlib", "bs4")
+# How many of the slowest imports to list.
+TOP_N = 15
+
+
+@dataclass
+class ImportTime:
+    module: str
+    # Both in microseconds
+    self_us: int
+    cumulative_us: int
+
+
+def parse_importtime(report: str) -> List[ImportTime]:
+    """Parse the stderr output of python -X importtime"""
+    times: List[ImportTime] = []
+    for line in report.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:") :].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            # The header line
+            continue
+        times.append(ImportTime(parts[2].strip(), self_us, cumulative_us))
+    return times
+
+
+def measure_imports(module: str = "next_meeting.main") -> List[ImportTime]:
+    """Import a module in a fresh interpreter and record what it cost"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def command_startup(args: Args) -> None:
+    """Implement the startup command"""
+    times = measure_imports()
+    total = sum(t.self_us for t in times)
+    _output(f"Importing next_meeting.main took {total / 1000:.1f}ms")
+    _output(f"Slowest {TOP_N} imports (cumulative):")
+    for t in sorted(times, key=lambda t: t.cumulative_us, reverse=True)[:TOP_N]:
+        _output(f"  {t.cumulative_us / 1000:8.1f}ms  {t.module}")
+
+    loaded = {t.module.split(".")[0] for t in times}
+    heavy = [m for m in HEAVY_MODULES if m in loaded]
+    if heavy:
+        _output(f"WARNING: slow to import packages loaded at startup: {heavy}")
@@ -0,0 +1,78 @@
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+from . import constants as c
+
+# Shared HTTP transports for talking to google. Reusing these keeps the
+# connections (and their TLS sessions) alive across requests, which matters in
+# the daemon and anywhere several pages or calendars are fetched.
+#
+# NOTE: both httplib2 (which googleapiclient requires) and requests only speak
+# HTTP/1.1, so this is keep-alive rather than HTTP/2 multiplexing.
+
+
+class HttpPool:
+    """A pool of httplib2.Http objects
+
+    httplib2.Http keeps its connections open between requests but isn't thread
+    safe, so each thread checks one out for the duration of a request and hands
+    it back afterwards for the next thread to reuse."""
+
+    def __init__(self, max_size: int, timeout: Optional[float]) -> None:
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[Any]" = queue.LifoQueue(maxsize=max_size)
+
+    def _new(self) -> Any:
+        import httplib2
+
+        return httplib2.Http(timeout=self.timeout)
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        try:
+            http = self._idle.get_nowait()
+        except queue.Empty:
+            http = self._new()
+        try:
+            yield http
+        finally:
+            try:
+                self._idle.put_nowait(http)
+            except queue.Full:
+                http.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_http_pool: Optional[HttpPool] = None
+_session: Any = None
+_lock = threading.Lock()
+
+
+def http_pool() -> HttpPool:
+    """The pool used for all calls to the calendar API"""
+    global _http_pool
+    with _lock:
+        if _http_pool is None:
+            _http_pool = HttpPool(c.FETCH_WORKERS, c.FETCH_TIMEOUT_SECONDS)
+        return _http_pool
+
+
+def auth_request() -> Any:
+    """A google.auth transport request for refreshing tokens that reuses a
+    single keep-alive requests.Session"""
+    global _session
+    import requests
+    from google.auth.transport.requests import Request
+
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+        return Request(session=_session)
@@ -2,11 +2,26 @@ from datetime import datetime
 
 import pytest
 
+import next_meeting.constants as c
+import next_meeting.parsing as parsing
 from next_meeting.args import Args, Command, OutputFormat
 
 from . import factories as f
 
 
+@pytest.fixture(autouse=True)
+def event_cache_file(tmp_path, monkeypatch) -> str:
+    """Keep each test's event (and parsed event) cache to itself"""
+    path = str(tmp_path / "events.sqlite")
+    monkeypatch.setattr(c, "EVENT_CACHE_FILE", path)
+    monkeypatch.setattr(c, "PAYLOAD_CACHE_FILE", str(tmp_path / "payload.json"))
+    monkeypatch.setattr(c, "SNAPSHOT_FILE", str(tmp_path / "events.snapshot"))
+    monkeypatch.setattr(
+        parsing, "_parsed_events", parsing.ParsedEventCache(c.PARSED_EVENT_CACHE_SIZE)
+    )
+    return path
+
+
 @pytest.fixture
 def now() -> datetime:
     return datetime(2021, 7, 19, 13, 0, 0, 0)
@@ -0,0 +1,70 @@
+import json
+from dataclasses import asdict
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from next_meeting import alfred
+from next_meeting.alfred import (
+    AlfredWorkflow,
+    Item,
+    ItemIcon,
+    JsonUtilityFormat,
+    ScriptFilterOutput,
+)
+
+START = datetime(2021, 7, 12, 9, 30, tzinfo=timezone(-timedelta(hours=4)))
+
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request, monkeypatch) -> str:
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(alfred, "orjson", None)
+    return request.param
+
+
+def output() -> JsonUtilityFormat:
+    items = [
+        Item(
+            uid="1",
+            title="Café ☕",
+            subtitle="Starts at 9:30",
+            arg="zoommtg://example.zoom.us/join?confno=1",
+            variables=dict(start=START, link=None),
+            icon=ItemIcon(path="icon.png"),
+        ),
+        Item(uid="2", title="No link", subtitle=""),
+    ]
+    return JsonUtilityFormat(
+        alfredworkflow=AlfredWorkflow(
+            arg=ScriptFilterOutput(items=items).to_json(),
+            config=dict(),
+            variables=dict(need_to_prompt=True, start=START),
+        )
+    )
+
+
+def test_to_json_matches_asdict(backend: str):
+    o = output()
+    # Same document as the old (indented, asdict based) encoding.
+    expected = json.loads(json.dumps(asdict(o), indent=2, default=datetime.isoformat))
+    actual = o.to_json()
+    assert json.loads(actual) == expected
+    assert "\n" not in actual
+    # Not escaped, Alfred reads UTF-8
+    assert "Café ☕" in actual
+    assert expected["alfredworkflow"]["variables"]["start"] == START.isoformat()
+
+
+def test_to_json_pretty(backend: str):
+    o = output()
+    assert json.loads(o.to_json(pretty=True)) == json.loads(o.to_json())
+    assert '\n  "alfredworkflow": {' in o.to_json(pretty=True)
+
+
+def test_to_json_unsupported(monkeypatch):
+    monkeypatch.setattr(alfred, "orjson", None)
+    with pytest.raises(TypeError):
+        alfred.to_json(Item(uid="1", title="", subtitle="", variables=dict(x={1})))
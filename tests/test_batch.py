@@ -0,0 +1,91 @@
+import random
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import next_meeting.constants as c
+from next_meeting.alfred import Item, ItemIcon
+from next_meeting.args import NextMeetingOptions
+from next_meeting.batch import EventBatch
+from next_meeting.index import EventIndex
+from next_meeting.main import joinable_events
+from next_meeting.parsing import MyEvent
+
+from . import factories as f
+
+START = datetime(2021, 7, 12, 9, 0, tzinfo=timezone.utc)
+
+
+def random_events(rng: random.Random, n: int):
+    events = []
+    for i in range(n):
+        e = f.sample_my_event()
+        e.id = str(i)
+        e.start = START + timedelta(minutes=rng.randrange(0, 1200, 5))
+        e.end = e.start + timedelta(minutes=rng.choice([5, 15, 30, 60, 90]))
+        kind = rng.random()
+        if kind < 0.1:
+            e.meeting_link = None
+        elif kind < 0.15:
+            e.is_not_day_event = False
+        elif kind < 0.2:
+            e.end = None
+        events.append(e)
+    return events
+
+
+def test_empty():
+    batch = EventBatch([])
+    assert len(batch) == 0
+    assert batch.find_meeting_to_join(START) == (NextMeetingOptions.NoOptions, None)
+
+
+@pytest.mark.parametrize("horizon", [None, timedelta(hours=c.HOURS_AHEAD)])
+def test_matches_event_index(horizon):
+    rng = random.Random(99)
+    events = random_events(rng, 60)
+    batch = EventBatch(events, horizon)
+    index = EventIndex(joinable_events(events), horizon)
+    for minute in range(-10, 1300, 2):
+        now = START + timedelta(minutes=minute, seconds=rng.choice([0, 30]))
+        option, event = batch.find_meeting_to_join(now)
+        expected_option, expected_event = index.find_meeting_to_join(now)
+        assert option == expected_option, now
+        assert (event and event.id) == (expected_event and expected_event.id), now
+        assert sorted(batch.ids[i] for i in batch.in_progress(now)) == sorted(
+            e.id for e in index.in_progress(now)
+        )
+
+
+def test_event_round_trip():
+    edt = timezone(-timedelta(hours=4))
+    aware = replace(
+        f.sample_my_event(),
+        start=datetime(2021, 7, 12, 9, 30, tzinfo=edt),
+        end=datetime(2021, 7, 12, 10, 0, tzinfo=edt),
+    )
+    naive = replace(
+        aware,
+        id="naive",
+        start=datetime(2021, 7, 13, 11, 0),
+        end=None,
+        is_not_day_event=False,
+        icon=None,
+    )
+    batch = EventBatch([naive, aware])
+    assert [batch.event(i) for i in range(len(batch))] == [aware, naive]
+    assert batch.event(0).start.utcoffset() == timedelta(hours=-4)
+
+
+def test_slotted():
+    event = f.sample_my_event()
+    item = event.to_item()
+    for o in (event, item, ItemIcon(path="icon.png")):
+        assert not hasattr(o, "__dict__")
+    # Still mutable
+    event.in_progress = True
+    with pytest.raises(AttributeError):
+        event.unknown = True
+    assert isinstance(item, Item)
+    assert isinstance(event, MyEvent)
@@ -0,0 +1,84 @@
+from datetime import datetime
+
+import pytest
+
+from next_meeting.cache import EventCache
+
+
+@pytest.fixture
+def cache(event_cache_file: str) -> EventCache:
+    with EventCache(event_cache_file) as cache:
+        yield cache
+
+
+def window(start: str, end: str):
+    return datetime.fromisoformat(start), datetime.fromisoformat(end)
+
+
+def test_empty_cache(cache: EventCache):
+    assert cache.state("primary") is None
+
+
+def test_replace_and_read_window(cache: EventCache, single_raw_event: dict):
+    time_min, time_max = window(
+        "2021-07-12T09:00:00-04:00", "2021-07-12T18:00:00-04:00"
+    )
+    cache.replace("primary", [single_raw_event], "sync1", time_min, time_max, 100.0)
+
+    state = cache.state("primary")
+    assert state.sync_token == "sync1"
+    assert state.covers(time_min, time_max)
+    assert state.is_fresh(110.0, 60)
+    assert not state.is_fresh(200.0, 60)
+    assert cache.events(["primary"], time_min, time_max) == [single_raw_event]
+
+    # The event ends at 9:40 so it's not in a window starting after that
+    later_min, later_max = window(
+        "2021-07-12T09:40:00-04:00", "2021-07-12T18:00:00-04:00"
+    )
+    assert cache.events(["primary"], later_min, later_max) == []
+    assert not state.covers(
+        *window("2021-07-12T08:00:00-04:00", "2021-07-12T18:00:00-04:00")
+    )
+
+
+def test_events_ordered_by_start(cache: EventCache, single_raw_event: dict):
+    time_min, time_max = window(
+        "2021-07-12T09:00:00-04:00", "2021-07-12T18:00:00-04:00"
+    )
+    later = dict(
+        single_raw_event,
+        id="later",
+        start={"dateTime": "2021-07-12T11:00:00-04:00"},
+        end={"dateTime": "2021-07-12T11:30:00-04:00"},
+    )
+    cache.replace("primary", [later, single_raw_event], None, time_min, time_max, 0)
+    ids = [e["id"] for e in cache.events(["primary"], time_min, time_max)]
+    assert ids == [single_raw_event["id"], "later"]
+
+
+def test_apply_changes(cache: EventCache, single_raw_event: dict):
+    time_min, time_max = window(
+        "2021-07-12T09:00:00-04:00", "2021-07-12T18:00:00-04:00"
+    )
+    other = dict(single_raw_event, id="other")
+    cache.replace("primary", [single_raw_event, other], "sync1", time_min, time_max, 0)
+
+    moved_out = dict(
+        single_raw_event,
+        start={"dateTime": "2021-07-13T09:30:00-04:00"},
+        end={"dateTime": "2021-07-13T09:40:00-04:00"},
+    )
+    cancelled = {"id": "other", "status": "cancelled"}
+    added = dict(single_raw_event, id="added")
+    cache.apply_changes("primary", [moved_out, cancelled, added], "sync2", 50)
+
+    assert [e["id"] for e in cache.events(["primary"], time_min, time_max)] == ["added"]
+    state = cache.state("primary")
+    assert state.sync_token == "sync2"
+    assert state.fetched_at == 50
+
+
+def test_apply_changes_unknown_calendar(cache: EventCache):
+    with pytest.raises(ValueError):
+        cache.apply_changes("primary", [], None, 0)
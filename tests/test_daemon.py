@@ -0,0 +1,151 @@
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from next_meeting.args import Args
+from next_meeting.client import request_output
+from next_meeting.daemon import DaemonServer, EventStore, _refresh_loop
+
+
+@pytest.fixture
+def store(args: Args, single_raw_event: dict) -> EventStore:
+    with patch("next_meeting.daemon.fetch_events") as mock_fetch_events:
+        mock_fetch_events.return_value = [single_raw_event]
+        store = EventStore(args)
+        store.refresh(datetime.fromisoformat("2021-07-12T09:20:00-04:00"))
+        yield store
+
+
+@pytest.fixture
+def socket_path(tmp_path) -> str:
+    return str(tmp_path / "nm.sock")
+
+
+def test_events_at(store: EventStore):
+    now = datetime(2021, 7, 12, 13, 35, 0, 0, tzinfo=timezone.utc)
+    [event] = store.events_at(now)
+    assert event.in_progress is True
+    assert event.is_next_joinable is False
+
+    # Doesn't touch the stored events
+    later = datetime(2021, 7, 12, 13, 29, 0, 0, tzinfo=timezone.utc)
+    [event] = store.events_at(later)
+    assert event.in_progress is False
+    assert event.is_next_joinable is True
+
+    # Events that are over are dropped
+    assert store.events_at(datetime(2021, 7, 13, tzinfo=timezone.utc)) == []
+
+
+def test_render_only_list(store: EventStore):
+    with pytest.raises(ValueError):
+        store.render(["-c", "join"])
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        # Before the window we fetched, and too late for all of it to be in it
+        ["-c", "list", "-n", "2021-07-12T09:19:00-04:00"],
+        ["-c", "list", "-n", "2021-07-12T09:36:00-04:00"],
+        ["-c", "list", "-n", "2021-07-12T09:29:00-04:00", "--log-level", "debug"],
+        ["-c", "list", "-n", "2021-07-12T09:29:00-04:00", "--calendar", "team"],
+        ["-c", "list", "-n", "2021-07-12T09:29:00-04:00", "--ics", "work.ics"],
+        ["-c", "list", "-n", "2021-07-12T09:29:00-04:00", "--refresh"],
+    ],
+)
+def test_render_only_what_we_have(store: EventStore, argv):
+    with pytest.raises(ValueError):
+        store.render(argv)
+
+
+def test_render_padded_window(args: Args, single_raw_event: dict):
+    late = dict(
+        single_raw_event,
+        id="late",
+        start={"dateTime": "2021-07-12T18:10:00-04:00"},
+        end={"dateTime": "2021-07-12T18:40:00-04:00"},
+    )
+    now = datetime.fromisoformat("2021-07-12T09:00:00-04:00")
+    with patch("next_meeting.daemon.fetch_events") as mock_fetch_events:
+        mock_fetch_events.return_value = [single_raw_event, late]
+        store = EventStore(args)
+        store.refresh(now)
+    assert mock_fetch_events.call_args.args[1] == now + timedelta(hours=9, minutes=15)
+
+    def listed(at: str):
+        output = store.render(["-c", "list", "-f", "ndjson", "-n", at])
+        return [r.get("id") for r in map(json.loads, output.splitlines())]
+
+    # Only what a run at that time would have fetched
+    assert listed("2021-07-12T09:00:00-04:00") == [single_raw_event["id"], None]
+    assert listed("2021-07-12T09:14:00-04:00") == [
+        single_raw_event["id"],
+        "late",
+        None,
+    ]
+
+
+def test_client_round_trip(store: EventStore, socket_path: str):
+    argv = ["-c", "list", "-f", "alfred", "-n", "2021-07-12T09:29:00-04:00"]
+    with DaemonServer(socket_path, store) as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            output = request_output(argv, socket_path)
+            assert output == store.render(argv)
+            variables = json.loads(output)["alfredworkflow"]["variables"]
+            assert variables["next_meeting"] == "FoundNextMeeting"
+            # The daemon won't handle anything but list, nm.py does it itself
+            assert request_output(["-c", "join"], socket_path) is None
+            assert request_output(["--bogus"], socket_path) is None
+            # Nor a time it doesn't have the events for
+            assert (
+                request_output(["-c", "list", "-n", "2023-05-23"], socket_path) is None
+            )
+        finally:
+            server.shutdown()
+            thread.join()
+
+
+@patch("next_meeting.daemon.refresh_expiring_creds")
+def test_refresh_loop(mock_refresh_creds: MagicMock, monkeypatch):
+    monkeypatch.setattr("next_meeting.daemon.c.DAEMON_REFRESH_SECONDS", 0)
+    stop = threading.Event()
+    store = MagicMock(name="EventStore")
+
+    def refresh():
+        if store.refresh.call_count == 1:
+            # Carries on after an error
+            raise ValueError("offline")
+        stop.set()
+
+    store.refresh.side_effect = refresh
+    _refresh_loop(store, stop)
+    assert store.refresh.call_count == 2
+    # The creds are refreshed ahead of each fetch
+    assert mock_refresh_creds.call_count == 2
+
+
+def test_client_no_daemon(socket_path: str):
+    assert request_output(["-c", "list"], socket_path) is None
+
+
+@patch("next_meeting.client.socket.socket")
+def test_client_daemon_not_responding(mock_socket: MagicMock, socket_path: str):
+    open(socket_path, "w").close()
+    mock_socket.return_value.__enter__.return_value.connect.side_effect = (
+        ConnectionRefusedError()
+    )
+    assert request_output(["-c", "list"], socket_path) is None
+
+
+@patch("next_meeting.client.socket.socket")
+def test_client_help(mock_socket: MagicMock, socket_path: str):
+    open(socket_path, "w").close()
+    # Left to nm.py, the daemon would only print it to its own stdout
+    assert request_output(["-c", "list", "--help"], socket_path) is None
+    mock_socket.assert_not_called()
@@ -1,9 +1,24 @@
+import os
+from dataclasses import replace
 from datetime import datetime
+from typing import List
+from unittest.mock import patch
 
 import pytest
 
+import next_meeting.constants as c
+import next_meeting.parsing as parsing
 from next_meeting.args import Args
-from next_meeting.parsing import MyEvent, parse_event, parse_events
+from next_meeting.parsing import (
+    MyEvent,
+    ParsedEventCache,
+    get_meeting_link,
+    iter_description_links,
+    iter_parsed_events,
+    parse_event,
+    parse_events,
+    parse_events_details,
+)
 
 from . import factories as f
 
@@ -12,6 +27,7 @@ def expected_event(id="12345678987") -> MyEvent:
     return MyEvent(
         id="77gcalEventId_20210712T133000Z",
         start=datetime.fromisoformat("2021-07-12T09:30:00-04:00"),
+        end=datetime.fromisoformat("2021-07-12T09:40:00-04:00"),
         summary="JIRA Board Review",
         is_not_day_event=True,
         in_progress=False,
@@ -155,6 +171,7 @@ def test_parse_event_all_day(
     del single_raw_event["end"]["dateTime"]
     parsed_events = parse_events([single_raw_event], args)
     expected_single_event.start = datetime.fromisoformat("2021-07-12")
+    expected_single_event.end = datetime.fromisoformat("2021-07-12")
     expected_single_event.is_not_day_event = False
     assert len(parsed_events) == 1
     assert parsed_events[0] == expected_single_event
@@ -186,6 +203,7 @@ def test_parse_event_google_meet(args: Args):
     expected: MyEvent = MyEvent(
         id="44gmeetid44",
         start=datetime.fromisoformat("2023-05-24T08:00:00-04:00"),
+        end=datetime.fromisoformat("2023-05-24T08:30:00-04:00"),
         summary="Next Meeting Test Google Meet",
         is_not_day_event=True,
         in_progress=False,
@@ -194,3 +212,144 @@ def test_parse_event_google_meet(args: Args):
         icon="icon.png",
     )
     assert event == expected
+
+
+@pytest.mark.parametrize(
+    "description,expected",
+    [
+        ("No links here", None),
+        ("<a href='https://example.com'>x</a>", None),
+        (
+            "<a href='https://example.com'>x</a> <A HREF = 'https://a.zoom.us/j/1'>",
+            "https://a.zoom.us/j/1",
+        ),
+        (
+            '<a href="https://a.zoom.us/j/1?a=1&amp;pwd=2">',
+            "https://a.zoom.us/j/1?a=1&pwd=2",
+        ),
+        (
+            "Join: https://meet.google.com/abc-defg-hij<br>",
+            "https://meet.google.com/abc-defg-hij",
+        ),
+        # Not the url of the zoom logo
+        (
+            '<img src="https://st1.zoom.us/static/logo.png"> '
+            '<a href="https://meet.google.com/abc">',
+            "https://meet.google.com/abc",
+        ),
+        # Only found by the HTML parsing fallback
+        (
+            '<a data-x="y>" href="zoommtg://example.zoom.us/join?confno=1">',
+            "zoommtg://example.zoom.us/join?confno=1",
+        ),
+    ],
+)
+def test_get_meeting_link_description(
+    args: Args, single_raw_event_description_only: dict, description, expected
+):
+    single_raw_event_description_only["description"] = description
+    assert get_meeting_link(single_raw_event_description_only, args) == expected
+
+
+def test_iter_description_links():
+    description = '<a href="https://one">one</a> and https://two'
+    assert list(iter_description_links(description)) == [
+        "https://one",
+        "https://two",
+    ]
+
+
+def test_iter_description_links_skips_other_tags():
+    description = (
+        '<img src="https://st1.zoom.us/static/logo.png"> '
+        '<a title="https://example.com" href="https://meet.google.com/abc">'
+    )
+    assert list(iter_description_links(description)) == ["https://meet.google.com/abc"]
+
+
+def test_iter_description_links_trailing_punctuation():
+    description = "Join (https://example.zoom.us/j/123?pwd=abc). Or https://two, ok;"
+    assert list(iter_description_links(description)) == [
+        "https://example.zoom.us/j/123?pwd=abc",
+        "https://two",
+    ]
+
+
+def test_parse_events_cached(args: Args, single_raw_event: dict, monkeypatch):
+    parse_events([single_raw_event], args)
+
+    # Same id + etag, so we don't look at the event again
+    single_raw_event["summary"] = "Changed, but the etag wasn't"
+    [event] = parse_events([single_raw_event], args)
+    assert event.summary == "JIRA Board Review"
+
+    # ...and that carries over to a new process
+    monkeypatch.setattr(parsing, "_parsed_events", ParsedEventCache(10))
+    args.now = datetime.fromisoformat("2021-07-12T09:37:00-04:00")
+    [event] = parse_events([single_raw_event], args)
+    assert event.summary == "JIRA Board Review"
+    # Time based attributes are always up to date
+    assert event.in_progress is True
+
+    single_raw_event["etag"] = '"400024"'
+    [event] = parse_events([single_raw_event], args)
+    assert event.summary == "Changed, but the etag wasn't"
+
+
+def test_parse_events_ics_leaves_event_cache(args: Args, single_raw_event: dict):
+    args = replace(args, ics=["calendar.ics"])
+    [event] = parse_events([single_raw_event], args)
+    [streamed] = iter_parsed_events([single_raw_event], args)
+    assert streamed == event
+    assert not os.path.exists(c.EVENT_CACHE_FILE)
+
+
+def test_parsed_event_cache_bounded():
+    cache = ParsedEventCache(2)
+    for i in range(3):
+        cache.put((str(i), "etag"), f.sample_my_event())
+    assert len(cache) == 2
+    assert cache.get(("0", "etag")) is None
+    assert cache.get(("2", "etag")) is not None
+
+
+def raw_events(n: int) -> List[dict]:
+    events = []
+    for i in range(n):
+        e = f.single_raw_event()
+        e["id"] = f"event{i}"
+        e["summary"] = f"Meeting {i}"
+        if i % 2:
+            del e["conferenceData"]
+            del e["location"]
+        events.append(e)
+    return events
+
+
+def test_parse_events_details_parallel(args: Args, monkeypatch):
+    events = raw_events(7)
+    serial = parse_events_details(events, args)
+
+    monkeypatch.setattr(c, "PARALLEL_PARSE_MIN_EVENTS", 5)
+    monkeypatch.setattr(c, "PARALLEL_PARSE_CHUNK_SIZE", 2)
+    args.jobs = 2
+    with patch("concurrent.futures.ProcessPoolExecutor") as pool:
+        # Too few to bother
+        assert parse_events_details(events[:4], args) == serial[:4]
+        pool.assert_not_called()
+
+    # In order, and the same as parsing them here
+    assert parse_events_details(events, args) == serial
+    assert [e.summary for e in serial] == [f"Meeting {i}" for i in range(7)]
+
+
+def test_parse_events_only_parses_uncached(args: Args):
+    events = raw_events(3)
+    parse_events(events[1:2], args)
+    with patch.object(
+        parsing, "parse_events_details", wraps=parsing.parse_events_details
+    ) as details:
+        parsed = parse_events(events, args)
+    [(uncached, _), _] = details.call_args
+    assert [e["id"] for e in uncached] == ["event0", "event2"]
+    assert [e.id for e in parsed] == ["event0", "event1", "event2"]
@@ -1,19 +1,522 @@
+import json
+import os
+import pickle
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from unittest.mock import MagicMock, patch
+from urllib.parse import parse_qs, urlparse
+
+import httplib2
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
 
 import next_meeting.gcal as gcal
-from next_meeting.args import Args
+from next_meeting.args import Args, OutputFormat
+from next_meeting.cache import EventCache
+from next_meeting.main import command_join, command_list
+from next_meeting.parsing import parse_event
+
+
+@pytest.fixture
+def mock_service() -> MagicMock:
+    with patch("next_meeting.gcal.fetch_creds") as mock_fetch_creds, patch(
+        "next_meeting.gcal._get_service"
+    ) as mock_get_service:
+        mock_fetch_creds.return_value = MagicMock(name="Credentials")
+        service = MagicMock(name="GoogleService")
+        mock_get_service.return_value = service
+        yield service
+
+
+def test_fetch_events(mock_service: MagicMock, args: Args, single_raw_event: dict):
+    args.now = datetime.fromisoformat("2021-07-12T09:00:00-04:00")
+    mock_service.events().list().execute.return_value = dict(items=[single_raw_event])
+
+    events = gcal.fetch_events(args)
+    assert events == [single_raw_event]
+
+
+def test_fetch_events_follows_pages(
+    mock_service: MagicMock, args: Args, single_raw_event: dict
+):
+    args.now = datetime.fromisoformat("2021-07-12T09:00:00-04:00")
+    second = dict(single_raw_event, id="second")
+    mock_service.events().list().execute.side_effect = [
+        dict(items=[single_raw_event], nextPageToken="page2"),
+        dict(items=[second], nextSyncToken="sync1"),
+    ]
+
+    events = gcal.fetch_events(args)
+    assert [e["id"] for e in events] == [single_raw_event["id"], "second"]
+
+
+def test_fetch_events_fresh_cache_skips_network(
+    mock_service: MagicMock, args: Args, single_raw_event: dict
+):
+    args.now = datetime.fromisoformat("2021-07-12T09:00:00-04:00")
+    mock_service.events().list().execute.return_value = dict(
+        items=[single_raw_event], nextSyncToken="sync1"
+    )
+    gcal.fetch_events(args)
+    mock_service.events().list().execute.reset_mock()
+
+    events = gcal.fetch_events(args)
+    assert events == [single_raw_event]
+    mock_service.events().list().execute.assert_not_called()
+
+
+def test_fetch_events_stale_cache_syncs(
+    mock_service: MagicMock, args: Args, single_raw_event: dict, monkeypatch
+):
+    args.now = datetime.fromisoformat("2021-07-12T09:00:00-04:00")
+    mock_service.events().list().execute.return_value = dict(
+        items=[single_raw_event], nextSyncToken="sync1"
+    )
+    gcal.fetch_events(args)
+
+    monkeypatch.setattr(gcal.c, "EVENT_CACHE_MAX_AGE_SECONDS", -1)
+    renamed = dict(single_raw_event, summary="Renamed")
+    mock_service.events().list().execute.return_value = dict(
+        items=[renamed], nextSyncToken="sync2"
+    )
+    events = gcal.fetch_events(args)
+    assert [e["summary"] for e in events] == ["Renamed"]
+    mock_service.events().list.assert_called_with(
+        calendarId="primary",
+        singleEvents=True,
+        fields=gcal.LIST_FIELDS,
+        syncToken="sync1",
+    )
+
+
+def test_fetch_events_later_runs_use_cache(
+    mock_service: MagicMock, args: Args, single_raw_event: dict, monkeypatch
+):
+    args.now = datetime.fromisoformat("2021-07-12T09:00:00-04:00")
+    # Only in the window of later runs
+    later = dict(
+        single_raw_event,
+        id="later",
+        start={"dateTime": "2021-07-12T18:30:00-04:00"},
+        end={"dateTime": "2021-07-12T19:00:00-04:00"},
+    )
+    mock_service.events().list().execute.return_value = dict(
+        items=[single_raw_event, later], nextSyncToken="sync1"
+    )
+    assert [e["id"] for e in gcal.fetch_events(args)] == [single_raw_event["id"]]
+    mock_service.events().list().execute.reset_mock()
+
+    # A minute on, still fresh: no network at all
+    args.now += timedelta(minutes=1)
+    assert len(gcal.fetch_events(args)) == 1
+    mock_service.events().list().execute.assert_not_called()
+
+    # Half an hour on and due a refresh: only the changes
+    monkeypatch.setattr(gcal.c, "EVENT_CACHE_MAX_AGE_SECONDS", -1)
+    args.now += timedelta(minutes=30)
+    mock_service.events().list().execute.return_value = dict(
+        items=[], nextSyncToken="sync2"
+    )
+    events = gcal.fetch_events(args)
+    assert [e["id"] for e in events] == [single_raw_event["id"], "later"]
+    assert mock_service.events().list.call_args.kwargs["syncToken"] == "sync1"
+
+
+def test_fetch_events_expired_sync_token(
+    mock_service: MagicMock, args: Args, single_raw_event: dict, monkeypatch
+):
+    args.now = datetime.fromisoformat("2021-07-12T09:00:00-04:00")
+    mock_service.events().list().execute.return_value = dict(
+        items=[single_raw_event], nextSyncToken="sync1"
+    )
+    gcal.fetch_events(args)
+
+    monkeypatch.setattr(gcal.c, "EVENT_CACHE_MAX_AGE_SECONDS", -1)
+    gone = HttpError(MagicMock(status=410), b"Gone")
+    mock_service.events().list().execute.side_effect = [
+        gone,
+        dict(items=[], nextSyncToken="sync2"),
+    ]
+    assert gcal.fetch_events(args) == []
+
+
+def test_list_page_asks_for_less(args: Args, monkeypatch):
+    # A real service (from the bundled discovery document), so this is the
+    # request googleapiclient would actually send.
+    monkeypatch.setattr(gcal, "_services", {})
+    monkeypatch.setattr(gcal, "_discovery_doc", None)
+    monkeypatch.setattr(gcal.c, "DISCOVERY_DOC_FILE", "missing.json")
+    service = gcal._get_service(AnonymousCredentials())
+    http = MagicMock(name="Http")
+    http.request.return_value = (httplib2.Response({"status": 200}), b"{}")
+    with patch("next_meeting.gcal._authorized_http", return_value=http):
+        gcal._list_page(service, None, "primary", args)
+
+    uri = http.request.call_args.args[0]
+    headers = http.request.call_args.kwargs["headers"]
+    assert parse_qs(urlparse(uri).query)["fields"] == [gcal.LIST_FIELDS]
+    assert "gzip" in headers["accept-encoding"]
+    assert "(gzip)" in headers["user-agent"]
+
+
+def test_list_fields_cover_parsing(args: Args, single_raw_event: dict):
+    # What a response would hold for an event with everything set
+    kept = {k: v for k, v in single_raw_event.items() if k in gcal.LIST_FIELDS}
+    assert parse_event(kept, args) == parse_event(single_raw_event, args)
+
+
+@pytest.fixture
+def mock_build_from_document(monkeypatch) -> MagicMock:
+    monkeypatch.setattr(gcal, "_services", {})
+    monkeypatch.setattr(gcal, "_discovery_doc", None)
+    with patch("googleapiclient.discovery.build_from_document") as p:
+        p.side_effect = lambda doc, credentials: MagicMock(name="GoogleService")
+        yield p
+
+
+def test_get_service_reuses_service(mock_build_from_document: MagicMock):
+    creds = MagicMock(client_id="client", refresh_token="refresh")
+    same_creds = MagicMock(client_id="client", refresh_token="refresh")
+    other_creds = MagicMock(client_id="client", refresh_token="other")
+
+    service = gcal._get_service(creds)
+    assert gcal._get_service(same_creds) is service
+    assert gcal._get_service(other_creds) is not service
+    assert mock_build_from_document.call_count == 2
+    # The bundled discovery document was used
+    doc = mock_build_from_document.call_args.args[0]
+    assert doc["name"] == "calendar"
+
+
+def test_discovery_document_from_disk(
+    mock_build_from_document: MagicMock, tmp_path, monkeypatch
+):
+    path = tmp_path / "discovery.json"
+    path.write_text('{"name": "from-disk"}')
+    monkeypatch.setattr(gcal.c, "DISCOVERY_DOC_FILE", str(path))
+
+    gcal._get_service(MagicMock())
+    assert mock_build_from_document.call_args.args[0] == {"name": "from-disk"}
+
+
+def calendar_requests(mock_service: MagicMock, responses: dict) -> None:
+    """Have events().list() respond differently for each calendar"""
+
+    def list_events(calendarId, **kwargs):
+        request = MagicMock(name=f"Request({calendarId})")
+        request.execute.side_effect = responses[calendarId]
+        return request
+
+    mock_service.events().list.side_effect = list_events
+
+
+def test_fetch_events_multiple_calendars(
+    mock_service: MagicMock, args: Args, single_raw_event: dict
+):
+    args.now = datetime.fromisoformat("2021-07-12T09:00:00-04:00")
+    args.calendars = ["primary", "team"]
+    earlier = dict(
+        single_raw_event,
+        id="earlier",
+        start={"dateTime": "2021-07-12T09:15:00-04:00"},
+        end={"dateTime": "2021-07-12T09:20:00-04:00"},
+    )
+    calendar_requests(
+        mock_service,
+        {
+            "primary": lambda **kw: dict(items=[single_raw_event]),
+            # The same event on both calendars only shows up once
+            "team": lambda **kw: dict(items=[earlier, single_raw_event]),
+        },
+    )
+
+    events = gcal.fetch_events(args)
+    assert [e["id"] for e in events] == ["earlier", single_raw_event["id"]]
 
 
-@patch("next_meeting.gcal.build")
-@patch("next_meeting.gcal._fetch_creds")
-def test_fetch_events(mock_fetch_creds, mock_build: MagicMock, args: Args):
-    creds = MagicMock(name="Credentials")
-    mock_fetch_creds.return_value = creds
-    mock_service = MagicMock(name="GoogleService")
-    mock_build.return_value = mock_service
-    mock_events_list = dict(items=[{}])
-    mock_service.events().list().execute.return_value = mock_events_list
+def test_fetch_events_calendar_timeout(
+    mock_service: MagicMock, args: Args, single_raw_event: dict, monkeypatch
+):
+    monkeypatch.setattr(gcal.c, "FETCH_TIMEOUT_SECONDS", 0.1)
+    args.now = datetime.fromisoformat("2021-07-12T09:00:00-04:00")
+    args.calendars = ["primary", "slow"]
+    release = threading.Event()
+    workers = []
 
+    def slow(**kw):
+        workers.append(threading.current_thread())
+        release.wait(1)
+        return dict(items=[])
+
+    calendar_requests(
+        mock_service,
+        {"primary": lambda **kw: dict(items=[single_raw_event]), "slow": slow},
+    )
+
+    started = time.monotonic()
+    events = gcal.fetch_events(args)
+    assert time.monotonic() - started < 1
+    assert events == [single_raw_event]
+    # Don't leave the worker running into the next test
+    release.set()
+    for worker in workers:
+        worker.join()
+
+
+def test_full_fetch_for_the_cache(
+    mock_service: MagicMock, args: Args, single_raw_event: dict, event_cache_file
+):
+    args.now = datetime.fromisoformat("2021-07-12T09:00:00-04:00")
+    earlier = dict(
+        single_raw_event,
+        id="earlier",
+        start={"dateTime": "2021-07-12T09:15:00-04:00"},
+        end={"dateTime": "2021-07-12T09:20:00-04:00"},
+    )
+    # Without orderBy google hands events back in any order, but with a sync
+    # token.
+    mock_service.events().list().execute.return_value = dict(
+        items=[single_raw_event, earlier], nextSyncToken="sync1"
+    )
     events = gcal.fetch_events(args)
-    assert events == [{}]
-    mock_build.assert_called_once_with("calendar", "v3", credentials=creds)
+    assert [e["id"] for e in events] == ["earlier", single_raw_event["id"]]
+
+    kwargs = mock_service.events().list.call_args.kwargs
+    assert "orderBy" not in kwargs
+    assert "maxResults" not in kwargs
+    with EventCache(event_cache_file) as cache:
+        assert cache.state("primary").sync_token == "sync1"
+
+
+def test_iter_events_stops_early(
+    mock_service: MagicMock,
+    args: Args,
+    single_raw_event: dict,
+    event_cache_file,
+    capsys,
+):
+    args.now = datetime.fromisoformat("2021-07-12T09:29:00-04:00")
+    later = dict(
+        single_raw_event,
+        id="later",
+        start={"dateTime": "2021-07-12T10:00:00-04:00"},
+        end={"dateTime": "2021-07-12T10:30:00-04:00"},
+    )
+    execute = mock_service.events().list().execute
+    execute.side_effect = [
+        dict(items=[single_raw_event, later], nextPageToken="page2"),
+        dict(items=[]),
+    ]
+
+    command_join(args)
+    assert capsys.readouterr().out.startswith("zoommtg://example.zoom.us/join")
+
+    # The later meeting settled it, so the next page was never asked for.
+    kwargs = mock_service.events().list.call_args.kwargs
+    assert execute.call_count == 1
+    assert kwargs["orderBy"] == "startTime"
+    assert kwargs["maxResults"] == gcal.c.STREAM_PAGE_SIZE
+    # What we did get is cached, as far as it goes
+    with EventCache(event_cache_file) as cache:
+        state = cache.state("primary")
+        assert (
+            state.window_max
+            == datetime.fromisoformat("2021-07-12T10:00:00-04:00").timestamp()
+        )
+        assert len(cache.events(["primary"], args.now, later_on(args.now))) == 2
+
+
+def later_on(now: datetime) -> datetime:
+    return now + timedelta(hours=gcal.c.HOURS_AHEAD)
+
+
+def test_iter_events_follows_pages(
+    mock_service: MagicMock, args: Args, single_raw_event: dict, event_cache_file
+):
+    args.now = datetime.fromisoformat("2021-07-12T09:00:00-04:00")
+    args.calendars = ["primary", "team"]
+    earlier = dict(
+        single_raw_event,
+        id="earlier",
+        start={"dateTime": "2021-07-12T09:15:00-04:00"},
+        end={"dateTime": "2021-07-12T09:20:00-04:00"},
+    )
+    tomorrow = dict(
+        single_raw_event,
+        id="tomorrow",
+        start={"dateTime": "2021-07-13T09:00:00-04:00"},
+        end={"dateTime": "2021-07-13T09:30:00-04:00"},
+    )
+    pages = iter(
+        [
+            dict(items=[single_raw_event], nextPageToken="page2"),
+            # Past the window, but still cached
+            dict(items=[tomorrow]),
+        ]
+    )
+    calendar_requests(
+        mock_service,
+        {
+            "primary": lambda **kw: next(pages),
+            "team": lambda **kw: dict(items=[earlier, single_raw_event]),
+        },
+    )
+
+    events = list(gcal.iter_events(args))
+    assert [e["id"] for e in events] == ["earlier", single_raw_event["id"]]
+    with EventCache(event_cache_file) as cache:
+        state = cache.state("primary")
+        assert state.covers(args.now, later_on(args.now))
+        tomorrow_end = datetime.fromisoformat("2021-07-14T00:00:00-04:00")
+        assert [e["id"] for e in cache.events(["primary"], args.now, tomorrow_end)] == [
+            single_raw_event["id"],
+            "tomorrow",
+        ]
+
+    # Now it's all cached
+    mock_service.events().list.reset_mock()
+    assert list(gcal.iter_events(args)) == events
+    mock_service.events().list.assert_not_called()
+
+
+def test_ndjson_streams(
+    mock_service: MagicMock, args: Args, single_raw_event: dict, capsys
+):
+    args.now = datetime.fromisoformat("2021-07-12T09:29:00-04:00")
+    args.format = OutputFormat.ndjson
+    later = dict(
+        single_raw_event,
+        id="later",
+        start={"dateTime": "2021-07-12T10:00:00-04:00"},
+        end={"dateTime": "2021-07-12T10:30:00-04:00"},
+    )
+    # What had been written each time a page was asked for
+    written = []
+
+    def list_page(**kw):
+        written.append(capsys.readouterr().out)
+        if len(written) == 1:
+            return dict(items=[single_raw_event], nextPageToken="page2")
+        return dict(items=[later])
+
+    calendar_requests(mock_service, {"primary": list_page})
+    command_list(args)
+
+    # The first meeting was out before the second page was asked for
+    assert written[0] == ""
+    assert json.loads(written[1])["id"] == single_raw_event["id"]
+    second, decision = map(json.loads, capsys.readouterr().out.splitlines())
+    assert second["id"] == "later"
+    assert decision["type"] == "decision"
+
+
+@pytest.fixture
+def token_files(tmp_path, monkeypatch):
+    token_file = tmp_path / "token.json"
+    legacy_file = tmp_path / "token.pickle"
+    monkeypatch.setattr(gcal.c, "TOKEN_FILE", str(token_file))
+    monkeypatch.setattr(gcal.c, "LEGACY_TOKEN_FILE", str(legacy_file))
+    return token_file, legacy_file
+
+
+def make_creds(expires_in: timedelta) -> Credentials:
+    return Credentials(
+        token="access",
+        refresh_token="refresh",
+        client_id="client",
+        client_secret="secret",
+        expiry=datetime.now(timezone.utc).replace(tzinfo=None) + expires_in,
+    )
+
+
+def test_fetch_creds_from_json(token_files):
+    token_file, _ = token_files
+    gcal._save_creds(make_creds(timedelta(hours=1)))
+    assert token_file.stat().st_mode & 0o777 == 0o600
+
+    with patch("next_meeting.gcal._refresh") as mock_refresh:
+        creds = gcal.fetch_creds()
+    assert creds.token == "access"
+    assert creds.valid
+    mock_refresh.assert_not_called()
+
+
+def test_fetch_creds_migrates_pickle(token_files):
+    token_file, legacy_file = token_files
+    with open(legacy_file, "wb") as f:
+        pickle.dump(make_creds(timedelta(hours=1)), f)
+
+    creds = gcal.fetch_creds()
+    assert creds.token == "access"
+    assert json.loads(token_file.read_text())["refresh_token"] == "refresh"
+
+
+def test_refresh_expiring_creds(token_files):
+    token_file, _ = token_files
+
+    def refresh(creds):
+        creds.token = "refreshed"
+
+    gcal._save_creds(make_creds(timedelta(hours=1)))
+    with patch("next_meeting.gcal._refresh", side_effect=refresh) as mock_refresh:
+        gcal.refresh_expiring_creds()
+        mock_refresh.assert_not_called()
+
+        gcal._save_creds(make_creds(timedelta(minutes=5)))
+        gcal.refresh_expiring_creds()
+    assert json.loads(token_file.read_text())["token"] == "refreshed"
+
+    gcal._save_creds(make_creds(timedelta(minutes=5)))
+    with patch("next_meeting.gcal._refresh", side_effect=ValueError("offline")):
+        gcal.refresh_expiring_creds()
+    assert json.loads(token_file.read_text())["token"] == "access"
+
+
+@patch("next_meeting.gcal.subprocess.Popen")
+def test_fetch_creds_refreshes_in_background(mock_popen: MagicMock, token_files):
+    gcal._save_creds(make_creds(timedelta(minutes=5)))
+    with patch("next_meeting.gcal._refresh") as mock_refresh:
+        # Still good, so a short-lived run doesn't wait on the refresh
+        assert gcal.fetch_creds().token == "access"
+        mock_refresh.assert_not_called()
+    mock_popen.assert_called_once()
+    assert mock_popen.call_args.kwargs["start_new_session"] is True
+
+    # Only one refresh at a time...
+    gcal.fetch_creds()
+    mock_popen.assert_called_once()
+
+    # ...until it's done (or given up on)
+    with patch("next_meeting.gcal._refresh"):
+        gcal.refresh_expiring_creds()
+    gcal.fetch_creds()
+    assert mock_popen.call_count == 2
+
+    marker = gcal._refresh_marker()
+    os.utime(marker, (0, 0))
+    gcal.fetch_creds()
+    assert mock_popen.call_count == 3
+
+
+def test_refresh_in_background_runs(token_files):
+    # The command the background process runs does what it should.
+    with patch("next_meeting.gcal.refresh_expiring_creds") as mock_refresh:
+        exec(gcal._REFRESH_CREDS, {})
+    mock_refresh.assert_called_once()
+
+
+def test_fetch_creds_refreshes_expired(token_files):
+    gcal._save_creds(make_creds(-timedelta(minutes=1)))
+
+    def refresh(creds):
+        creds.token = "refreshed"
+        creds.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(
+            hours=1
+        )
+
+    with patch("next_meeting.gcal._refresh", side_effect=refresh):
+        creds = gcal.fetch_creds()
+    assert creds.token == "refreshed"
@@ -0,0 +1,337 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from unittest.mock import MagicMock, patch
+from urllib.parse import parse_qs, unquote, urlparse
+
+import httpx
+import pytest
+
+import next_meeting.gcal_async as gcal_async
+from next_meeting.args import Args, parse_args
+from next_meeting.cache import EventCache
+from next_meeting.main import command_join
+
+NOW = datetime.fromisoformat("2021-07-12T09:00:00-04:00")
+
+
+class FakeClient:
+    """Answers each calendar's requests with the given function of the
+    request's parameters"""
+
+    def __init__(self, calendars: Dict[str, Callable[..., Dict[str, Any]]]) -> None:
+        self.calendars = calendars
+        self.requests: List[Dict[str, Any]] = []
+
+    async def get_json(
+        self, url: str, params: Dict[str, str], token: Optional[str]
+    ) -> Dict[str, Any]:
+        calendar_id = unquote(url.split("/calendars/")[1].split("/")[0])
+        self.requests.append(dict(params, calendar_id=calendar_id, token=token))
+        result = self.calendars[calendar_id](**params)
+        if asyncio.iscoroutine(result):
+            return await result
+        return result
+
+    async def aclose(self) -> None:
+        pass
+
+
+@pytest.fixture
+def args(args: Args) -> Args:
+    args.now = NOW
+    return args
+
+
+@pytest.fixture
+def fetch_creds() -> MagicMock:
+    with patch("next_meeting.gcal.fetch_creds") as mock_fetch_creds:
+        mock_fetch_creds.return_value = MagicMock(token="access")
+        yield mock_fetch_creds
+
+
+def use_client(client: FakeClient):
+    return patch("next_meeting.gcal_async._client", return_value=client)
+
+
+def test_fetch_events(fetch_creds: MagicMock, args: Args, single_raw_event: dict):
+    args.calendars = ["primary", "team@example.com"]
+    second = dict(
+        single_raw_event, id="second", start={"dateTime": "2021-07-12T10:00:00-04:00"}
+    )
+    earlier = dict(
+        single_raw_event, id="earlier", start={"dateTime": "2021-07-12T09:15:00-04:00"}
+    )
+    pages = {
+        None: dict(items=[single_raw_event], nextPageToken="page2"),
+        "page2": dict(items=[second], nextSyncToken="sync1"),
+    }
+    client = FakeClient(
+        {
+            "primary": lambda **kw: pages[kw.get("pageToken")],
+            # The same event on both calendars only shows up once
+            "team@example.com": lambda **kw: dict(items=[earlier, single_raw_event]),
+        }
+    )
+    with use_client(client):
+        events = gcal_async.fetch_events(args)
+    assert [e["id"] for e in events] == ["earlier", single_raw_event["id"], "second"]
+    assert {r["token"] for r in client.requests} == {"access"}
+    assert {r["fields"] for r in client.requests} == {gcal_async.gcal.LIST_FIELDS}
+    assert {r["calendar_id"] for r in client.requests} == set(args.calendars)
+
+    # Now it's all cached
+    client.requests.clear()
+    with use_client(client):
+        assert gcal_async.fetch_events(args) == events
+    assert client.requests == []
+    fetch_creds.assert_called_once()
+
+
+def test_fetch_events_expired_sync_token(
+    fetch_creds: MagicMock, args: Args, single_raw_event: dict, monkeypatch
+):
+    client = FakeClient(
+        {"primary": lambda **kw: dict(items=[single_raw_event], nextSyncToken="s1")}
+    )
+    with use_client(client):
+        gcal_async.fetch_events(args)
+
+    monkeypatch.setattr(gcal_async.c, "EVENT_CACHE_MAX_AGE_SECONDS", -1)
+    renamed = dict(single_raw_event, summary="Renamed")
+
+    def primary(**kw):
+        if "syncToken" in kw:
+            raise gcal_async.HttpError(410, b"Gone")
+        return dict(items=[renamed], nextSyncToken="s2")
+
+    client = FakeClient(dict(primary=primary))
+    with use_client(client):
+        events = gcal_async.fetch_events(args)
+    assert events == [renamed]
+    assert [r.get("syncToken") for r in client.requests] == ["s1", None]
+
+
+def test_full_fetch_for_the_cache(
+    fetch_creds: MagicMock, args: Args, single_raw_event: dict, event_cache_file
+):
+    earlier = dict(
+        single_raw_event,
+        id="earlier",
+        start={"dateTime": "2021-07-12T09:15:00-04:00"},
+        end={"dateTime": "2021-07-12T09:20:00-04:00"},
+    )
+    # Without orderBy google hands events back in any order, but with a sync
+    # token.
+    client = FakeClient(
+        dict(
+            primary=lambda **kw: dict(
+                items=[single_raw_event, earlier], nextSyncToken="sync1"
+            )
+        )
+    )
+    with use_client(client):
+        events = gcal_async.fetch_events(args)
+    assert [e["id"] for e in events] == ["earlier", single_raw_event["id"]]
+    (request,) = client.requests
+    assert "orderBy" not in request and "maxResults" not in request
+    # Past the window we want, so later runs can still use it
+    window_max = NOW + timedelta(
+        hours=gcal_async.c.HOURS_AHEAD + gcal_async.c.EVENT_CACHE_EXTRA_HOURS
+    )
+    assert request["timeMax"] == window_max.isoformat()
+    with EventCache(event_cache_file) as cache:
+        assert cache.state("primary").sync_token == "sync1"
+
+
+def test_fetch_events_calendar_timeout(
+    fetch_creds: MagicMock, args: Args, single_raw_event: dict, monkeypatch
+):
+    monkeypatch.setattr(gcal_async.c, "FETCH_TIMEOUT_SECONDS", 0.1)
+    args.calendars = ["primary", "slow"]
+
+    async def slow(**kw):
+        await asyncio.sleep(1)
+        return dict(items=[])
+
+    client = FakeClient(
+        dict(primary=lambda **kw: dict(items=[single_raw_event]), slow=slow)
+    )
+    started = time.monotonic()
+    with use_client(client):
+        assert gcal_async.fetch_events(args) == [single_raw_event]
+    assert time.monotonic() - started < 1
+
+
+def event_at(event: dict, id: str, start: str) -> dict:
+    return dict(
+        event,
+        id=id,
+        start={"dateTime": f"2021-07-12T{start}:00-04:00"},
+        end={"dateTime": f"2021-07-12T{start[:2]}:59:00-04:00"},
+    )
+
+
+def test_creds_load_while_reading_the_cache(
+    fetch_creds: MagicMock, args: Args, single_raw_event: dict, monkeypatch
+):
+    args.calendars = ["primary", "team"]
+    team = event_at(single_raw_event, "team", "10:00")
+    client = FakeClient(
+        dict(
+            primary=lambda **kw: dict(items=[single_raw_event], nextSyncToken="s1"),
+            team=lambda **kw: dict(items=[team], nextSyncToken="s2"),
+        )
+    )
+    with use_client(client):
+        gcal_async.fetch_events(args)
+
+    # Only the team calendar is stale
+    with EventCache(gcal_async.c.EVENT_CACHE_FILE) as cache:
+        cache.apply_changes("team", [], "s2", 0)
+    read = threading.Event()
+    events = EventCache.events
+
+    def reading(self, *args):
+        read.set()
+        return events(self, *args)
+
+    def load_creds():
+        # Which would time out if one waited on the other
+        assert read.wait(1)
+        return MagicMock(token="access")
+
+    monkeypatch.setattr(EventCache, "events", reading)
+    fetch_creds.side_effect = load_creds
+    client.requests.clear()
+    with use_client(client):
+        events_now = gcal_async.fetch_events(args)
+    assert [e["id"] for e in events_now] == [single_raw_event["id"], "team"]
+    assert [r["calendar_id"] for r in client.requests] == ["team"]
+
+
+def test_iter_parsed_pages(
+    fetch_creds: MagicMock, args: Args, single_raw_event: dict, monkeypatch
+):
+    args.calendars = ["primary", "team"]
+    later = event_at(single_raw_event, "later", "10:00")
+    pages = {
+        None: dict(items=[single_raw_event], nextPageToken="page2"),
+        "page2": dict(items=[later]),
+    }
+    page2_requested = threading.Event()
+
+    def primary(**kw):
+        if kw.get("pageToken") == "page2":
+            page2_requested.set()
+        return pages[kw.get("pageToken")]
+
+    client = FakeClient(
+        dict(
+            primary=primary,
+            team=lambda **kw: dict(
+                items=[
+                    event_at(single_raw_event, "earlier", "09:15"),
+                    event_at(single_raw_event, "last", "11:00"),
+                ]
+            ),
+        )
+    )
+    parse_events = gcal_async.parse_events
+
+    def parse_page(events, args):
+        # The next page is fetched while this one is parsed
+        assert page2_requested.wait(1)
+        return parse_events(events, args)
+
+    monkeypatch.setattr(gcal_async, "parse_events", parse_page)
+
+    async def collect():
+        return [
+            [e.id for e in page] async for page in gcal_async.iter_parsed_pages(args)
+        ]
+
+    with use_client(client):
+        found = asyncio.run(collect())
+    # Each page is everything starting by when the primary calendar has got to
+    assert found == [["earlier", single_raw_event["id"]], ["later", "last"]]
+    assert {r["orderBy"] for r in client.requests} == {"startTime"}
+
+
+def test_command_join_async(
+    fetch_creds: MagicMock, args: Args, single_raw_event: dict, capsys
+):
+    args.now = NOW + timedelta(minutes=29)
+    args.use_async = True
+    pages = {
+        None: dict(
+            items=[single_raw_event, event_at(single_raw_event, "later", "10:00")],
+            nextPageToken="page2",
+        ),
+        "page2": dict(
+            items=[event_at(single_raw_event, "after", "11:00")],
+            nextPageToken="page3",
+        ),
+        "page3": dict(items=[]),
+    }
+    client = FakeClient(dict(primary=lambda **kw: pages[kw.get("pageToken")]))
+    with use_client(client):
+        command_join(args)
+    assert capsys.readouterr().out.startswith("zoommtg://example.zoom.us/join")
+    # Decided on the first page, so the one after the next never was asked for
+    assert "page3" not in [r.get("pageToken") for r in client.requests]
+
+
+def test_command_list_async(args: Args, capsys):
+    assert parse_args(["-c", "list", "--async"]).use_async
+    args.use_async = True
+    with patch("next_meeting.gcal_async.fetch_events") as mock_fetch_events:
+        mock_fetch_events.return_value = []
+        from next_meeting.main import command_list
+
+        command_list(args)
+    mock_fetch_events.assert_called_once_with(args)
+
+
+def test_thread_client():
+    http = MagicMock(name="Http")
+    http.request.return_value = (MagicMock(status=200), b'{"items": []}')
+    with patch("next_meeting.gcal_async.http_pool") as pool:
+        pool().connection().__enter__.return_value = http
+        client = gcal_async._ThreadClient()
+        result = asyncio.run(client.get_json("https://x/events", dict(a="1"), "tok"))
+        assert result == dict(items=[])
+        url = http.request.call_args.args[0]
+        assert parse_qs(urlparse(url).query) == dict(a=["1"])
+        headers = http.request.call_args.kwargs["headers"]
+        assert headers["Authorization"] == "Bearer tok"
+        assert "gzip" in headers["User-Agent"]
+
+        http.request.return_value = (MagicMock(status=410), b"Gone")
+        with pytest.raises(gcal_async.HttpError) as e:
+            asyncio.run(client.get_json("https://x/events", {}, None))
+        assert e.value.status == 410
+
+
+def test_httpx_client():
+    def handler(request):
+        assert request.headers["Authorization"] == "Bearer tok"
+        if request.url.params.get("syncToken"):
+            return httpx.Response(410)
+        return httpx.Response(200, json=dict(items=[]))
+
+    async def run():
+        client = gcal_async._HttpxClient()
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            assert await client.get_json("https://x/events", {}, "tok") == dict(
+                items=[]
+            )
+            with pytest.raises(gcal_async.HttpError):
+                await client.get_json("https://x/events", dict(syncToken="s"), "tok")
+        finally:
+            await client.aclose()
+
+    asyncio.run(run())
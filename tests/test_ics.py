@@ -0,0 +1,229 @@
+import json
+import os
+import time
+from dataclasses import replace
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import patch
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import next_meeting.ics as ics
+from next_meeting.args import Args, Command, OutputFormat
+from next_meeting.main import command_list
+from next_meeting.parsing import parse_event
+
+CALENDAR = "tests/events/calendar.ics"
+NEW_YORK = ZoneInfo("America/New_York")
+
+
+@pytest.fixture
+def ics_args() -> Args:
+    return Args(
+        command=Command.list,
+        format=OutputFormat.alfred,
+        now=datetime.fromisoformat("2021-07-12T09:00:00-04:00"),
+        ics=[CALENDAR],
+    )
+
+
+def at(day: int, hour: int = 9) -> datetime:
+    return datetime(2021, 7, day, hour, tzinfo=NEW_YORK)
+
+
+def test_fetch_events(ics_args: Args):
+    events = ics.fetch_events(ics_args)
+    # The standup was moved to Wednesday, the rest are out of the window or
+    # cancelled.
+    assert [e["id"] for e in events] == ["holiday@example.com", "review@example.com"]
+    holiday, review = events
+    assert holiday["start"] == dict(date="2021-07-12")
+    assert holiday["end"] == dict(date="2021-07-13")
+    assert review["start"] == dict(dateTime="2021-07-12T14:00:00+00:00")
+    assert review["summary"] == "JIRA Board Review, again"
+    assert review["description"] == (
+        "This is a meeting to review the JIRA Board.\n"
+        "Join: https://meet.google.com/abc-defg-hij"
+    )
+
+    event = parse_event(review, ics_args)
+    assert event.meeting_link == "https://meet.google.com/abc-defg-hij"
+    assert event.start == datetime(2021, 7, 12, 14, tzinfo=timezone.utc)
+
+
+def test_exdate(ics_args: Args):
+    events = ics.fetch_events(replace(ics_args, now=at(13)))
+    assert "standup@example.com_20210713T133000Z" not in [e["id"] for e in events]
+
+
+def test_moved_instance(ics_args: Args):
+    events = ics.fetch_events(replace(ics_args, now=at(14)))
+    standups = [e for e in events if e["id"].startswith("standup@")]
+    assert [(e["id"], e["summary"], e["start"]["dateTime"]) for e in standups] == [
+        (
+            "standup@example.com_20210714T133000Z",
+            "Standup",
+            "2021-07-14T09:30:00-04:00",
+        ),
+        (
+            "standup@example.com_20210712T133000Z",
+            "Standup (moved)",
+            "2021-07-14T11:00:00-04:00",
+        ),
+    ]
+    assert standups[0]["etag"] == "3-20210712T120000Z"
+    # Not the alarm's
+    assert "description" not in standups[0]
+
+
+def test_command_list(ics_args: Args, capsys):
+    command_list(replace(ics_args, now=at(15).replace(minute=28)))
+    output = json.loads(capsys.readouterr().out.splitlines()[-1])
+    variables = output["alfredworkflow"]["variables"]
+    assert variables["next_meeting"] == "FoundNextMeeting"
+    assert variables["title"] == "Standup"
+    assert variables["meeting_link"].startswith("zoommtg://example.zoom.us/join")
+
+
+def occurrences(rule: str, dtstart, after: datetime, before: datetime):
+    return list(ics._occurrences(dtstart, ics._parse_rule(rule), after, before))
+
+
+@pytest.mark.parametrize(
+    "rule, expected",
+    [
+        ("FREQ=MONTHLY;BYDAY=2TU", [date(2021, 7, 13), date(2021, 8, 10)]),
+        ("FREQ=MONTHLY;BYDAY=-1FR", [date(2021, 7, 30), date(2021, 8, 27)]),
+        ("FREQ=MONTHLY;BYMONTHDAY=1,-1", [date(2021, 7, 1), date(2021, 7, 31)]),
+        ("FREQ=DAILY;INTERVAL=10", [date(2021, 7, 10), date(2021, 7, 20)]),
+        ("FREQ=WEEKLY;INTERVAL=2;BYDAY=MO", [date(2021, 7, 12), date(2021, 7, 26)]),
+        ("FREQ=YEARLY;BYMONTH=7,8;BYMONTHDAY=4", [date(2021, 7, 4), date(2021, 8, 4)]),
+        ("FREQ=DAILY;COUNT=3", []),
+        ("FREQ=DAILY;UNTIL=20210702", [date(2021, 7, 1), date(2021, 7, 2)]),
+    ],
+)
+def test_occurrences(rule: str, expected):
+    # Starting well before the window
+    dtstart = datetime(2021, 1, 1, 9, tzinfo=timezone.utc)
+    after = datetime(2021, 7, 1, tzinfo=timezone.utc)
+    found = occurrences(rule, dtstart, after, after + timedelta(days=60))
+    assert [d.date() for d in found if d >= after][:2] == expected
+
+
+def test_occurrences_keep_wall_time():
+    # Across the change from daylight saving time
+    dtstart = datetime(2021, 11, 5, 9, 30, tzinfo=NEW_YORK)
+    found = occurrences("FREQ=DAILY", dtstart, dtstart, dtstart + timedelta(days=3))
+    assert [d.utcoffset() for d in found] == [timedelta(hours=h) for h in (-4, -4, -5)]
+    assert {d.hour for d in found} == {9}
+
+
+@pytest.fixture
+def new_york_local(monkeypatch):
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.mark.parametrize(
+    "dtstart", ["DTSTART:20211101T093000", "DTSTART;TZID=Eastern:20211101T093000"]
+)
+def test_floating_keeps_wall_time(new_york_local, dtstart: str):
+    # Floating (and unknown TZID) weekly meetings stay at 9:30 local time once
+    # daylight saving time ends
+    window = ics.Window(
+        datetime(2021, 11, 1, tzinfo=NEW_YORK), datetime(2021, 11, 16, tzinfo=NEW_YORK)
+    )
+    window.read(
+        [
+            "BEGIN:VEVENT",
+            "UID:weekly@example.com",
+            dtstart,
+            "DURATION:PT30M",
+            "RRULE:FREQ=WEEKLY",
+            "END:VEVENT",
+        ]
+    )
+    assert [(e["start"], e["end"]) for e in window.events()] == [
+        (
+            dict(dateTime=f"2021-11-{day:02}T09:30:00{offset}"),
+            dict(dateTime=f"2021-11-{day:02}T10:00:00{offset}"),
+        )
+        for day, offset in ((1, "-04:00"), (8, "-05:00"), (15, "-05:00"))
+    ]
+
+
+def test_occurrences_never():
+    # There's never a 30th of February, but that's no reason to hang
+    dtstart = datetime(2020, 1, 30, tzinfo=timezone.utc)
+    rule = "FREQ=YEARLY;BYMONTH=2;BYMONTHDAY=30"
+    assert occurrences(rule, dtstart, at(1), at(2)) == []
+
+
+def test_occurrences_unsupported():
+    dtstart = datetime(2021, 7, 12, tzinfo=timezone.utc)
+    rule = "FREQ=MONTHLY;BYSETPOS=-1;BYDAY=MO,TU"
+    assert occurrences(rule, dtstart, at(1), at(31)) == [dtstart]
+
+
+def test_skips_ahead():
+    # An event that has happened every day for 50 years only costs us the
+    # window (and a day or so either side)
+    dtstart = datetime(1971, 7, 12, tzinfo=timezone.utc)
+    rule = ics._parse_rule("FREQ=DAILY")
+    with patch("next_meeting.ics._days", wraps=ics._days) as days:
+        found = list(ics._occurrences(dtstart, rule, at(12), at(13)))
+    assert [d for d in found if d >= at(12)] == [
+        datetime(2021, 7, 13, tzinfo=timezone.utc)
+    ]
+    assert days.call_count < 5
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        ("SUMMARY:Hello", ("SUMMARY", "", "Hello")),
+        (
+            "dtstart;TZID=UTC:20210712T090000",
+            ("DTSTART", "TZID=UTC", "20210712T090000"),
+        ),
+        (
+            'ATTENDEE;CN="Last: First":mailto:a@example.com',
+            ("ATTENDEE", 'CN="Last: First"', "mailto:a@example.com"),
+        ),
+    ],
+)
+def test_split(line: str, expected):
+    assert ics._split(line) == expected
+
+
+@pytest.fixture
+def feed_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(ics.c, "ICS_FEED_DIR", str(tmp_path / "feeds"))
+    return tmp_path / "feeds"
+
+
+def test_feed(ics_args: Args, feed_dir):
+    args = replace(ics_args, ics=["webcal://example.com/calendar.ics"])
+
+    def download(url: str, path: str) -> None:
+        assert url == "https://example.com/calendar.ics"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(CALENDAR) as f, open(path, "w") as out:
+            out.write(f.read())
+
+    with patch("next_meeting.ics._download", side_effect=download) as mock_download:
+        assert len(ics.fetch_events(args)) == 2
+        assert len(ics.fetch_events(args)) == 2
+        assert mock_download.call_count == 1
+
+        # Stale, but we can't get a new copy
+        for path in feed_dir.iterdir():
+            os.utime(path, (0, time.time() - ics.c.ICS_FEED_MAX_AGE_SECONDS))
+        mock_download.side_effect = OSError("offline")
+        assert len(ics.fetch_events(args)) == 2
+
+        with pytest.raises(OSError):
+            ics.fetch_events(replace(args, ics=["https://example.com/other.ics"]))
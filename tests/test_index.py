@@ -0,0 +1,102 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import next_meeting.constants as c
+from next_meeting.args import Args, NextMeetingOptions
+from next_meeting.index import EventIndex
+from next_meeting.main import find_meeting_to_join
+from next_meeting.parsing import MyEvent, update_event_times
+
+from . import factories as f
+
+START = datetime(2021, 7, 12, 9, 0, tzinfo=timezone.utc)
+
+
+def event(start_minutes: int, length_minutes: int) -> MyEvent:
+    e = f.sample_my_event()
+    e.id = f"{start_minutes}+{length_minutes}"
+    e.start = START + timedelta(minutes=start_minutes)
+    e.end = e.start + timedelta(minutes=length_minutes)
+    return e
+
+
+def test_empty():
+    index = EventIndex([])
+    assert index.in_progress(START) == []
+    assert index.starting_soon(START) == []
+    assert index.find_meeting_to_join(START) == (NextMeetingOptions.NoOptions, None)
+
+
+def test_in_progress_boundaries():
+    first, second = event(0, 30), event(30, 30)
+    index = EventIndex([second, first])
+    at = START.__add__
+    assert index.in_progress(at(timedelta(minutes=-1))) == []
+    assert index.in_progress(at(timedelta(minutes=0))) == [first]
+    assert index.in_progress(at(timedelta(minutes=10))) == [first]
+    # Both ends are inclusive
+    assert index.in_progress(at(timedelta(minutes=30))) == [first, second]
+    assert index.in_progress(at(timedelta(minutes=45))) == [second]
+    assert index.in_progress(at(timedelta(minutes=61))) == []
+
+
+def test_starting_soon():
+    first, second = event(0, 30), event(30, 30)
+    index = EventIndex([first, second])
+    assert index.starting_soon(START + timedelta(minutes=28)) == [second]
+    assert index.starting_soon(START + timedelta(minutes=27)) == []
+    assert index.starting_soon(START + timedelta(minutes=30)) == []
+
+
+def test_events_without_times():
+    no_start = f.sample_my_event()
+    no_start.start = None
+    index = EventIndex([no_start])
+    assert index.in_progress(START) == []
+    assert index.find_meeting_to_join(START) == (
+        NextMeetingOptions.MultipleOptions,
+        None,
+    )
+
+
+def test_matches_find_meeting_to_join(args: Args):
+    """The index should always agree with flagging every event for the time
+    and searching them"""
+    rng = random.Random(1234)
+    events = sorted(
+        (
+            event(rng.randrange(0, 600, 5), rng.choice([5, 15, 30, 60, 90]))
+            for _ in range(40)
+        ),
+        key=lambda e: e.start,
+    )
+    index = EventIndex(events)
+    for minute in range(-10, 700):
+        args.now = START + timedelta(minutes=minute, seconds=rng.choice([0, 30]))
+        flagged = [update_event_times(e, args.now) for e in events if e.end >= args.now]
+        expected = find_meeting_to_join(flagged, args)
+        assert index.find_meeting_to_join(args.now) == expected, args.now
+
+
+def test_horizon_matches_find_meeting_to_join(args: Args):
+    """With a horizon the index should agree with searching only the events
+    we'd have fetched"""
+    rng = random.Random(4321)
+    events = sorted(
+        (
+            event(rng.randrange(0, 1200, 5), rng.choice([5, 15, 30, 60, 90]))
+            for _ in range(20)
+        ),
+        key=lambda e: e.start,
+    )
+    horizon = timedelta(hours=c.HOURS_AHEAD)
+    index = EventIndex(events, horizon)
+    for minute in range(-10, 1300, 3):
+        args.now = START + timedelta(minutes=minute)
+        fetched = [
+            update_event_times(e, args.now)
+            for e in events
+            if e.end >= args.now and e.start < args.now + horizon
+        ]
+        expected = find_meeting_to_join(fetched, args)
+        assert index.find_meeting_to_join(args.now) == expected, args.now
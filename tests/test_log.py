@@ -0,0 +1,100 @@
+import logging
+from dataclasses import replace
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import next_meeting.gcal as gcal
+import next_meeting.log as log
+from next_meeting.args import Args, LogLevel, OutputFormat, parse_args
+
+logger = logging.getLogger("next_meeting.test")
+
+
+@pytest.fixture(autouse=True)
+def stop_logging():
+    yield
+    log.stop()
+
+
+class Formatted:
+    """Counts how many times it's been formatted into a message"""
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __str__(self) -> str:
+        self.count += 1
+        return "formatted"
+
+
+def test_configure(args: Args, capsys):
+    log.configure(replace(args, log_level=LogLevel.info))
+    logger.info("Shown %s", "here")
+    logger.debug("Not shown")
+    log.stop()
+
+    captured = capsys.readouterr()
+    assert captured.err == "Shown here\n"
+    assert captured.out == ""
+
+
+def test_configure_stdout(args: Args, capsys):
+    log.configure(replace(args, format=OutputFormat.stdout, log_level=LogLevel.info))
+    logger.info("Shown")
+    log.stop()
+    assert capsys.readouterr().out == "Shown\n"
+
+
+def test_below_level_not_formatted(args: Args, capsys):
+    log.configure(args)
+    message = Formatted()
+    logger.debug("%s", message)
+    logger.info("%s", message)
+    log.stop()
+
+    assert message.count == 0
+    assert capsys.readouterr().err == ""
+
+
+def test_log_file(args: Args, tmp_path, monkeypatch):
+    monkeypatch.setattr(log.c, "LOG_FILE_MAX_BYTES", 200)
+    path = tmp_path / "next-meeting.log"
+    log.configure(replace(args, log_level=LogLevel.debug, log_file=str(path)))
+    for i in range(10):
+        logger.debug("Message %d", i)
+    log.stop()
+
+    assert "DEBUG next_meeting.test: Message 9" in path.read_text()
+    assert (tmp_path / "next-meeting.log.1").exists()
+
+
+def test_configure_again(args: Args, capsys):
+    log.configure(args)
+    log.configure(args)
+    logger.warning("Once")
+    log.stop()
+    assert capsys.readouterr().err == "Once\n"
+
+
+def test_parse_args():
+    args = parse_args(["-c", "list", "--log-level", "debug", "--log-file", "x.log"])
+    assert args.log_level == LogLevel.debug
+    assert args.log_file == "x.log"
+    assert parse_args(["-c", "list"]).log_level == LogLevel.warning
+
+
+@pytest.mark.parametrize("level, dumps", [(LogLevel.warning, 0), (LogLevel.debug, 1)])
+def test_raw_events_only_when_debugging(
+    args: Args, single_raw_event: dict, level: LogLevel, dumps: int
+):
+    args.now = datetime.fromisoformat("2021-07-12T09:00:00-04:00")
+    log.configure(replace(args, log_level=level))
+    service = MagicMock(name="GoogleService")
+    service.events().list().execute.return_value = dict(items=[single_raw_event])
+    with patch("next_meeting.gcal.fetch_creds"), patch(
+        "next_meeting.gcal._get_service", return_value=service
+    ), patch("next_meeting.gcal.debug_raw_events") as mock_debug_raw_events:
+        gcal.fetch_events(args)
+    assert mock_debug_raw_events.call_count == dumps
@@ -1,17 +1,25 @@
+import json
+import time
 from datetime import datetime, timedelta, timezone
 from unittest.mock import MagicMock, patch
 
 import pytest
 
+import next_meeting.constants as c
 from next_meeting.alfred import AlfredWorkflow, JsonUtilityFormat, ScriptFilterOutput
-from next_meeting.args import Args, NextMeetingOptions
-from next_meeting.main import command_list
-from next_meeting.parsing import MyEvent
+from next_meeting.args import Args, NextMeetingOptions, OutputFormat
+from next_meeting.cache import EventCache
+from next_meeting.index import EventIndex
+from next_meeting.main import command_join, command_list, next_change, render_list
+from next_meeting.parsing import MyEvent, update_event_times
+from next_meeting.payload import load as load_payload
+
+from . import factories as f
 
 
 @pytest.fixture
 def mock_fetch_events() -> MagicMock:
-    with patch("next_meeting.main.fetch_events") as p:
+    with patch("next_meeting.gcal.fetch_events") as p:
         yield p
 
 
@@ -63,3 +71,93 @@ def test_command_list_meeting_to_join(
     )
     expected_output: str = expected.to_json() + "\n"
     assert expected_output == captured.out
+
+
+def test_next_change():
+    now = datetime(2021, 7, 12, 9, 0, tzinfo=timezone.utc)
+    event = MyEvent(
+        id="1",
+        start=now + timedelta(minutes=30),
+        end=now + timedelta(minutes=60),
+        summary="",
+    )
+    assert next_change([event], now) == now + timedelta(minutes=27)
+    assert next_change([event], now + timedelta(minutes=28)) == event.start
+    assert next_change([event], now + timedelta(minutes=31)) == event.end
+    assert next_change([event], now + timedelta(minutes=61)) is None
+    assert next_change([], now) is None
+
+
+def test_command_list_saves_payload(
+    mock_fetch_events: MagicMock, args: Args, single_raw_event: dict, capsys
+):
+    args.now = datetime(2021, 7, 12, 13, 0, 0, 0, tzinfo=timezone.utc)
+    mock_fetch_events.return_value = [single_raw_event]
+
+    # Nothing was cached, so nothing to say when this should be refreshed
+    command_list(args)
+    assert load_payload(args) is None
+
+    with EventCache(c.EVENT_CACHE_FILE) as cache:
+        window_end = args.now + timedelta(hours=c.HOURS_AHEAD)
+        cache.replace("primary", [], None, args.now, window_end, time.time())
+    command_list(args)
+    output = capsys.readouterr().out.splitlines()[-1]
+    assert load_payload(args) == output
+
+    # Good until it's time to join the meeting at 13:30
+    args.now = datetime(2021, 7, 12, 13, 26, 59, 0, tzinfo=timezone.utc)
+    assert load_payload(args) == output
+    args.now = datetime(2021, 7, 12, 13, 27, 0, 0, tzinfo=timezone.utc)
+    assert load_payload(args) is None
+
+
+@patch("next_meeting.gcal.iter_events")
+def test_command_list_ndjson(
+    mock_iter_events: MagicMock, args: Args, single_raw_event: dict, capsys
+):
+    args.format = OutputFormat.ndjson
+    args.now = datetime(2021, 7, 12, 13, 29, 0, 0, tzinfo=timezone.utc)
+    day_event = dict(
+        single_raw_event,
+        id="day",
+        start=dict(date="2021-07-12"),
+        end=dict(date="2021-07-13"),
+    )
+    mock_iter_events.return_value = iter([day_event, single_raw_event])
+    command_list(args)
+
+    meeting, decision = map(json.loads, capsys.readouterr().out.splitlines())
+    assert meeting["type"] == "meeting"
+    assert meeting["title"] == "JIRA Board Review"
+    assert meeting["start"] == "2021-07-12T09:30:00-04:00"
+    assert meeting["is_next_joinable"] is True
+    assert decision == dict(
+        type="decision",
+        next_meeting=NextMeetingOptions.FoundNextMeeting.value,
+        id=meeting["id"],
+        meeting_link=meeting["meeting_link"],
+        title="JIRA Board Review",
+        start="2021-07-12T09:30:00-04:00",
+    )
+
+
+@patch("next_meeting.gcal.iter_events")
+def test_command_join_nothing_obvious(
+    mock_iter_events: MagicMock, args: Args, single_raw_event: dict, capsys
+):
+    # Half an hour before the only meeting
+    args.now = datetime(2021, 7, 12, 13, 0, 0, 0, tzinfo=timezone.utc)
+    mock_iter_events.return_value = iter([single_raw_event])
+    command_join(args)
+    assert capsys.readouterr().out == ""
+
+
+def test_render_list_ndjson(args: Args):
+    args.format = OutputFormat.ndjson
+    args.now = datetime(2021, 7, 12, 13, 29, 0, 0, tzinfo=timezone.utc)
+    events = [update_event_times(f.sample_my_event(), args.now)]
+    expected = render_list(events, args)
+    assert render_list(events, args, EventIndex(events)) == expected
+    [decision] = map(json.loads, expected.splitlines()[1:])
+    assert decision["next_meeting"] == NextMeetingOptions.FoundNextMeeting.value
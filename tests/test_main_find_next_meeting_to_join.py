@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 from next_meeting.args import Args, NextMeetingOptions
 from next_meeting.main import find_meeting_to_join
 
@@ -84,3 +86,42 @@ def test_multiple_in_progress_one_up_next(args: Args):
 
     assert options == NextMeetingOptions.FoundNextMeeting
     assert to_join is next
+
+
+def test_stops_once_decided(args: Args):
+    in_progress = f.sample_my_event()
+    in_progress.in_progress = True
+    args.now = in_progress.start + timedelta(minutes=5)
+    later = f.sample_my_event()
+    later.start = args.now + timedelta(hours=1)
+
+    def events():
+        yield in_progress
+        yield later
+        raise AssertionError("Kept looking after the decision was made")
+
+    options, to_join = find_meeting_to_join(events(), args)
+
+    assert options == NextMeetingOptions.FoundNextMeeting
+    assert to_join is in_progress
+
+
+def test_stops_at_second_next_joinable(args: Args):
+    in_progress = f.sample_my_event()
+    in_progress.in_progress = True
+    args.now = in_progress.start + timedelta(minutes=5)
+    next1, next2 = f.sample_my_event(), f.sample_my_event()
+    for e in (next1, next2):
+        e.start = args.now + timedelta(minutes=1)
+        e.is_next_joinable = True
+
+    def events():
+        yield in_progress
+        yield next1
+        yield next2
+        raise AssertionError("Kept looking after the decision was made")
+
+    options, to_join = find_meeting_to_join(events(), args)
+
+    assert options == NextMeetingOptions.FoundNextMeeting
+    assert to_join is in_progress
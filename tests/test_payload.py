@@ -0,0 +1,89 @@
+import runpy
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import next_meeting.constants as c
+from next_meeting import payload
+from next_meeting.args import Args, OutputFormat
+
+NOW = datetime(2021, 7, 12, 13, 0, tzinfo=timezone.utc)
+ARGV = ["-c", "list", "-f", "alfred", "-n", NOW.isoformat()]
+
+
+@pytest.fixture
+def saved(args: Args) -> Args:
+    args.now = NOW
+    payload.save(args, "output", NOW + timedelta(minutes=5), time.time() + 60)
+    return args
+
+
+def test_load(saved: Args):
+    assert payload.load(saved) == "output"
+    saved.now = NOW + timedelta(minutes=4)
+    assert payload.load(saved) == "output"
+
+
+@pytest.mark.parametrize(
+    "now",
+    [NOW - timedelta(seconds=1), NOW + timedelta(minutes=5), NOW.replace(tzinfo=None)],
+)
+def test_load_outside_window(saved: Args, now: datetime):
+    saved.now = now
+    assert payload.load(saved) is None
+
+
+def test_load_expired(args: Args):
+    args.now = NOW
+    payload.save(args, "output", None, time.time() - 1)
+    assert payload.load(args) is None
+
+
+def test_load_outside_rendered_window(args: Args):
+    # Nothing in it will change, but it's only what was happening then
+    args.now = NOW
+    payload.save(args, "output", None, time.time() + 60)
+    args.now = NOW + timedelta(hours=c.HOURS_AHEAD, seconds=-1)
+    assert payload.load(args) == "output"
+    args.now = NOW + timedelta(hours=c.HOURS_AHEAD)
+    assert payload.load(args) is None
+    args.now = datetime.now(timezone.utc)
+    assert payload.load(args) is None
+
+
+def test_load_different_args(saved: Args):
+    saved.calendars = ["team"]
+    assert payload.load(saved) is None
+
+
+def test_load_not_cacheable(saved: Args):
+    saved.refresh = True
+    assert payload.load(saved) is None
+    saved.refresh = False
+    saved.format = OutputFormat.stdout
+    assert payload.load(saved) is None
+
+
+def test_load_nothing_saved(args: Args):
+    assert payload.load(args) is None
+
+
+def test_cached_output(saved: Args, capsys):
+    assert payload.cached_output(ARGV) == "output"
+    assert payload.cached_output(ARGV + ["--refresh"]) is None
+    assert payload.cached_output(["--bogus"]) is None
+    # Leaves the complaining to the real run
+    assert capsys.readouterr().err == ""
+
+
+def test_help_printed_once(saved: Args, capsys, monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["nm.py", "--help"])
+    with pytest.raises(SystemExit):
+        runpy.run_path("nm.py", run_name="__main__")
+    assert capsys.readouterr().out.count("usage:") == 1
+
+
+def test_cached_output_nothing_saved():
+    assert payload.cached_output(ARGV) is None
@@ -0,0 +1,117 @@
+import json
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from next_meeting import profiling
+from next_meeting.args import ProfileFormat
+from next_meeting.main import entrypoint
+
+
+@pytest.fixture
+def profiler():
+    yield profiling.start()
+    profiling._profiler = None
+
+
+@profiling.profiled("double")
+def double(x: int) -> int:
+    return x * 2
+
+
+def test_disabled_records_nothing():
+    assert profiling._profiler is None
+    assert profiling.span("a") is profiling.span("b")
+    with profiling.span("a"):
+        pass
+    assert double(2) == 4
+
+
+def test_spans(profiler: profiling.Profiler):
+    with profiling.span("outer"):
+        assert double(2) == 4
+        assert double(3) == 6
+
+    assert [(s.name, s.depth) for s in profiler.spans] == [
+        ("double", 1),
+        ("double", 1),
+        ("outer", 0),
+    ]
+    stages = profiler.stages()
+    assert [(s["name"], s["calls"], s["depth"]) for s in stages] == [
+        ("outer", 1, 0),
+        ("double", 2, 1),
+    ]
+    breakdown = profiler.breakdown()
+    assert "\n  double " in breakdown
+    assert breakdown.splitlines()[-1].startswith("total")
+
+
+def test_spans_from_other_threads(profiler: profiling.Profiler):
+    with profiling.span("main"):
+        thread = threading.Thread(target=double, args=(1,), name="worker")
+        thread.start()
+        thread.join()
+
+    # Nesting is per thread
+    assert {(s.name, s.thread_name, s.depth) for s in profiler.spans} == {
+        ("main", "MainThread", 0),
+        ("double", "worker", 0),
+    }
+
+
+def test_span_records_exceptions(profiler: profiling.Profiler):
+    with pytest.raises(ValueError):
+        with profiling.span("boom"):
+            raise ValueError()
+    assert [s.name for s in profiler.spans] == ["boom"]
+
+
+def test_chrome_trace(profiler: profiling.Profiler):
+    double(1)
+    trace = profiler.to_chrome_trace()
+    complete = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+    metadata = [e for e in trace["traceEvents"] if e["ph"] == "M"]
+    assert [e["name"] for e in complete] == ["double"]
+    assert metadata[0]["args"] == dict(name="MainThread")
+    assert metadata[0]["tid"] == complete[0]["tid"]
+
+
+@pytest.mark.parametrize(
+    "format,key",
+    [(ProfileFormat.json, "stages"), (ProfileFormat.chrome, "traceEvents")],
+)
+def test_finish(profiler, tmp_path, capsys, format: ProfileFormat, key: str):
+    double(1)
+    output = str(tmp_path / "profile.json")
+    finished = profiling.finish(output, format)
+
+    assert finished is profiler
+    assert profiling._profiler is None
+    assert "double" in capsys.readouterr().err
+    with open(output) as f:
+        assert key in json.load(f)
+
+
+def test_finish_when_not_profiling(capsys):
+    assert profiling.finish(None, ProfileFormat.json) is None
+    assert capsys.readouterr().err == ""
+
+
+@patch("next_meeting.gcal.fetch_events")
+def test_entrypoint_profile(mock_fetch_events: MagicMock, tmp_path, capsys):
+    mock_fetch_events.return_value = []
+    output = str(tmp_path / "profile.json")
+    argv = ["nm.py", "-c", "list", "-f", "alfred", "--profile-output", output]
+    with patch("sys.argv", argv):
+        entrypoint()
+
+    captured = capsys.readouterr()
+    # The breakdown doesn't get mixed in with the output for Alfred
+    assert "ScriptFilterOutput.to_json" not in captured.out
+    assert "ScriptFilterOutput.to_json" in captured.err
+    with open(output) as f:
+        stages = [s["name"] for s in json.load(f)["stages"]]
+    assert "find_meeting_to_join" in stages
+    assert profiling._profiler is None
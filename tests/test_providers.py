@@ -0,0 +1,101 @@
+import pytest
+
+import next_meeting.providers as providers
+from next_meeting.args import Args
+from next_meeting.parsing import parse_event
+from next_meeting.providers import Provider
+
+from . import factories as f
+
+
+@pytest.mark.parametrize(
+    "value, provider",
+    [
+        ("https://example.zoom.us/j/1234", providers.ZOOM),
+        ("https://meet.google.com/abc-defg-hij", providers.GOOGLE_MEET),
+        ("https://teams.microsoft.com/l/meetup-join/19%3ameeting", providers.TEAMS),
+        ("https://example.webex.com/meet/someone", providers.WEBEX),
+        ("https://chime.aws/1234567890", providers.CHIME),
+        ("Room 42, https://example.com", None),
+        # The first link wins
+        ("https://chime.aws/1 or https://a.zoom.us/j/2", providers.CHIME),
+    ],
+)
+def test_find_provider(value: str, provider: Provider):
+    assert providers.find_provider(value) == provider
+    assert providers.has_meeting_link(value) == (provider is not None)
+
+
+@pytest.mark.parametrize(
+    "link, expected",
+    [
+        (
+            "https://example.zoom.us/j/1234?pwd=abcd",
+            "zoommtg://example.zoom.us/join?action=join&confno=1234&pwd=abcd",
+        ),
+        (
+            "https://teams.microsoft.com/l/meetup-join/19%3ameeting?context=x",
+            "msteams:/l/meetup-join/19%3ameeting?context=x",
+        ),
+        ("https://chime.aws/1234567890", "chime://meeting?pin=1234567890"),
+        # No protocol of their own
+        (
+            "https://meet.google.com/abc-defg-hij",
+            "https://meet.google.com/abc-defg-hij",
+        ),
+        ("https://example.webex.com/meet/x", "https://example.webex.com/meet/x"),
+        # Already native
+        (
+            "zoommtg://example.zoom.us/join?confno=1",
+            "zoommtg://example.zoom.us/join?confno=1",
+        ),
+        ("https://example.com", "https://example.com"),
+    ],
+)
+def test_to_native(link: str, expected: str):
+    assert providers.to_native(link) == expected
+
+
+def test_register(monkeypatch):
+    monkeypatch.setattr(providers, "_providers", providers.providers())
+    monkeypatch.setattr(providers, "_by_marker", dict(providers._by_marker))
+    monkeypatch.setattr(providers, "_matcher", providers._matcher)
+
+    assert not providers.has_meeting_link("https://meet.example.com/x")
+    jitsi = providers.register(
+        Provider("jitsi", ("meet.example.com",), lambda url: "jitsi-meet://x")
+    )
+    assert providers.find_provider("https://meet.example.com/x") == jitsi
+    assert providers.to_native("https://meet.example.com/x") == "jitsi-meet://x"
+    assert providers.find_provider("https://a.zoom.us/j/1") == providers.ZOOM
+    assert jitsi in providers.providers()
+
+
+def test_register_needs_hostnames():
+    with pytest.raises(ValueError):
+        providers.register(Provider("nope", ("zoom",)))
+
+
+def test_matcher_shared_tails():
+    # Tails shared, heads that are suffixes of each other, ...
+    markers = ["a.example.com", "ba.example.com", "b.com", "example.co", "x.y.z"]
+    matcher = providers._compile(markers)
+    values = [f"https://{m}/j/1" for m in markers] + [
+        "https://c.example.com",
+        "https://example.com",
+        "a.example.con",
+        "b.co",
+        "y.z",
+        "",
+    ]
+    for value in values:
+        expected = any(m in value for m in markers)
+        assert bool(matcher.search(value)) == expected, value
+
+
+def test_parse_event_teams(args: Args):
+    raw = f.single_raw_event()
+    del raw["conferenceData"]
+    raw["location"] = "https://teams.microsoft.com/l/meetup-join/19%3ameeting"
+    event = parse_event(raw, args)
+    assert event.meeting_link == "msteams:/l/meetup-join/19%3ameeting"
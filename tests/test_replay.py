@@ -0,0 +1,116 @@
+import json
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from next_meeting import gcal, log
+from next_meeting.args import (
+    Args,
+    Command,
+    LogLevel,
+    NextMeetingOptions,
+    parse_args,
+)
+from next_meeting.replay import command_replay, load_events, replay, times
+
+from . import factories as f
+
+EDT = timezone(-timedelta(hours=4))
+EVENTS = "tests/events/single-event-all-3.json"
+
+
+def test_load_events(tmp_path):
+    event = f.single_raw_event()
+    for i, recorded in enumerate([event, [event, event], dict(items=[event])]):
+        path = tmp_path / f"{i}.json"
+        path.write_text(json.dumps(recorded))
+        assert all(e == event for e in load_events(str(path)))
+    assert len(load_events(str(path))) == 1
+
+
+def test_load_events_from_log(args: Args, tmp_path):
+    event = f.single_raw_event()
+    moved = dict(event, summary="Moved")
+    other = dict(event, id="other")
+    path = tmp_path / "next-meeting.log"
+    log.configure(replace(args, log_level=LogLevel.debug, log_file=str(path)))
+    gcal.logger.debug("Getting the upcoming events in primary")
+    gcal.debug_raw_events(dict(items=[event, other], nextPageToken="page2"))
+    # The changes from a later (incremental) sync
+    gcal.debug_raw_events(dict(items=[moved, dict(id="other", status="cancelled")]))
+    log.stop()
+    assert load_events(str(path)) == [moved]
+
+    path.write_text("Nothing recorded here")
+    with pytest.raises(ValueError):
+        load_events(str(path))
+
+
+def test_times():
+    start = datetime(2021, 7, 12, 9, 0, tzinfo=EDT)
+    assert list(times(start, start + timedelta(minutes=2), timedelta(minutes=1))) == [
+        start,
+        start + timedelta(minutes=1),
+        start + timedelta(minutes=2),
+    ]
+
+
+def test_replay():
+    event = f.sample_my_event()
+    event.end = event.start + timedelta(minutes=10)
+    start = datetime(2021, 7, 12, 9, 0, tzinfo=EDT)
+    end = datetime(2021, 7, 12, 10, 0, tzinfo=EDT)
+    timeline = replay([event], times(start, end, timedelta(minutes=1)))
+    assert [(d.at.strftime("%H:%M"), d.option) for d in timeline] == [
+        # Coming up, but not yet
+        ("09:00", NextMeetingOptions.MultipleOptions),
+        ("09:28", NextMeetingOptions.FoundNextMeeting),
+        ("09:41", NextMeetingOptions.NoOptions),
+    ]
+    assert timeline[1].event.summary == event.summary
+    assert timeline[1].event.is_next_joinable is True
+
+
+def test_replay_beyond_horizon():
+    event = f.sample_my_event()
+    start = event.start - timedelta(days=1)
+    [decision] = replay([event], [start])
+    assert decision.option == NextMeetingOptions.NoOptions
+
+
+def test_command_replay(capsys):
+    args = parse_args(
+        [
+            "-c",
+            "replay",
+            "--events",
+            EVENTS,
+            "-n",
+            "2021-07-12T09:00:00-04:00",
+            "--until",
+            "2021-07-12T10:00:00-04:00",
+        ]
+    )
+    assert args.command == Command.replay
+    command_replay(args)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3
+    assert lines[1].startswith("2021-07-12T09:28:00-04:00  FoundNextMeeting")
+    assert "JIRA Board Review" in lines[1]
+
+
+def test_command_replay_at(capsys):
+    argv = ["-c", "replay", "--events", EVENTS]
+    argv += ["--at", "2021-07-12T09:35:00-04:00", "--at", "2021-07-12T09:00:00-04:00"]
+    command_replay(parse_args(argv))
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split()[1] for line in lines] == [
+        "MultipleOptions",
+        "FoundNextMeeting",
+    ]
+
+
+def test_replay_needs_events():
+    with pytest.raises(SystemExit):
+        parse_args(["-c", "replay"])
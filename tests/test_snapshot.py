@@ -0,0 +1,191 @@
+import random
+import runpy
+import sys
+import time
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import next_meeting.constants as c
+from next_meeting import payload, snapshot
+from next_meeting.args import Args, NextMeetingOptions, OutputFormat
+from next_meeting.cache import EventCache
+from next_meeting.index import EventIndex
+from next_meeting.main import command_list, render_list
+from next_meeting.parsing import update_event_times
+
+from . import factories as f
+
+NOW = datetime(2021, 7, 12, 9, 0, tzinfo=timezone.utc)
+ARGV = ["-c", "list", "-f", "alfred", "-n", NOW.isoformat()]
+
+
+def random_events(rng: random.Random, n: int):
+    events = []
+    for i in range(n):
+        e = f.sample_my_event()
+        e.id = str(i)
+        e.summary = f"Meeting {i} ☕"
+        e.start = NOW + timedelta(minutes=rng.randrange(0, 600, 5))
+        e.end = e.start + timedelta(minutes=rng.choice([5, 15, 30, 60, 90]))
+        if rng.random() < 0.1:
+            e.end = None
+        if rng.random() < 0.2:
+            e.icon = None
+        events.append(e)
+    return events
+
+
+@pytest.fixture
+def saved(args: Args) -> Args:
+    args.now = NOW
+    snapshot.save(args, random_events(random.Random(1), 20), time.time() + 60)
+    return args
+
+
+def test_empty(args: Args):
+    args.now = NOW
+    snapshot.save(args, [], time.time() + 60)
+    with snapshot.Snapshot(c.SNAPSHOT_FILE) as saved:
+        assert len(saved) == 0
+        assert saved.find_meeting_to_join(NOW) == (NextMeetingOptions.NoOptions, None)
+
+
+def test_matches_event_index(args: Args):
+    rng = random.Random(99)
+    events = random_events(rng, 60)
+    args.now = NOW
+    snapshot.save(args, events, time.time() + 60)
+    index = EventIndex(events)
+    with snapshot.Snapshot(c.SNAPSHOT_FILE) as saved:
+        for minute in range(-10, 700, 2):
+            now = NOW + timedelta(minutes=minute, seconds=rng.choice([0, 30]))
+            option, event = saved.find_meeting_to_join(now)
+            expected_option, expected_event = index.find_meeting_to_join(now)
+            assert option == expected_option, now
+            assert (event and event.id) == (expected_event and expected_event.id)
+
+
+def test_event_round_trip(args: Args):
+    edt = timezone(-timedelta(hours=4))
+    aware = replace(
+        f.sample_my_event(),
+        start=datetime(2021, 7, 12, 9, 30, tzinfo=edt),
+        end=datetime(2021, 7, 12, 10, 0, tzinfo=edt),
+    )
+    naive = replace(
+        aware, id="naive", start=datetime(2021, 7, 13, 11, 0), end=None, icon=None
+    )
+    args.now = NOW
+    snapshot.save(args, [naive, aware], time.time() + 60)
+    with snapshot.Snapshot(c.SNAPSHOT_FILE) as saved:
+        assert [saved.event(i) for i in range(len(saved))] == [aware, naive]
+        assert saved.event(0).start.utcoffset() == timedelta(hours=-4)
+
+
+def test_load(saved: Args):
+    with snapshot.load(saved) as loaded:
+        assert len(loaded) == 20
+    saved.now = NOW + timedelta(hours=1)
+    assert snapshot.load(saved) is not None
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        # Events that ended before then aren't in it
+        dict(now=NOW - timedelta(seconds=1)),
+        dict(now=NOW + timedelta(hours=c.HOURS_AHEAD, seconds=1)),
+        # As a real-time run would be
+        dict(now=datetime.now(timezone.utc)),
+        dict(calendars=["team"]),
+        dict(refresh=True),
+        dict(format=OutputFormat.stdout),
+        dict(ics=["calendar.ics"]),
+    ],
+)
+def test_load_different_args(saved: Args, change: dict):
+    assert snapshot.load(replace(saved, **change)) is None
+
+
+def test_load_expired(args: Args):
+    args.now = NOW
+    snapshot.save(args, [], time.time() - 1)
+    assert snapshot.load(args) is None
+
+
+@pytest.mark.parametrize("keep", [0, 10, snapshot._HEADER.size + 10])
+def test_load_damaged(saved: Args, keep: int):
+    with open(c.SNAPSHOT_FILE, "rb") as f:
+        data = f.read()
+    with open(c.SNAPSHOT_FILE, "wb") as f:
+        f.write(data[:keep])
+    assert snapshot.load(saved) is None
+
+
+def test_load_old_version(saved: Args, monkeypatch):
+    monkeypatch.setattr(snapshot, "_VERSION", snapshot._VERSION + 1)
+    assert snapshot.load(saved) is None
+
+
+def test_snapshot_output(args: Args):
+    events = random_events(random.Random(5), 30)
+    args.now = NOW
+    snapshot.save(args, events, time.time() + 60)
+
+    later = NOW + timedelta(hours=2, minutes=1)
+    argv = ["-c", "list", "-f", "alfred", "-n", later.isoformat()]
+    output = snapshot.snapshot_output(argv)
+
+    current = [update_event_times(replace(e), later) for e in events]
+    current = [e for e in current if not (e.end and e.end < later)]
+    current.sort(key=lambda e: e.start)
+    expected = render_list(current, replace(args, now=later), EventIndex(events))
+    assert output == expected
+    # Saved for next time
+    assert payload.load(replace(args, now=later)) == output
+
+    assert snapshot.snapshot_output(argv + ["--refresh"]) is None
+    assert snapshot.snapshot_output(["--bogus"]) is None
+
+
+def test_help_printed_once(saved: Args, capsys, monkeypatch):
+    payload.save(saved, "output", None, time.time() + 60)
+    monkeypatch.setattr(sys, "argv", ["nm.py", "-h"])
+    with pytest.raises(SystemExit):
+        runpy.run_path("nm.py", run_name="__main__")
+    assert capsys.readouterr().out.count("usage:") == 1
+
+
+def test_snapshot_output_nothing_saved():
+    assert snapshot.snapshot_output(ARGV) is None
+
+
+@patch("next_meeting.gcal.fetch_events")
+def test_command_list_saves_snapshot(
+    mock_fetch_events: MagicMock, args: Args, single_raw_event: dict, capsys
+):
+    args.now = datetime(2021, 7, 12, 13, 0, tzinfo=timezone.utc)
+    mock_fetch_events.return_value = [single_raw_event]
+
+    # Nothing was cached, so nothing to say when this should be refreshed
+    command_list(args)
+    assert snapshot.load(args) is None
+
+    with EventCache(c.EVENT_CACHE_FILE) as cache:
+        window_end = args.now + timedelta(hours=c.HOURS_AHEAD)
+        cache.replace("primary", [], None, args.now, window_end, time.time())
+    command_list(args)
+    output = capsys.readouterr().out.splitlines()[-1]
+
+    # Past what the payload is good for, the snapshot can still answer.
+    argv = ["-c", "list", "-f", "alfred", "-n", "2021-07-12T13:29:00+00:00"]
+    found = snapshot.snapshot_output(argv)
+    assert found is not None and found != output
+    assert '"next_meeting":"FoundNextMeeting"' in found
+    with snapshot.load(args) as loaded:
+        assert [loaded.event(i).id for i in range(len(loaded))] == [
+            single_raw_event["id"]
+        ]
@@ -0,0 +1,38 @@
+import subprocess
+import sys
+
+from next_meeting.args import Args
+from next_meeting.startup import command_startup, parse_importtime
+
+REPORT = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:        80 |        200 | json
+import time:      5000 |      90000 |   googleapiclient.discovery
+"""
+
+
+def test_parse_importtime():
+    times = parse_importtime(REPORT)
+    assert [t.module for t in times] == ["_io", "json", "googleapiclient.discovery"]
+    assert times[2].self_us == 5000
+    assert times[2].cumulative_us == 90000
+
+
+def test_command_startup(args: Args, capsys):
+    command_startup(args)
+    out = capsys.readouterr().out
+    assert "Importing next_meeting.main took" in out
+    assert "WARNING" not in out
+
+
+def test_cli_startup_skips_heavy_imports():
+    # Starting the CLI shouldn't import any of the slow libraries
+    code = (
+        "import sys, next_meeting.main; "
+        "print([m for m in ('googleapiclient', 'bs4') if m in sys.modules])"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,44 @@
+import threading
+
+import next_meeting.transport as transport
+from next_meeting.transport import HttpPool
+
+
+def test_pool_reuses_connections():
+    pool = HttpPool(max_size=2, timeout=1)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+        # Checked out, so a concurrent user gets its own
+        with pool.connection() as third:
+            assert third is not first
+
+
+def test_pool_bounded():
+    pool = HttpPool(max_size=1, timeout=1)
+    with pool.connection():
+        with pool.connection():
+            pass
+    # Only one was kept around, the other was closed
+    assert pool._idle.qsize() == 1
+    pool.close()
+    assert pool._idle.qsize() == 0
+
+
+def test_shared_transports(monkeypatch):
+    monkeypatch.setattr(transport, "_http_pool", None)
+    monkeypatch.setattr(transport, "_session", None)
+
+    pools = []
+    threads = [
+        threading.Thread(target=lambda: pools.append(transport.http_pool()))
+        for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(p is pools[0] for p in pools)
+
+    assert transport.auth_request().session is transport.auth_request().session